@@ -0,0 +1,98 @@
+"""
+Benchmark for the session codecs in src/core/codec.py.
+Compares encode/decode time and bytes per session for legacy JSON vs the compact
+binary codec (plain and compressed), on synthetic sessions of growing history size
+and, if present, on the real rows in data/sessions.db.
+
+Usage: python scripts/bench_codec.py [iterations]
+"""
+import os
+import sys
+import time
+import sqlite3
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from src.core import codec
+
+ITERATIONS = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+def make_session(history_len):
+    return {
+        "client_id": "clinica_teste",
+        "phone": "558199999999",
+        "status": "AGUARDANDO_HUMANO",
+        "data": {"plano": "CASSI", "pedido_descricao": "Hemograma completo e glicose"},
+        "history": [
+            {"timestamp": 1767225600.0 + i, "role": "user", "message": f"Mensagem número {i} do paciente", "intent": "ORCAMENTO" if i % 3 else None}
+            for i in range(history_len)
+        ],
+        "last_updated": 1767225600.0,
+        "interaction_count": 2,
+        "last_action": "ASK_ORDER",
+    }
+
+def variants():
+    return {
+        "json (legacy)": lambda s: codec.encode(s, codec="json"),
+        "compact": _compact,
+        "compact+zlib": lambda s: _forced(s, "zlib"),
+        "compact+zstd": lambda s: _forced(s, "zstd"),
+    }
+
+def _compact(session):
+    old = codec.SESSION_COMPRESSION
+    codec.SESSION_COMPRESSION = "none"
+    try:
+        return codec.encode(session, codec="binary")
+    finally:
+        codec.SESSION_COMPRESSION = old
+
+def _forced(session, compression):
+    old_c, old_min = codec.SESSION_COMPRESSION, codec.SESSION_COMPRESS_MIN_BYTES
+    codec.SESSION_COMPRESSION, codec.SESSION_COMPRESS_MIN_BYTES = compression, 0
+    try:
+        return codec.encode(session, codec="binary")
+    finally:
+        codec.SESSION_COMPRESSION, codec.SESSION_COMPRESS_MIN_BYTES = old_c, old_min
+
+def bench(label, sessions):
+    print(f"\n== {label} ({len(sessions)} sessions, {ITERATIONS} iterations) ==")
+    print(f"{'codec':<16}{'bytes/session':>15}{'encode us':>12}{'decode us':>12}")
+    for name, encode in variants().items():
+        if name == "compact+zstd" and codec.zstd is None:
+            print(f"{name:<16}{'(zstd not installed)':>39}")
+            continue
+        blobs = [encode(s) for s in sessions]
+        size = sum(len(b.encode("utf-8") if isinstance(b, str) else b) for b in blobs) / len(blobs)
+
+        start = time.perf_counter()
+        for _ in range(ITERATIONS):
+            for s in sessions:
+                encode(s)
+        enc_us = (time.perf_counter() - start) / (ITERATIONS * len(sessions)) * 1e6
+
+        start = time.perf_counter()
+        for _ in range(ITERATIONS):
+            for b in blobs:
+                codec.decode(b)
+        dec_us = (time.perf_counter() - start) / (ITERATIONS * len(sessions)) * 1e6
+        print(f"{name:<16}{size:>15.0f}{enc_us:>12.1f}{dec_us:>12.1f}")
+
+def real_sessions(path=os.path.join("data", "sessions.db")):
+    if not os.path.exists(path):
+        return []
+    conn = sqlite3.connect(path)
+    try:
+        return [codec.decode(row[0]) for row in conn.execute("SELECT data FROM sessions")]
+    except sqlite3.Error:
+        return []
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    for n in (0, 10, 100):
+        bench(f"synthetic, {n} history entries", [make_session(n)])
+    real = real_sessions()
+    if real:
+        bench("data/sessions.db", real)
@@ -6,17 +6,30 @@ import json
 import os
 import uuid
 import base64
+import tempfile
+import hashlib
+import hmac
+from starlette.concurrency import run_in_threadpool
 from src.core.triage import Triage
+from src.core.message import NormalizedMessage
 from src.core.transcriber import Transcriber
 from src.core.session import SessionManager
-from src.core.replier import Replier
+from src.core.replier import AsyncReplier
+from src.core.outbox import OutboxWorker
+from src.core.ingest import IngestQueue
+from src.core.dedup import DedupCache, message_id
+from src.config import OUTBOX_ENABLED, INGEST_ENABLED, DEDUP_ENABLED, RESULTS_IMPORT_TOKEN
+from src.core import database
+from src.core.importer import import_stream
 
 app = FastAPI(title="Anti-Gravity Sprint Hook")
 
 # Initialize cores
 triage_service = Triage()
 session_manager = SessionManager()
-replier_service = Replier()
+replier_service = AsyncReplier()
+outbox_worker = OutboxWorker(replier_service) if OUTBOX_ENABLED else None
+dedup_cache = DedupCache() if DEDUP_ENABLED else None
 
 # Transcriber might fail if FFmpeg is missing, handle gracefully?
 # For now, we instantiate on demand or let it fail at startup if model is None?
@@ -74,8 +87,50 @@ class SimpleWhatsappPayload(BaseModel):
     timestamp: Optional[Any] = None
     originalMessage: Optional[Dict[str, Any]] = None
 
+def reply_key(client_id: str, sender: str, inbound: Any, reply: str) -> Optional[str]:
+    """
+    Idempotency key of a reply to the inbound message `inbound` (its message id, else its
+    timestamp): the same inbound message redelivered queues its reply only once.
+    """
+    if inbound is None:
+        return None # Nothing identifies the inbound message: a fresh key per reply
+    digest = hashlib.sha1(reply.encode("utf-8")).hexdigest()[:16]
+    return f"{client_id}:{sender}:{inbound}:{digest}"
+
+async def send_reply(client_id: str, sender: str, reply: str, key: Optional[str]):
+    """Queues a reply in the outbox (retried until delivered), or sends it in the background."""
+    if outbox_worker:
+        await outbox_worker.enqueue(client_id, sender, reply, key)
+    else:
+        replier_service.send_text_nowait(client_id, sender, reply)
+
 @app.post("/webhook")
 async def whatsapp_webhook(payload: SimpleWhatsappPayload):
+    """
+    Acknowledges as soon as the payload is validated: the message is handled by the
+    ingest queue's workers. Answers 429 with Retry-After while the queue is full.
+    A redelivered message (same WhatsApp message key id) is dropped here, before triage.
+    """
+    msg_id = message_id(payload.originalMessage) if dedup_cache else None
+    if msg_id and await dedup_cache.check(payload.clientId, msg_id):
+        print(f"[IN/GW] [{payload.clientId}] Duplicate message {msg_id} from {payload.remoteJid} dropped")
+        return {"status": "duplicate"}
+    if not ingest_queue:
+        return await handle_message(payload)
+    if not await ingest_queue.submit(payload.clientId, payload.remoteJid, payload.model_dump()):
+        if msg_id:
+            dedup_cache.forget(payload.clientId, msg_id) # Not taken: its redelivery must get through
+        raise HTTPException(status_code=429, detail="Ingest queue full",
+                            headers={"Retry-After": str(ingest_queue.retry_after_s)})
+    return {"status": "queued"}
+
+async def handle_queued(item: Dict[str, Any]):
+    await handle_message(SimpleWhatsappPayload(**item))
+
+ingest_queue = IngestQueue(handle_queued) if INGEST_ENABLED else None
+
+async def handle_message(payload: SimpleWhatsappPayload) -> Dict[str, Any]:
+    """Triage, session update and reply for one gateway message."""
     print(f"[IN/GW] [{payload.clientId}] Msg from {payload.remoteJid}: {payload.text}")
     
     sender = payload.remoteJid
@@ -109,17 +164,19 @@ async def whatsapp_webhook(payload: SimpleWhatsappPayload):
 
     # 3. Triage
     # If fromMe, we don't need triage as we just want to update state
+    # Normalized once; triage and the state machine share it
+    normalized = NormalizedMessage(text_content)
     intent = None
     entities = {}
+    flow = session_manager.flows.get(client_id) # Resolved once: triage and the session share it
     if not payload.fromMe:
-        intent = triage_service.detect_intent(text_content)
-        entities = triage_service.extract_entities(text_content)
+        intent, entities = triage_service.analyze(normalized, fuzzy=flow.fuzzy)
         print(f"   [OUT] Intent: {intent} | Entities: {entities}")
     
     # 4. Update Session
     phone = sender.split("@")[0]
     
-    session_result = session_manager.update_session(
+    session_result = await session_manager.update_session_async(
         client_id=client_id,
         phone=phone,
         message=text_content,
@@ -127,7 +184,9 @@ async def whatsapp_webhook(payload: SimpleWhatsappPayload):
         entities=entities,
         contact_name=payload.contactName or payload.pushName, # Prefer Contact, then Push
         media_type=payload.mediaType,
-        from_me=payload.fromMe
+        from_me=payload.fromMe,
+        normalized=normalized,
+        flow=flow
     )
 
     if not session_result:
@@ -140,7 +199,9 @@ async def whatsapp_webhook(payload: SimpleWhatsappPayload):
     reply_msg = session_result.get("reply_message")
     if reply_msg:
         # Replier service needs to know WHICH client is sending
-        replier_service.send_text(client_id, sender, reply_msg)
+        # The response never waits for the gateway
+        inbound = message_id(payload.originalMessage) or payload.timestamp
+        await send_reply(client_id, sender, reply_msg, reply_key(client_id, sender, inbound, reply_msg))
 
     return {
         "status": "processed",
@@ -165,6 +226,7 @@ async def evolution_webhook(request: Request):
 
     # Adapting to variable payload structures
     event_type = payload.get("event")
+    client_id = payload.get("instance") or "default" # One Evolution instance per clinic
     print(f"   [EVENT] {event_type}")
 
     if event_type != "messages.upsert":
@@ -275,8 +337,9 @@ async def evolution_webhook(request: Request):
 
     if text_content:
         # 3. Triage
-        intent = triage_service.detect_intent(text_content)
-        entities = triage_service.extract_entities(text_content)
+        normalized = NormalizedMessage(text_content)
+        flow = session_manager.flows.get(client_id)
+        intent, entities = triage_service.analyze(normalized, fuzzy=flow.fuzzy)
         
         print(f"   [OUT] Intent: {intent} | Entities: {entities}")
         
@@ -284,11 +347,15 @@ async def evolution_webhook(request: Request):
         # Use sender (remoteJid) as phone identifier for now.
         phone = sender.split("@")[0]
         
-        session_result = session_manager.update_session(
+        session_result = await session_manager.update_session_async(
+            client_id=client_id,
             phone=phone,
             message=text_content,
             intent=intent,
-            entities=entities
+            entities=entities,
+            contact_name=data.get("pushName"),
+            normalized=normalized,
+            flow=flow
         )
         
         if not session_result:
@@ -300,7 +367,7 @@ async def evolution_webhook(request: Request):
         # 5. Auto-Reply
         reply_msg = session_result.get("reply_message")
         if reply_msg:
-            replier_service.send_text(sender, reply_msg)
+            await send_reply(client_id, sender, reply_msg, reply_key(client_id, sender, message_id(data), reply_msg))
     
     return {
         "status": "processed",
@@ -309,6 +376,59 @@ async def evolution_webhook(request: Request):
         "session": "updated"
     }
 
+@app.post("/results/import")
+async def import_results(request: Request, format: str = "csv", clientId: Optional[str] = None):
+    """
+    Bulk-loads an LIS export (CSV or NDJSON body) into the results store.
+    Requires the X-Import-Token header to match RESULTS_IMPORT_TOKEN (the route is
+    off while that is unset): imported results are later sent to patients by phone.
+    The body is spooled to disk as it arrives and imported in a worker thread,
+    so memory stays flat and the event loop keeps serving /webhook meanwhile.
+    """
+    token = request.headers.get("X-Import-Token", "")
+    if not RESULTS_IMPORT_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not hmac.compare_digest(token.encode("utf-8"), RESULTS_IMPORT_TOKEN.encode("utf-8")):
+        raise HTTPException(status_code=401, detail="invalid or missing X-Import-Token")
+    if format not in ("csv", "ndjson"):
+        raise HTTPException(status_code=400, detail="format must be csv or ndjson")
+    spool = await run_in_threadpool(tempfile.TemporaryFile)
+    try:
+        async for chunk in request.stream():
+            await run_in_threadpool(spool.write, chunk)
+        await run_in_threadpool(spool.seek, 0)
+        report = await run_in_threadpool(import_stream, session_manager.results, spool, format,
+                                         client_id=clientId, source=f"import:{format}")
+    finally:
+        await run_in_threadpool(spool.close)
+    print(f"[IMPORT] {report}")
+    return report
+
+@app.on_event("startup")
+async def startup():
+    if dedup_cache:
+        await dedup_cache.load()
+    if outbox_worker:
+        outbox_worker.start()
+    if ingest_queue:
+        await ingest_queue.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    if ingest_queue: # First: handling the queued messages still queues replies
+        await ingest_queue.stop()
+    if outbox_worker:
+        await outbox_worker.stop()
+    await replier_service.aclose()
+    if dedup_cache:
+        await dedup_cache.close()
+    session_manager.close()
+    database.close_connections()
+
 @app.get("/health")
 def health_check():
-    return {"status": "ok", "ffmpeg": "unknown (check logs)"}
+    return {"status": "ok", "ffmpeg": "unknown (check logs)", "session_cache": session_manager.cache.stats(),
+            "timeout_sweeper": session_manager.sweeper.last_report if session_manager.sweeper else None,
+            "replier": replier_service.stats, "circuits": replier_service.circuits(), "outbox": outbox_worker.health() if outbox_worker else None,
+            "ingest": ingest_queue.health() if ingest_queue else None,
+            "dedup": dedup_cache.stats() if dedup_cache else None}
@@ -16,3 +16,107 @@ raw_ignored = os.getenv("IGNORED_NUMBERS", "558799497007")
 IGNORED_NUMBERS = [n.strip() for n in raw_ignored.split(",") if n.strip()]
 
 TEST_PREFIX = "#teste"
+
+# SQLite tuning
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", 5000))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", 128))
+
+# Write-behind persistence (SessionManager): batch session writes into group commits
+SESSION_WRITE_BEHIND = os.getenv("SESSION_WRITE_BEHIND", "false").lower() in ("1", "true", "yes")
+WRITE_BEHIND_FLUSH_MS = int(os.getenv("WRITE_BEHIND_FLUSH_MS", 200)) # Max loss window on a hard crash
+WRITE_BEHIND_MAX_BATCH = int(os.getenv("WRITE_BEHIND_MAX_BATCH", 50))
+
+# Retention (background job, see src/core/retention.py)
+RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", 120)) # 4 months
+# Per-tenant overrides, e.g. "clinica_a:90,clinica_b:30"
+raw_retention = os.getenv("RETENTION_DAYS_BY_CLIENT", "")
+RETENTION_DAYS_BY_CLIENT = {
+    client.strip(): int(days) for client, days in
+    (item.split(":", 1) for item in raw_retention.split(",") if ":" in item)
+}
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", 500))
+RETENTION_INTERVAL_S = int(os.getenv("RETENTION_INTERVAL_S", 6 * 3600))
+RETENTION_START_DELAY_S = int(os.getenv("RETENTION_START_DELAY_S", 60)) # Keep it off the startup path
+
+# Async database access (FastAPI path): one writer thread, a few reader threads
+DB_READER_THREADS = int(os.getenv("DB_READER_THREADS", 4))
+
+# Session blob encoding (src/core/codec.py): "binary" (compact, versioned) or "json" (legacy text)
+SESSION_CODEC = os.getenv("SESSION_CODEC", "binary")
+SESSION_COMPRESSION = os.getenv("SESSION_COMPRESSION", "zlib") # zlib, zstd or none
+SESSION_COMPRESS_MIN_BYTES = int(os.getenv("SESSION_COMPRESS_MIN_BYTES", 512))
+
+# Per-tenant sharding: one SQLite file per client_id under DB_SHARD_DIR
+DB_SHARD_MODE = os.getenv("DB_SHARD_MODE", "false").lower() in ("1", "true", "yes")
+DB_SHARD_DIR = os.getenv("DB_SHARD_DIR", os.path.join("data", "shards"))
+DB_SHARD_MAX_OPEN = int(os.getenv("DB_SHARD_MAX_OPEN", 16)) # Open shard handles kept per thread (LRU)
+
+# In-process session cache (SessionManager): LRU, entries expire after SESSION_TIMEOUT
+SESSION_CACHE_MAX_ENTRIES = int(os.getenv("SESSION_CACHE_MAX_ENTRIES", 5000)) # ~1-2KB each; 0 disables
+
+# Conversation flows (src/core/flow.py): optional per-tenant overrides as <client_id>.json
+FLOWS_DIR = os.getenv("FLOWS_DIR", os.path.join("data", "flows"))
+FLOW_CHECK_INTERVAL_S = float(os.getenv("FLOW_CHECK_INTERVAL_S", 5)) # how often a tenant's file is stat()ed for changes
+
+# Session timeouts (lazy check in SessionManager + background sweeper, see src/core/sweeper.py)
+SESSION_TIMEOUT = int(os.getenv("SESSION_TIMEOUT", 900)) # 15 minutes for automated flows
+HUMAN_SESSION_TIMEOUT = int(os.getenv("HUMAN_SESSION_TIMEOUT", 7200)) # 2 hours for human mode
+SESSION_SWEEPER = os.getenv("SESSION_SWEEPER", "true").lower() in ("1", "true", "yes")
+SESSION_SWEEP_INTERVAL_S = float(os.getenv("SESSION_SWEEP_INTERVAL_S", 30))
+SESSION_SWEEP_BATCH_SIZE = int(os.getenv("SESSION_SWEEP_BATCH_SIZE", 200))
+
+# Concurrency: per-conversation lock stripes, retries when another writer saved the session first
+SESSION_LOCK_STRIPES = int(os.getenv("SESSION_LOCK_STRIPES", 256))
+SESSION_SAVE_RETRIES = int(os.getenv("SESSION_SAVE_RETRIES", 3))
+
+# Exam results store (src/core/results.py)
+RESULTS_DB_PATH = os.getenv("RESULTS_DB_PATH", os.path.join("data", "results.db"))
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", 1000)) # rows per transaction in src/core/importer.py
+RESULTS_IMPORT_TOKEN = os.getenv("RESULTS_IMPORT_TOKEN", "") # X-Import-Token of POST /results/import; empty disables the route
+
+# Typo-tolerant triage (src/core/fuzzy.py); tenants can override in data/flows/<client_id>.json
+FUZZY_MATCHING = os.getenv("FUZZY_MATCHING", "true").lower() in ("1", "true", "yes")
+FUZZY_MIN_LENGTH = int(os.getenv("FUZZY_MIN_LENGTH", 5))
+FUZZY_MAX_DISTANCE = int(os.getenv("FUZZY_MAX_DISTANCE", 1))
+FUZZY_LONG_LENGTH = int(os.getenv("FUZZY_LONG_LENGTH", 8))
+FUZZY_LONG_MAX_DISTANCE = int(os.getenv("FUZZY_LONG_MAX_DISTANCE", 2))
+# Real words never fuzzy-matched ("calor" is not "valor"); extend it with src/scripts/build_vocabulary.py
+FUZZY_VOCABULARY_PATH = os.getenv("FUZZY_VOCABULARY_PATH", os.path.join("data", "vocabulary.txt"))
+
+# Optional intent classifier (src/core/classifier.py, needs numpy): used when no keyword matched
+CLASSIFIER_MODEL_PATH = os.getenv("CLASSIFIER_MODEL_PATH", os.path.join("data", "intent_model.npz"))
+CLASSIFIER_THRESHOLD = float(os.getenv("CLASSIFIER_THRESHOLD", 0.8)) # min probability to trust a prediction
+CLASSIFIER_FEATURE_BITS = int(os.getenv("CLASSIFIER_FEATURE_BITS", 16)) # 2**bits hashed features
+
+# Outbound replies through the local Node gateway (src/core/replier.py)
+GATEWAY_URL = os.getenv("GATEWAY_URL", "http://localhost:3000")
+REPLY_TIMEOUT_S = float(os.getenv("REPLY_TIMEOUT_S", 20))
+REPLY_MAX_CONNECTIONS = int(os.getenv("REPLY_MAX_CONNECTIONS", 20)) # keep-alive pool to the gateway
+REPLY_CONCURRENCY_PER_CLIENT = int(os.getenv("REPLY_CONCURRENCY_PER_CLIENT", 4)) # in-flight sends per tenant
+
+# Durable outbox for replies (src/core/outbox.py)
+OUTBOX_ENABLED = os.getenv("OUTBOX_ENABLED", "true").lower() in ("1", "true", "yes")
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", 50)) # replies claimed per drain
+OUTBOX_POLL_INTERVAL_S = float(os.getenv("OUTBOX_POLL_INTERVAL_S", 1.0))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", 8)) # then dead-lettered
+OUTBOX_BACKOFF_BASE_S = float(os.getenv("OUTBOX_BACKOFF_BASE_S", 2.0))
+OUTBOX_BACKOFF_MAX_S = float(os.getenv("OUTBOX_BACKOFF_MAX_S", 300.0))
+OUTBOX_KEEP_SENT_S = int(os.getenv("OUTBOX_KEEP_SENT_S", 24 * 3600))
+
+# Per-tenant circuit breaker in front of the gateway (src/core/breaker.py)
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", 5)) # consecutive failures before opening
+BREAKER_RESET_TIMEOUT_S = float(os.getenv("BREAKER_RESET_TIMEOUT_S", 30)) # open time before a probe
+
+# Inbound queue between /webhook and the message pipeline (src/core/ingest.py)
+INGEST_ENABLED = os.getenv("INGEST_ENABLED", "true").lower() in ("1", "true", "yes")
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", 8)) # conversations handled in parallel
+INGEST_MAX_DEPTH = int(os.getenv("INGEST_MAX_DEPTH", 1000)) # waiting messages before /webhook answers 429
+INGEST_PERSIST = os.getenv("INGEST_PERSIST", "false").lower() in ("1", "true", "yes") # inbox table survives restarts
+INGEST_RETRY_AFTER_S = int(os.getenv("INGEST_RETRY_AFTER_S", 2)) # Retry-After of a 429
+INGEST_DRAIN_TIMEOUT_S = float(os.getenv("INGEST_DRAIN_TIMEOUT_S", 10.0)) # shutdown wait for queued messages
+
+# Drops gateway redeliveries of a message already received (src/core/dedup.py)
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "true").lower() in ("1", "true", "yes")
+DEDUP_TTL_S = float(os.getenv("DEDUP_TTL_S", 6 * 3600)) # how long a message id is remembered
+DEDUP_MAX_ENTRIES = int(os.getenv("DEDUP_MAX_ENTRIES", 50000)) # in-memory ids (LRU beyond that)
+DEDUP_SPILL = os.getenv("DEDUP_SPILL", "false").lower() in ("1", "true", "yes") # evicted ids go to SQLite
@@ -0,0 +1,72 @@
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from src.config import BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_TIMEOUT_S
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+class CircuitBreaker:
+    """
+    Stops calling a dependency that keeps failing, so callers fail in microseconds
+    instead of each waiting out a timeout.
+    - closed: calls go through; failure_threshold failures in a row open the circuit.
+    - open: calls are refused until reset_timeout_s has passed.
+    - half_open: one probe call goes through; its success closes the circuit, its
+      failure opens it for another reset_timeout_s.
+    """
+
+    def __init__(self, name: str = "", failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 reset_timeout_s: float = BREAKER_RESET_TIMEOUT_S, clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout_s = reset_timeout_s
+        self.clock = clock
+        self.state = CLOSED
+        self.failures = 0
+        self.rejected = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def _ready_to_probe(self) -> bool:
+        return self.state == OPEN and self.clock() - self._opened_at >= self.reset_timeout_s
+
+    def available(self) -> bool:
+        """Whether allow() would let a call through now (without claiming the probe)."""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            return (self._ready_to_probe() or self.state == HALF_OPEN) and not self._probing
+
+    def allow(self) -> bool:
+        """Claims a call. In half_open only one call (the probe) is let through at a time."""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self._ready_to_probe():
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state, self.failures, self._probing = CLOSED, 0, False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    print(f"[BREAKER] [{self.name}] Circuit opened after {self.failures} failures.")
+                self.state, self._opened_at, self._probing = OPEN, self.clock(), False
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            retry_in: Optional[float] = None
+            if self.state == OPEN:
+                retry_in = round(max(0.0, self._opened_at + self.reset_timeout_s - self.clock()), 1)
+            return {"state": self.state, "failures": self.failures, "rejected": self.rejected, "retry_in_s": retry_in}
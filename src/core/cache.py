@@ -0,0 +1,83 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+class SessionCache:
+    """
+    Bounded LRU of decoded sessions, keyed by (client_id, phone).
+
+    Entries carry the row version they were loaded/saved at; a lookup only hits if the
+    caller's current version (database.get_session_version) still matches, so writes made
+    elsewhere (e.g. the dashboard process) are never served stale. Entries older than
+    `ttl_s` are dropped: by then the conversation has timed out and gets reset anyway.
+    """
+
+    def __init__(self, max_entries: int = 5000, ttl_s: float = 900):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.expired = 0
+        self.evictions = 0
+
+    def get(self, client_id: str, phone: str, version: Optional[int]) -> Optional[dict]:
+        """Returns a private copy of the cached session if it is still at `version`."""
+        key = (client_id, phone)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            stored_at, session = entry
+            if session.get("version") != version:
+                self.stale += 1
+            elif time.time() - stored_at > self.ttl_s:
+                self.expired += 1
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return copy.deepcopy(session)
+            del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, client_id: str, phone: str, session: dict):
+        """Caches a snapshot of a session that matches what is stored in the database."""
+        if self.max_entries <= 0:
+            return
+        # History entries are already in the messages table; a loaded session starts with none
+        snapshot = copy.deepcopy({k: v for k, v in session.items() if k != "history"})
+        snapshot["history"] = []
+        key = (client_id, phone)
+        with self._lock:
+            self._entries[key] = (time.time(), snapshot)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, client_id: str, phone: str):
+        with self._lock:
+            self._entries.pop((client_id, phone), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "expired": self.expired,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
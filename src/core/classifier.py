@@ -0,0 +1,150 @@
+import os
+import zlib
+from functools import lru_cache
+from typing import Iterable, List, Optional, Sequence, Tuple, Union
+
+try:
+    import numpy as np
+except ImportError: # Optional dependency: pip install .[ml]
+    np = None
+
+from src.config import CLASSIFIER_FEATURE_BITS
+from src.core.message import NormalizedMessage, normalize_text
+
+NO_INTENT = "NONE" # Label of messages with no intent
+
+def _crc(text: str) -> int:
+    # Stable across processes (unlike hash()), so a saved model keeps its meaning
+    return zlib.crc32(text.encode("utf-8"))
+
+@lru_cache(maxsize=65536)
+def _word_features(word: str, n_features: int) -> Tuple[int, ...]:
+    # Chat vocabulary repeats a lot, so each word is hashed once
+    padded = f"<{word}>"
+    return (_crc("w:" + word) % n_features,) + tuple(_crc("c:" + padded[i:i + 3]) % n_features
+                                                     for i in range(len(padded) - 2))
+
+def features(normalized_text: str, n_features: int) -> List[int]:
+    """
+    Hashed feature ids of a normalized text: words, word bigrams and character
+    trigrams of each word (so "resultadu" still shares most features with "resultado").
+    """
+    words = normalized_text.split(" ") if normalized_text else []
+    ids = [_crc("b:" + a + " " + b) % n_features for a, b in zip(words, words[1:])]
+    for word in words:
+        ids.extend(_word_features(word, n_features))
+    return ids
+
+class IntentClassifier:
+    """
+    Multinomial logistic regression over hashed n-gram features. The model is one
+    (n_features x n_labels) float32 matrix (2**16 x 6 is 1.5 MB) plus a bias, and
+    scoring a message is a gather and a sum over its few dozen feature rows.
+    Requires numpy; see src/scripts/train_intent_classifier.py to build one.
+
+    Triage only asks it about messages the keywords missed, so it is only as useful
+    as its human-labeled training messages: trained on the intents the keyword rules
+    logged, it learns those rules and answers NONE for exactly those messages.
+    """
+
+    def __init__(self, labels: Sequence[str], n_features: int = 1 << CLASSIFIER_FEATURE_BITS,
+                 weights=None, bias=None):
+        if np is None:
+            raise RuntimeError("the intent classifier needs numpy (pip install .[ml])")
+        self.labels = list(labels)
+        self.n_features = n_features
+        self.weights = weights if weights is not None else np.zeros((n_features, len(self.labels)), dtype=np.float32)
+        self.bias = bias if bias is not None else np.zeros(len(self.labels), dtype=np.float32)
+
+    # --- Features ---
+
+    def _vectorize(self, texts: Iterable[Union[str, NormalizedMessage]]):
+        """CSR-style (ids, offsets) for a batch: message i owns ids[offsets[i]:offsets[i + 1]]."""
+        ids: List[int] = []
+        offsets = [0]
+        for text in texts:
+            normalized = text.normalized if isinstance(text, NormalizedMessage) else normalize_text(text)
+            ids += features(normalized, self.n_features)
+            offsets.append(len(ids))
+        return np.asarray(ids, dtype=np.int64), np.asarray(offsets, dtype=np.int64)
+
+    def _scores(self, ids, offsets):
+        scores = np.zeros((len(offsets) - 1, len(self.labels)), dtype=np.float32)
+        filled = offsets[1:] > offsets[:-1] # reduceat needs non-empty segments
+        if ids.size:
+            scores[filled] = np.add.reduceat(self.weights[ids], offsets[:-1][filled], axis=0)
+        return scores + self.bias
+
+    @staticmethod
+    def _softmax(scores):
+        scores = scores - scores.max(axis=1, keepdims=True)
+        exp = np.exp(scores)
+        return exp / exp.sum(axis=1, keepdims=True)
+
+    # --- Inference ---
+
+    def predict(self, texts: Sequence[Union[str, NormalizedMessage]]) -> List[Tuple[Optional[str], float]]:
+        """(intent or None, probability) per text, scored as one batch (e.g. a replay of the messages table)."""
+        if not texts:
+            return []
+        probs = self._softmax(self._scores(*self._vectorize(texts)))
+        best = probs.argmax(axis=1)
+        return [(None if self.labels[i] == NO_INTENT else self.labels[i], float(probs[row, i]))
+                for row, i in enumerate(best)]
+
+    def predict_one(self, text: Union[str, NormalizedMessage]) -> Tuple[Optional[str], float]:
+        return self.predict([text])[0]
+
+    # --- Training ---
+
+    def fit(self, texts: Sequence[Union[str, NormalizedMessage]], labels: Sequence[str], epochs: int = 10,
+            batch_size: int = 256, learning_rate: float = 0.5, l2: float = 1e-5, seed: int = 0) -> "IntentClassifier":
+        """Mini-batch SGD on the cross-entropy. Features are hashed once up front."""
+        index = {label: i for i, label in enumerate(self.labels)}
+        targets = np.asarray([index[label] for label in labels], dtype=np.int64)
+        ids, offsets = self._vectorize(texts)
+        rng = np.random.default_rng(seed)
+        for _ in range(epochs):
+            order = rng.permutation(len(targets))
+            for start in range(0, len(order), batch_size):
+                batch = order[start:start + batch_size]
+                # Gather the batch's slice of the CSR arrays
+                lengths = offsets[batch + 1] - offsets[batch]
+                batch_ids = np.concatenate([ids[offsets[i]:offsets[i + 1]] for i in batch])
+                batch_offsets = np.concatenate(([0], np.cumsum(lengths)))
+                grad = self._softmax(self._scores(batch_ids, batch_offsets))
+                grad[np.arange(len(batch)), targets[batch]] -= 1.0
+                grad /= len(batch)
+                # Sparse update: only the rows of features present in the batch move
+                rows = np.repeat(np.arange(len(batch)), lengths)
+                np.subtract.at(self.weights, batch_ids, learning_rate * grad[rows])
+                self.bias -= learning_rate * grad.sum(axis=0)
+            if l2:
+                self.weights *= (1.0 - learning_rate * l2)
+        return self
+
+    # --- Storage ---
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "wb") as f:
+            np.savez_compressed(f, weights=self.weights, bias=self.bias, labels=np.asarray(self.labels),
+                                n_features=np.asarray(self.n_features))
+
+    @classmethod
+    def load(cls, path: str) -> "IntentClassifier":
+        if np is None:
+            raise RuntimeError("the intent classifier needs numpy (pip install .[ml])")
+        with np.load(path) as data:
+            return cls([str(label) for label in data["labels"]], int(data["n_features"]),
+                       data["weights"].astype(np.float32), data["bias"].astype(np.float32))
+
+def load_classifier(path: str) -> Optional[IntentClassifier]:
+    """The saved model, or None if numpy is missing or there is no (readable) model file."""
+    if np is None or not os.path.exists(path):
+        return None
+    try:
+        return IntentClassifier.load(path)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"[TRIAGE] Could not load intent classifier {path}: {e}")
+        return None
@@ -0,0 +1,93 @@
+import json
+import zlib
+from typing import Dict, Union
+
+try:
+    from compression import zstd # Python 3.14+
+except ImportError:
+    try:
+        import zstandard as zstd
+    except ImportError:
+        zstd = None
+
+from src.config import SESSION_CODEC, SESSION_COMPRESSION, SESSION_COMPRESS_MIN_BYTES
+
+# Stored session blobs are self-describing, so every version stays readable:
+#   TEXT  -> legacy JSON (json.dumps(..., ensure_ascii=False)), as written before codecs
+#   BLOB  -> 1 header byte with the codec id, then the payload
+CODEC_COMPACT = 0x01 # Compact JSON (no whitespace, short keys), UTF-8
+CODEC_ZLIB = 0x02    # CODEC_COMPACT payload, zlib-compressed
+CODEC_ZSTD = 0x03    # CODEC_COMPACT payload, zstd-compressed
+
+# Keys repeated in every session / history entry get one-letter aliases.
+# Only top-level session keys and history entries are aliased, never the free-form "data" dict.
+KEY_ALIASES = {
+    "client_id": "c",
+    "phone": "p",
+    "status": "s",
+    "data": "d",
+    "history": "h",
+    "last_updated": "u",
+    "interaction_count": "n",
+    "last_action": "a",
+    "timestamp": "t",
+    "role": "r",
+    "message": "m",
+    "intent": "i",
+}
+KEY_NAMES = {alias: key for key, alias in KEY_ALIASES.items()}
+
+def _rename(obj: Dict, names: Dict[str, str]) -> Dict:
+    out = {names.get(k, k): v for k, v in obj.items()}
+    history = out.get(names.get("history", "history"))
+    if isinstance(history, list):
+        out[names.get("history", "history")] = [
+            {names.get(k, k): v for k, v in entry.items()} if isinstance(entry, dict) else entry
+            for entry in history
+        ]
+    return out
+
+def _compress(payload: bytes):
+    """Returns (codec_id, body), compressing only when it pays off."""
+    if len(payload) >= SESSION_COMPRESS_MIN_BYTES:
+        if SESSION_COMPRESSION == "zstd" and zstd is not None:
+            body = zstd.compress(payload)
+            if len(body) < len(payload):
+                return CODEC_ZSTD, body
+        elif SESSION_COMPRESSION in ("zlib", "zstd"): # zstd requested but unavailable -> zlib
+            body = zlib.compress(payload, 6)
+            if len(body) < len(payload):
+                return CODEC_ZLIB, body
+    return CODEC_COMPACT, payload
+
+def encode(session: Dict, codec: str = SESSION_CODEC) -> Union[str, bytes]:
+    """Encodes a session for storage. codec="json" writes legacy JSON text."""
+    if codec == "json":
+        return json.dumps(session, ensure_ascii=False)
+    payload = json.dumps(_rename(session, KEY_ALIASES), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    codec_id, body = _compress(payload)
+    return bytes((codec_id,)) + body
+
+def decode(raw: Union[str, bytes]) -> Dict:
+    """Decodes any stored version. Raises ValueError on corrupt or unknown data."""
+    if isinstance(raw, str):
+        return json.loads(raw)
+
+    if not raw:
+        raise ValueError("empty session blob")
+    codec_id, body = raw[0], bytes(raw[1:])
+    if codec_id == CODEC_ZLIB:
+        body = _decompress(zlib.decompress, body)
+    elif codec_id == CODEC_ZSTD:
+        if zstd is None:
+            raise ValueError("session is zstd-compressed but no zstd module is available")
+        body = _decompress(zstd.decompress, body)
+    elif codec_id != CODEC_COMPACT:
+        raise ValueError(f"unknown session codec {codec_id:#x}")
+    return _rename(json.loads(body), KEY_NAMES)
+
+def _decompress(fn, body: bytes) -> bytes:
+    try:
+        return fn(body)
+    except Exception as e: # zlib.error / zstd errors
+        raise ValueError(f"corrupt session blob: {e}") from e
@@ -1,29 +1,158 @@
 import sqlite3
-import json
 import os
+import json
 import time
-from typing import Dict, Optional
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+from urllib.parse import quote, unquote
+
+from src.core import codec
+from src.config import (DB_BUSY_TIMEOUT_MS, DB_STATEMENT_CACHE_SIZE, DB_READER_THREADS,
+                        DB_SHARD_MODE, DB_SHARD_DIR, DB_SHARD_MAX_OPEN,
+                        SESSION_TIMEOUT, HUMAN_SESSION_TIMEOUT)
 
 DB_PATH = os.path.join("data", "sessions.db")
 
-def get_connection():
-    """Returns a connection to the SQLite database."""
-    # Ensure data dir exists
-    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-    conn = sqlite3.connect(DB_PATH)
+# Shard mode: each client_id's sessions/messages live in their own file, so a busy
+# clinic's writes never take the write lock the other clinics need.
+SHARD_MODE = DB_SHARD_MODE
+SHARD_DIR = DB_SHARD_DIR
+
+# One connection per thread, reused across calls. sqlite3 keeps a per-connection
+# cache of prepared statements, so reusing the connection also reuses them.
+_local = threading.local()
+_open_connections = set()
+_open_lock = threading.Lock()
+_generation = 0 # Bumped by close_connections() so other threads reconnect
+
+def _connect(path: str) -> sqlite3.Connection:
+    """Opens a tuned connection (WAL, synchronous=NORMAL, busy_timeout)."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    is_new = not os.path.exists(path) or os.path.getsize(path) == 0
+    conn = sqlite3.connect(
+        path,
+        timeout=DB_BUSY_TIMEOUT_MS / 1000,
+        cached_statements=DB_STATEMENT_CACHE_SIZE,
+        check_same_thread=False, # Only used by its owner thread; close_connections() may run elsewhere
+    )
     conn.row_factory = sqlite3.Row
+    if is_new:
+        # New databases reclaim space with PRAGMA incremental_vacuum instead of a blocking VACUUM.
+        # Must be set before the header is written; existing files: see enable_incremental_vacuum.
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    # WAL lets the dashboard read while the webhook writes
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
     return conn
 
+def get_connection(client_id: Optional[str] = None):
+    """
+    Returns the calling thread's pooled connection to the SQLite database.
+    In shard mode, a client_id routes to that clinic's own database file.
+    """
+    if SHARD_MODE and client_id is not None:
+        return _get_shard_connection(client_id)
+
+    conn = getattr(_local, "conn", None)
+    if conn is not None and _local.path == DB_PATH and _local.generation == _generation:
+        return conn
+
+    if conn is not None:
+        # DB_PATH changed (tests / tools) or pool was closed: drop the stale handle
+        _discard(conn)
+
+    conn = _connect(DB_PATH)
+    _local.conn = conn
+    _local.path = DB_PATH
+    _local.generation = _generation
+    with _open_lock:
+        _open_connections.add(conn)
+    return conn
+
+def shard_path(client_id: str) -> str:
+    """File holding one client's data. quote() keeps the name filesystem-safe and reversible."""
+    return os.path.join(SHARD_DIR, quote(client_id, safe="") + ".db")
+
+def _get_shard_connection(client_id: str) -> sqlite3.Connection:
+    # Per-thread LRU of open shard handles, bounded by DB_SHARD_MAX_OPEN
+    shards = getattr(_local, "shards", None)
+    if shards is None or _local.shards_generation != _generation:
+        shards = _local.shards = OrderedDict()
+        _local.shards_generation = _generation
+
+    path = shard_path(client_id)
+    conn = shards.get(path)
+    if conn is not None:
+        shards.move_to_end(path)
+        return conn
+
+    # Opened lazily; schema setup is idempotent and only runs when a handle is (re)opened
+    conn = _connect(path)
+    _init_schema(conn)
+    with _open_lock:
+        _open_connections.add(conn)
+    shards[path] = conn
+    if len(shards) > DB_SHARD_MAX_OPEN:
+        _, oldest = shards.popitem(last=False)
+        _discard(oldest)
+    return conn
+
+def _shard_client_ids() -> List[str]:
+    if not os.path.isdir(SHARD_DIR):
+        return []
+    return sorted(unquote(name[:-3]) for name in os.listdir(SHARD_DIR) if name.endswith(".db"))
+
+def _connections_for(client_id: Optional[str] = None) -> Iterator[sqlite3.Connection]:
+    """
+    Connections that may hold client_id's rows: the main database, its shard, or every
+    shard when client_id is None. A generator, so at most one extra shard is open at a time.
+    """
+    if not SHARD_MODE:
+        yield get_connection()
+    elif client_id is not None:
+        yield get_connection(client_id)
+    else:
+        for shard_client in _shard_client_ids():
+            yield get_connection(shard_client)
+
+def _discard(conn: sqlite3.Connection):
+    with _open_lock:
+        _open_connections.discard(conn)
+    try:
+        conn.close()
+    except sqlite3.Error:
+        pass
+
+def close_connections():
+    """Closes every pooled connection (call on shutdown)."""
+    global _generation
+    with _open_lock:
+        _generation += 1
+        conns = list(_open_connections)
+        _open_connections.clear()
+    for conn in conns:
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
 def init_db():
-    """Initializes the database schema."""
-    conn = get_connection()
+    """Initializes the database schema (shards are initialized when first opened)."""
+    _init_schema(get_connection())
+
+def _init_schema(conn: sqlite3.Connection):
     cursor = conn.cursor()
     
     # Check if table needs migration (adding client_id)
     cursor.execute("PRAGMA table_info(sessions)")
     columns = [row[1] for row in cursor.fetchall()]
     
-    if "client_id" not in columns:
+    if columns and "client_id" not in columns:
         print("[DB] Migrating database to multitenant schema...")
         # Backup old data if needed, but since it's a POC and schema changes PK, 
         # it's safer to recreate or alter. Recreating is cleaner for POC.
@@ -52,105 +181,699 @@ def init_db():
             )
         ''')
     
+    # Queue fields promoted out of the JSON blob so the dashboard can filter/count on an index
+    cursor.execute("PRAGMA table_info(sessions)")
+    columns = [row[1] for row in cursor.fetchall()]
+    missing = [(name, decl) for name, decl in _INDEXED_COLUMNS if name not in columns]
+    for name, decl in missing:
+        cursor.execute(f"ALTER TABLE sessions ADD COLUMN {name} {decl}")
+    if missing and cursor.execute("SELECT 1 FROM sessions LIMIT 1").fetchone():
+        print(f"[DB] Backfilling indexed columns: {', '.join(name for name, _ in missing)}")
+        cursor.execute('''
+            UPDATE sessions SET
+                status = json_extract(data, '$.status'),
+                last_updated = json_extract(data, '$.last_updated'),
+                interaction_count = json_extract(data, '$.interaction_count'),
+                waiting_since = CASE WHEN json_extract(data, '$.status') = 'AGUARDANDO_HUMANO'
+                                     THEN json_extract(data, '$.last_updated') END
+            WHERE json_valid(data)
+        ''')
+    # Bumped on every save, so caches can tell with a primary-key lookup that a row changed under them
+    if "version" not in columns:
+        cursor.execute("ALTER TABLE sessions ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+    # Deadline of the session's inactivity timeout, for the background sweeper
+    if "expires_at" not in columns:
+        cursor.execute("ALTER TABLE sessions ADD COLUMN expires_at REAL")
+        cursor.execute(f'''
+            UPDATE sessions SET expires_at = last_updated + CASE WHEN status = 'AGUARDANDO_HUMANO'
+                                                                 THEN {float(HUMAN_SESSION_TIMEOUT)} ELSE {float(SESSION_TIMEOUT)} END
+            WHERE last_updated > 0 AND status IS NOT 'FINALIZADO'
+        ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions (client_id, expires_at) WHERE expires_at IS NOT NULL")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sessions_status ON sessions (client_id, status, last_updated)")
+    # Retention deletes walk these in small batches
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sessions_updated ON sessions (client_id, updated_at)")
+    
+    # Conversation history lives in its own append-only table, so saving a session
+    # no longer rewrites every past message. Tables created before it had a row id were
+    # keyed by (client_id, phone, ts), which dropped messages sharing a timestamp.
+    cursor.execute("PRAGMA table_info(messages)")
+    message_columns = [row[1] for row in cursor.fetchall()]
+    if message_columns and "id" not in message_columns:
+        print("[DB] Re-keying the messages table on a row id...")
+        cursor.execute("DROP TABLE IF EXISTS messages_old")
+        cursor.execute("ALTER TABLE messages RENAME TO messages_old")
+        cursor.execute("DROP INDEX IF EXISTS idx_messages_ts")
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            client_id TEXT NOT NULL,
+            phone TEXT NOT NULL,
+            ts REAL NOT NULL,
+            role TEXT,
+            message TEXT,
+            intent TEXT,
+            entry_id TEXT
+        )
+    ''')
+    if message_columns and "id" not in message_columns:
+        cursor.execute('''
+            INSERT INTO messages (client_id, phone, ts, role, message, intent)
+            SELECT client_id, phone, ts, role, message, intent FROM messages_old ORDER BY client_id, phone, ts
+        ''')
+        cursor.execute("DROP TABLE messages_old")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_messages_conversation ON messages (client_id, phone, ts)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_messages_ts ON messages (client_id, ts)")
+    # History entries carry an id (see SessionManager): saving one again is a no-op
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_messages_entry ON messages (client_id, phone, entry_id)
+        WHERE entry_id IS NOT NULL
+    ''')
+
+    # Outbound replies waiting for (or done with) delivery, see src/core/outbox.py.
+    # status: pending -> sent, or dead after too many failures
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            idempotency_key TEXT NOT NULL UNIQUE,
+            client_id TEXT NOT NULL,
+            recipient TEXT NOT NULL,
+            text TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            last_error TEXT
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (next_attempt_at) WHERE status = 'pending'")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_outbox_recipient ON outbox (client_id, recipient, id) WHERE status = 'pending'")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_outbox_done ON outbox (status, updated_at)")
+
+    # Inbound messages accepted by /webhook but not handled yet (INGEST_PERSIST), see src/core/ingest.py
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS inbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            client_id TEXT NOT NULL,
+            conversation TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            received_at REAL NOT NULL
+        )
+    ''')
+
+    # Message ids the dedup cache evicted from memory (DEDUP_SPILL), see src/core/dedup.py
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS seen_messages (
+            client_id TEXT NOT NULL,
+            message_id TEXT NOT NULL,
+            seen_at REAL NOT NULL,
+            PRIMARY KEY (client_id, message_id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_seen_messages_ts ON seen_messages (client_id, seen_at)")
+    
     conn.commit()
-    conn.close()
+
+_INDEXED_COLUMNS = [
+    ("status", "TEXT"),
+    ("last_updated", "REAL"),
+    ("waiting_since", "REAL"), # Set when the session enters AGUARDANDO_HUMANO
+    ("interaction_count", "INTEGER"),
+]
+
+def _decode_session(raw: Union[str, bytes]) -> Dict:
+    session = codec.decode(raw)
+    # Rows written before the messages table still carry their history inline;
+    # it is moved out on the next save. Otherwise "history" only holds new entries.
+    session.setdefault("history", [])
+    return session
 
 def get_session(client_id: str, phone: str) -> Optional[Dict]:
-    """Retrieves a session by client_id and phone number."""
-    conn = get_connection()
+    """Retrieves a session by client_id and phone number. session["version"] is the row version."""
+    conn = get_connection(client_id)
     cursor = conn.cursor()
     
-    cursor.execute("SELECT data FROM sessions WHERE client_id = ? AND phone = ?", (client_id, phone))
+    cursor.execute("SELECT data, version FROM sessions WHERE client_id = ? AND phone = ?", (client_id, phone))
     row = cursor.fetchone()
-    conn.close()
     
     if row:
         try:
-            return json.loads(row["data"])
-        except json.JSONDecodeError:
+            session = _decode_session(row["data"])
+        except ValueError: # Corrupt / unknown encoding
             return None
+        session["version"] = row["version"]
+        return session
     return None
 
+def get_session_version(client_id: str, phone: str) -> Optional[int]:
+    """Current row version of a session (None if it does not exist). Never decodes the blob."""
+    row = get_connection(client_id).execute(
+        "SELECT version FROM sessions WHERE client_id = ? AND phone = ?", (client_id, phone)
+    ).fetchone()
+    return row[0] if row else None
+
+# Session keys that are also columns: iter_sessions reads these without decoding the blob
+_SESSION_COLUMNS = ("client_id", "phone", "status", "last_updated", "waiting_since",
+                    "interaction_count", "updated_at", "version", "expires_at")
+
+def iter_sessions(client_id: Optional[str] = None, fields: Optional[Sequence[str]] = None,
+                  batch_size: int = 500) -> Iterator[Dict]:
+    """
+    Streams sessions (optionally for one client), fetching batch_size rows at a time,
+    so a scan uses constant memory however many sessions there are.
+    With `fields`, each session only carries those keys; if they are all columns
+    (see _SESSION_COLUMNS) the data blob is never read. Corrupt rows are skipped.
+    """
+    wanted = list(fields) if fields else None
+    decode = wanted is None or any(name not in _SESSION_COLUMNS for name in wanted)
+    # Full sessions look like get_session's (plus their keys); projections read the columns they name
+    columns = ["client_id", "phone"] + [name for name in _SESSION_COLUMNS[2:]
+                                        if (name == "version" if wanted is None else name in wanted)]
+    sql = f"SELECT {', '.join(columns)}{', data' if decode else ''} FROM sessions"
+    params: Tuple = ()
+    if client_id:
+        sql += " WHERE client_id = ?"
+        params = (client_id,)
+
+    for conn in _connections_for(client_id):
+        cursor = conn.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                if decode:
+                    try:
+                        session = _decode_session(row["data"])
+                    except ValueError:
+                        continue
+                else:
+                    session = {}
+                session.update((name, row[name]) for name in columns)
+                if wanted is not None:
+                    session = {name: session.get(name) for name in wanted}
+                yield session
+
 def get_all_sessions(client_id: Optional[str] = None) -> Dict[str, Dict]:
-    """Retrieves all active sessions, optionally filtered by client_id."""
+    """
+    Retrieves all active sessions, optionally filtered by client_id.
+    Each session's "history" holds only its latest message (see get_history for the rest).
+    Materializes everything: prefer iter_sessions for scans and exports.
+    """
+    last_messages = {}
+    for conn in _connections_for(client_id):
+        last_messages.update(_get_last_messages(conn, client_id))
+
+    sessions = {}
+    for s_data in iter_sessions(client_id):
+        last = last_messages.get((s_data["client_id"], s_data["phone"]))
+        if last:
+            s_data["history"] = [last]
+        sessions[s_data["phone"]] = s_data
+    return sessions
+
+def _get_last_messages(conn: sqlite3.Connection, client_id: Optional[str] = None) -> Dict[Tuple[str, str], Dict]:
+    """Latest message per conversation."""
+    where, params = ("WHERE client_id = ?", (client_id,)) if client_id else ("", ())
+    rows = conn.execute(_LAST_MESSAGES_SQL.format(where=where), params)
+    return {(row["client_id"], row["phone"]): _message_entry(row) for row in rows}
+
+def list_client_ids() -> List[str]:
+    """Distinct client_ids with at least one session (walks the primary key index; shard mode lists the shard files)."""
+    if SHARD_MODE:
+        return _shard_client_ids()
     conn = get_connection()
-    cursor = conn.cursor()
-    
-    if client_id:
-        cursor.execute("SELECT client_id, phone, data FROM sessions WHERE client_id = ?", (client_id,))
+    return [row[0] for row in conn.execute("SELECT DISTINCT client_id FROM sessions ORDER BY client_id")]
+
+def count_by_status(client_id: str) -> Dict[str, int]:
+    """Number of sessions per status for a client, answered from idx_sessions_status."""
+    conn = get_connection(client_id)
+    rows = conn.execute("SELECT status, COUNT(*) FROM sessions WHERE client_id = ? GROUP BY status", (client_id,))
+    return {row[0]: row[1] for row in rows}
+
+def list_sessions(client_id: str, status: Optional[Union[str, Sequence[str]]] = None,
+                  limit: int = 100, offset: int = 0,
+                  exclude_status: Optional[Sequence[str]] = None) -> List[Dict]:
+    """
+    Lists a client's sessions, most recently active first. Filtering and paging use
+    the indexed columns; only the returned page is JSON-decoded. Each session's
+    "history" holds its latest message, "waiting_since" comes from the column and
+    "version" is the row version (pass it as save_session's expected_version).
+    """
+    conn = get_connection(client_id)
+    where = ["client_id = ?"]
+    params: List = [client_id]
+    if status is not None:
+        statuses = [status] if isinstance(status, str) else list(status)
+        where.append(f"status IN ({','.join('?' * len(statuses))})")
+        params.extend(statuses)
+    if exclude_status:
+        where.append(f"status NOT IN ({','.join('?' * len(exclude_status))})")
+        params.extend(exclude_status)
+    params.extend([limit, offset])
+
+    rows = conn.execute(f'''
+        SELECT phone, data, waiting_since, version FROM sessions
+        WHERE {' AND '.join(where)}
+        ORDER BY last_updated DESC LIMIT ? OFFSET ?
+    ''', params).fetchall()
+    if not rows:
+        return []
+
+    phones = [row["phone"] for row in rows]
+    last_rows = conn.execute(_LAST_MESSAGES_SQL.format(
+        where=f"WHERE client_id = ? AND phone IN ({','.join('?' * len(phones))})"), [client_id, *phones])
+    last_messages = {row["phone"]: _message_entry(row) for row in last_rows}
+
+    sessions = []
+    for row in rows:
+        try:
+            s_data = _decode_session(row["data"])
+        except ValueError: # Corrupt / unknown encoding
+            continue
+        s_data["client_id"] = client_id
+        s_data["phone"] = row["phone"]
+        s_data["waiting_since"] = row["waiting_since"]
+        s_data["version"] = row["version"]
+        if row["phone"] in last_messages:
+            s_data["history"] = [last_messages[row["phone"]]]
+        sessions.append(s_data)
+    return sessions
+
+# Newest message of each conversation; the row id breaks timestamp ties (same order as get_history)
+_LAST_MESSAGES_SQL = '''
+    SELECT client_id, phone, ts, role, message, intent FROM (
+        SELECT client_id, phone, ts, role, message, intent,
+               ROW_NUMBER() OVER (PARTITION BY client_id, phone ORDER BY ts DESC, id DESC) AS newest
+        FROM messages {where}
+    ) WHERE newest = 1
+'''
+
+def _message_entry(row) -> Dict:
+    return {"timestamp": row["ts"], "role": row["role"], "message": row["message"], "intent": row["intent"]}
+
+def get_history(client_id: str, phone: str, limit: Optional[int] = None) -> List[Dict]:
+    """Returns a conversation's messages, oldest first (the last `limit` ones if given)."""
+    conn = get_connection(client_id)
+    if limit:
+        rows = conn.execute('''
+            SELECT ts, role, message, intent FROM messages
+            WHERE client_id = ? AND phone = ? ORDER BY ts DESC, id DESC LIMIT ?
+        ''', (client_id, phone, limit)).fetchall()
+        rows.reverse()
     else:
-        cursor.execute("SELECT client_id, phone, data FROM sessions")
-        
-    rows = cursor.fetchall()
-    conn.close()
+        rows = conn.execute('''
+            SELECT ts, role, message, intent FROM messages
+            WHERE client_id = ? AND phone = ? ORDER BY ts, id
+        ''', (client_id, phone)).fetchall()
+    return [_message_entry(row) for row in rows]
+
+def iter_messages(client_id: Optional[str] = None, role: Optional[str] = "user",
+                  batch_size: int = 500) -> Iterator[Dict]:
+    """Streams logged messages (all conversations, optionally one client/role), batch_size rows at a time."""
+    sql = "SELECT client_id, phone, ts, role, message, intent FROM messages WHERE message IS NOT NULL"
+    params: List = []
+    if client_id:
+        sql += " AND client_id = ?"
+        params.append(client_id)
+    if role:
+        sql += " AND role = ?"
+        params.append(role)
+
+    for conn in _connections_for(client_id):
+        cursor = conn.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield {"client_id": row["client_id"], "phone": row["phone"], **_message_entry(row)}
+
+# waiting_since keeps its original value while the session stays in AGUARDANDO_HUMANO
+_UPSERT_SESSION_SQL = '''
+    INSERT INTO sessions (client_id, phone, data, updated_at, status, last_updated, waiting_since, interaction_count, expires_at, version) 
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 1)
+    ON CONFLICT(client_id, phone) DO UPDATE SET
+        data = excluded.data,
+        updated_at = excluded.updated_at,
+        status = excluded.status,
+        last_updated = excluded.last_updated,
+        waiting_since = CASE WHEN excluded.status = 'AGUARDANDO_HUMANO'
+                             THEN COALESCE(sessions.waiting_since, excluded.waiting_since) END,
+        interaction_count = excluded.interaction_count,
+        expires_at = excluded.expires_at,
+        version = sessions.version + 1
+    RETURNING version
+'''
+
+def _expires_at(status: Optional[str], last_updated: Optional[float]) -> Optional[float]:
+    """When SessionManager's inactivity timeout fires (None: finished, or never interacted)."""
+    if not last_updated or status == "FINALIZADO":
+        return None
+    return last_updated + (HUMAN_SESSION_TIMEOUT if status == "AGUARDANDO_HUMANO" else SESSION_TIMEOUT)
+
+# Optimistic concurrency: only overwrite the row if it is still at the version the caller
+# loaded (a missing row counts as version 0). Nothing is RETURNed when it was not.
+_UPSERT_SESSION_IF_VERSION_SQL = _UPSERT_SESSION_SQL.replace(
+    "RETURNING version", "WHERE sessions.version = ?\n    RETURNING version")
+
+class StaleSessionError(Exception):
+    """save_session(expected_version=...) lost the race: someone else saved the session first."""
+
+    def __init__(self, client_id: str, phone: str, expected_version: int):
+        super().__init__(f"session {client_id}/{phone} is no longer at version {expected_version}")
+        self.client_id = client_id
+        self.phone = phone
+        self.expected_version = expected_version
+
+# Stored in their own table/column, never inside the JSON blob
+_ROW_ONLY_KEYS = ("history", "waiting_since", "version")
+
+# Entries are only deduplicated by their explicit id: two messages with one timestamp are both kept
+_APPEND_MESSAGE_SQL = '''
+    INSERT INTO messages (client_id, phone, ts, role, message, intent, entry_id)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (client_id, phone, entry_id) WHERE entry_id IS NOT NULL DO NOTHING
+'''
+
+def save_session(client_id: str, phone: str, session_data: Dict, expected_version: Optional[int] = None) -> int:
+    """
+    Upserts a session. Entries in session_data["history"] are appended to the
+    messages table; the session row itself only stores the state-machine fields.
+    Returns the row's new version.
+
+    With expected_version (0 for a session that did not exist yet), nothing is written
+    unless the stored row is still at that version; StaleSessionError is raised instead.
+    """
+    if expected_version is None:
+        return save_sessions([(client_id, phone, session_data)])[(client_id, phone)]
+
+    rows, messages = _session_rows([(client_id, phone, session_data)])
+    conn = get_connection(client_id)
+    with conn:
+        returned = conn.execute(_UPSERT_SESSION_IF_VERSION_SQL, rows[0] + (expected_version,)).fetchone()
+        # An insert returns version 1: only expected when the session was new (deleted meanwhile otherwise)
+        if returned is None or returned[0] != expected_version + 1:
+            raise StaleSessionError(client_id, phone, expected_version) # `with conn` rolls back
+        if messages:
+            conn.executemany(_APPEND_MESSAGE_SQL, messages)
+    return returned[0]
+
+def _session_rows(items: Iterable[Tuple[str, str, Dict]]) -> Tuple[List[Tuple], List[Tuple]]:
+    """Session rows (for the upsert statements) and message rows of (client_id, phone, session_data) items."""
+    now = time.time()
+    rows, messages = [], []
+    for client_id, phone, session_data in items:
+        state = {k: v for k, v in session_data.items() if k not in _ROW_ONLY_KEYS}
+        status = state.get("status")
+        rows.append((client_id, phone, codec.encode(state), now,
+                     status, state.get("last_updated"), now if status == "AGUARDANDO_HUMANO" else None,
+                     state.get("interaction_count"), _expires_at(status, state.get("last_updated"))))
+        for entry in session_data.get("history") or []:
+            messages.append((client_id, phone, entry.get("timestamp", now), entry.get("role"),
+                             entry.get("message"), entry.get("intent"), entry.get("id")))
+    return rows, messages
+
+def save_sessions(items: Iterable[Tuple[str, str, Dict]]) -> Dict[Tuple[str, str], int]:
+    """
+    Upserts many (client_id, phone, session_data) in a single transaction (one fsync)
+    per database file: one in total, or one per shard touched in shard mode.
+    Returns the new version of each saved (client_id, phone).
+    """
+    # Items per target database; key None = main database
+    batches: Dict[Optional[str], List] = {}
+    for item in items:
+        batches.setdefault(item[0] if SHARD_MODE else None, []).append(item)
     
-    sessions = {}
+    versions = {}
+    for target, batch in batches.items():
+        rows, messages = _session_rows(batch)
+        conn = get_connection(target)
+        # `with conn` commits, or rolls back so the pooled connection never keeps a dangling transaction
+        with conn:
+            # One execute per row (executemany cannot return rows); the statement stays cached
+            for row in rows:
+                versions[(row[0], row[1])] = conn.execute(_UPSERT_SESSION_SQL, row).fetchone()[0]
+            if messages:
+                conn.executemany(_APPEND_MESSAGE_SQL, messages)
+    return versions
+
+def list_expired_sessions(client_id: str, now: float, limit: int = 200) -> List[Dict]:
+    """Sessions whose timeout deadline has passed, oldest first (idx_sessions_expires). Each carries its version."""
+    conn = get_connection(client_id)
+    rows = conn.execute('''
+        SELECT phone, data, version FROM sessions
+        WHERE client_id = ? AND expires_at < ? ORDER BY expires_at LIMIT ?
+    ''', (client_id, now, limit)).fetchall()
+    sessions = []
     for row in rows:
         try:
-             s_data = json.loads(row["data"])
-             s_data["client_id"] = row["client_id"] # Ensure it matches DB
-             s_data["phone"] = row["phone"]
-             sessions[row["phone"]] = s_data
-        except:
-             continue
+            session = _decode_session(row["data"])
+        except ValueError:
+            continue
+        session.update(client_id=client_id, phone=row["phone"], version=row["version"])
+        sessions.append(session)
     return sessions
 
-def save_session(client_id: str, phone: str, session_data: Dict):
-    """Upserts a session."""
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    json_data = json.dumps(session_data, ensure_ascii=False)
+_EXPIRE_SESSION_SQL = '''
+    UPDATE sessions SET
+        data = ?, updated_at = ?, status = ?, last_updated = ?, interaction_count = ?, expires_at = ?,
+        waiting_since = CASE WHEN ? = 'AGUARDANDO_HUMANO' THEN COALESCE(waiting_since, ?) END,
+        version = version + 1
+    WHERE client_id = ? AND phone = ? AND version = ?
+'''
+
+def expire_sessions(client_id: str, sessions: Iterable[Dict]) -> List[str]:
+    """
+    Writes sessions moved by the timeout sweeper, in one short transaction. Each update
+    only applies if the row is still at session["version"] (i.e. no message arrived
+    in between). Returns the phones that were updated.
+    """
     now = time.time()
-    
-    cursor.execute('''
-        INSERT INTO sessions (client_id, phone, data, updated_at) 
-        VALUES (?, ?, ?, ?)
-        ON CONFLICT(client_id, phone) DO UPDATE SET
-            data = excluded.data,
-            updated_at = excluded.updated_at
-    ''', (client_id, phone, json_data, now))
-    
-    conn.commit()
-    conn.close()
+    applied = []
+    conn = get_connection(client_id)
+    with conn:
+        for session in sessions:
+            state = {k: v for k, v in session.items() if k not in _ROW_ONLY_KEYS}
+            status, last_updated = state.get("status"), state.get("last_updated")
+            cursor = conn.execute(_EXPIRE_SESSION_SQL, (
+                codec.encode(state), now, status, last_updated, state.get("interaction_count"),
+                _expires_at(status, last_updated), status, now,
+                client_id, state["phone"], session["version"],
+            ))
+            if cursor.rowcount:
+                applied.append(state["phone"])
+    return applied
 
-def prune_old_sessions(days_retention: int = 30):
-    """Deletes sessions inactive for more than X days."""
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        # Calculate cutoff timestamp
-        limit_time = time.time() - (days_retention * 86400)
-        
-        cursor.execute("DELETE FROM sessions WHERE updated_at < ?", (limit_time,))
-        deleted = cursor.rowcount
-        
-        if deleted > 0:
-            print(f"[DB] Auto-pruned {deleted} old sessions (>{days_retention} days).")
-            # Reclaim disk space
-            cursor.execute("VACUUM")
-            
-        conn.commit()
-        conn.close()
-    except Exception as e:
-        print(f"[DB] Error pruning sessions: {e}")
+def prune_sessions_batch(client_id: str, cutoff: float, batch_size: int = 500) -> int:
+    """Deletes up to batch_size of a client's sessions last updated before cutoff. Short transaction."""
+    conn = get_connection(client_id)
+    with conn:
+        cursor = conn.execute('''
+            DELETE FROM sessions WHERE rowid IN (
+                SELECT rowid FROM sessions WHERE client_id = ? AND updated_at < ? LIMIT ?
+            )
+        ''', (client_id, cutoff, batch_size))
+    return cursor.rowcount
+
+def prune_messages_batch(client_id: str, cutoff: float, batch_size: int = 500) -> int:
+    """Deletes up to batch_size of a client's messages older than cutoff. Short transaction."""
+    conn = get_connection(client_id)
+    with conn:
+        cursor = conn.execute('''
+            DELETE FROM messages WHERE id IN (
+                SELECT id FROM messages WHERE client_id = ? AND ts < ? LIMIT ?
+            )
+        ''', (client_id, cutoff, batch_size))
+    return cursor.rowcount
+
+def get_auto_vacuum_mode(client_id: Optional[str] = None) -> int:
+    """0 = NONE, 1 = FULL, 2 = INCREMENTAL."""
+    return get_connection(client_id).execute("PRAGMA auto_vacuum").fetchone()[0]
+
+def incremental_vacuum(client_id: Optional[str] = None, max_pages: int = 1000) -> int:
+    """
+    Returns up to max_pages free pages to the OS (auto_vacuum=INCREMENTAL only).
+    Returns the number of bytes reclaimed.
+    """
+    conn = get_connection(client_id)
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    # The pragma does its work while being stepped, so drain it
+    conn.execute(f"PRAGMA incremental_vacuum({int(max_pages)})").fetchall()
+    after = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    return (before - after) * page_size
+
+def enable_incremental_vacuum(client_id: Optional[str] = None):
+    """
+    One-off conversion of an existing database to auto_vacuum=INCREMENTAL.
+    Needs a full VACUUM, so run it during a maintenance window, not at startup.
+    """
+    conn = get_connection(client_id)
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    conn.execute("VACUUM")
+    print(f"[DB] auto_vacuum is now {get_auto_vacuum_mode(client_id)} (2 = INCREMENTAL).")
 
 def delete_session(client_id: str, phone: str):
     """Deletes a specific session by client_id and phone number."""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM sessions WHERE client_id = ? AND phone = ?", (client_id, phone))
-    conn.commit()
-    conn.close()
+    conn = get_connection(client_id)
+    with conn:
+        conn.execute("DELETE FROM sessions WHERE client_id = ? AND phone = ?", (client_id, phone))
+        conn.execute("DELETE FROM messages WHERE client_id = ? AND phone = ?", (client_id, phone))
 
 def clear_all_sessions(client_id: Optional[str] = None):
     """⚠️ DANGER: Deletes sessions. If client_id is None, deletes ALL."""
-    conn = get_connection()
-    cursor = conn.cursor()
-    if client_id:
-        cursor.execute("DELETE FROM sessions WHERE client_id = ?", (client_id,))
-    else:
-        cursor.execute("DELETE FROM sessions")
-    conn.commit()
-    conn.close()
+    for conn in _connections_for(client_id):
+        with conn:
+            # A shard only holds one client: an unfiltered DELETE lets SQLite truncate instead of scanning
+            if client_id and not SHARD_MODE:
+                conn.execute("DELETE FROM sessions WHERE client_id = ?", (client_id,))
+                conn.execute("DELETE FROM messages WHERE client_id = ?", (client_id,))
+            else:
+                conn.execute("DELETE FROM sessions")
+                conn.execute("DELETE FROM messages")
+
+# --- OUTBOX ---
+
+def enqueue_outbox(client_id: str, recipient: str, text: str, idempotency_key: str, now: Optional[float] = None) -> bool:
+    """Queues a reply. Returns False if a reply with this idempotency key was already queued."""
+    now = time.time() if now is None else now
+    conn = get_connection(client_id)
+    with conn:
+        cursor = conn.execute('''
+            INSERT OR IGNORE INTO outbox (idempotency_key, client_id, recipient, text, next_attempt_at, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (idempotency_key, client_id, recipient, text, now, now, now))
+    return cursor.rowcount == 1
+
+def list_due_outbox(now: float, limit: int = 50, exclude_clients: Sequence[str] = ()) -> List[Dict]:
+    """
+    Pending replies whose next attempt is due, oldest first. Only the oldest pending
+    reply of each recipient is returned, so a recipient's replies go out in order
+    (a later one waits while an earlier one is backing off). Replies of
+    exclude_clients (e.g. tenants whose circuit is open) are left out.
+    """
+    due: List[Dict] = []
+    excluded = list(exclude_clients)
+    not_in = f"AND o.client_id NOT IN ({', '.join('?' * len(excluded))})" if excluded else ""
+    for conn in _connections_for(None):
+        rows = conn.execute(f'''
+            SELECT * FROM outbox AS o
+            WHERE o.status = 'pending' AND o.next_attempt_at <= ? {not_in}
+              AND o.id = (SELECT MIN(id) FROM outbox WHERE status = 'pending'
+                          AND client_id = o.client_id AND recipient = o.recipient)
+            ORDER BY o.next_attempt_at LIMIT ?
+        ''', (now, *excluded, limit - len(due))).fetchall()
+        due.extend(dict(row) for row in rows)
+        if len(due) >= limit:
+            break
+    return due
+
+def mark_outbox(client_id: str, outbox_id: int, status: str, now: float,
+                next_attempt_at: Optional[float] = None, error: Optional[str] = None):
+    """Records an attempt: status "sent", "dead", or "pending" again with its next_attempt_at."""
+    conn = get_connection(client_id)
+    with conn:
+        conn.execute('''
+            UPDATE outbox SET status = ?, attempts = attempts + 1, updated_at = ?, last_error = ?,
+                              next_attempt_at = COALESCE(?, next_attempt_at)
+            WHERE id = ?
+        ''', (status, now, error, next_attempt_at, outbox_id))
+
+def outbox_counts() -> Dict[str, int]:
+    counts: Dict[str, int] = {}
+    for conn in _connections_for(None):
+        for row in conn.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status"):
+            counts[row[0]] = counts.get(row[0], 0) + row[1]
+    return counts
+
+def prune_outbox_batch(cutoff: float, batch_size: int = 500) -> int:
+    """Deletes up to batch_size sent replies (per database file) finished before cutoff. Dead ones stay for inspection."""
+    deleted = 0
+    for conn in _connections_for(None):
+        with conn:
+            deleted += conn.execute('''
+                DELETE FROM outbox WHERE id IN (
+                    SELECT id FROM outbox WHERE status = 'sent' AND updated_at < ? LIMIT ?
+                )
+            ''', (cutoff, batch_size)).rowcount
+    return deleted
+
+# --- INBOX ---
+
+def add_inbox(client_id: str, conversation: str, payload: Dict, now: Optional[float] = None) -> int:
+    """Stores an accepted inbound message until it is handled. Returns its id."""
+    now = time.time() if now is None else now
+    conn = get_connection(client_id)
+    with conn:
+        cursor = conn.execute("INSERT INTO inbox (client_id, conversation, payload, received_at) VALUES (?, ?, ?, ?)",
+                              (client_id, conversation, json.dumps(payload, ensure_ascii=False), now))
+    return cursor.lastrowid
+
+def delete_inbox(client_id: str, inbox_id: int):
+    conn = get_connection(client_id)
+    with conn:
+        conn.execute("DELETE FROM inbox WHERE id = ?", (inbox_id,))
+
+def list_inbox() -> List[Dict]:
+    """Messages still waiting (e.g. after a restart), in arrival order per database file."""
+    rows: List[Dict] = []
+    for conn in _connections_for(None):
+        for row in conn.execute("SELECT id, client_id, conversation, payload FROM inbox ORDER BY id"):
+            rows.append({**dict(row), "payload": json.loads(row["payload"])})
+    return rows
+
+# --- SEEN MESSAGES ---
+
+def save_seen_messages(entries: Iterable[Tuple[str, str, float]], cutoff: float):
+    """Stores (client_id, message_id, seen_at) entries and drops the ones seen before cutoff."""
+    by_client: Dict[str, List[Tuple[str, str, float]]] = {}
+    for entry in entries:
+        by_client.setdefault(entry[0], []).append(entry)
+    for client_id, rows in by_client.items():
+        conn = get_connection(client_id)
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO seen_messages (client_id, message_id, seen_at) VALUES (?, ?, ?)", rows)
+            conn.execute("DELETE FROM seen_messages WHERE client_id = ? AND seen_at < ?", (client_id, cutoff))
+
+def seen_message_since(client_id: str, message_id: str, cutoff: float) -> bool:
+    row = get_connection(client_id).execute(
+        "SELECT 1 FROM seen_messages WHERE client_id = ? AND message_id = ? AND seen_at >= ?",
+        (client_id, message_id, cutoff)).fetchone()
+    return row is not None
+
+def latest_seen_message() -> Optional[float]:
+    """When the newest stored message id was seen (None if there is none)."""
+    latest = None
+    for conn in _connections_for(None):
+        value = conn.execute("SELECT MAX(seen_at) FROM seen_messages").fetchone()[0]
+        if value is not None and (latest is None or value > latest):
+            latest = value
+    return latest
+
+# --- ASYNC API ---
+# For async callers (FastAPI): blocking sqlite work runs on dedicated threads so the
+# event loop never waits on disk. All writes go through ONE writer thread (its queue
+# orders them and they never fight each other for SQLite's write lock); reads fan out
+# to a small reader pool, which WAL lets run alongside the writer. Every thread uses
+# its own pooled connection from get_connection().
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+_readers = ThreadPoolExecutor(max_workers=DB_READER_THREADS, thread_name_prefix="db-reader")
+
+async def run_read(fn, *args, **kwargs):
+    """Runs a blocking read function on the reader pool."""
+    return await asyncio.get_running_loop().run_in_executor(_readers, partial(fn, *args, **kwargs))
+
+async def run_write(fn, *args, **kwargs):
+    """Runs a blocking write function on the single writer thread."""
+    return await asyncio.get_running_loop().run_in_executor(_writer, partial(fn, *args, **kwargs))
+
+async def get_session_async(client_id: str, phone: str) -> Optional[Dict]:
+    return await run_read(get_session, client_id, phone)
+
+async def save_session_async(client_id: str, phone: str, session_data: Dict, expected_version: Optional[int] = None) -> int:
+    return await run_write(save_session, client_id, phone, session_data, expected_version)
+
+async def save_sessions_async(items: Iterable[Tuple[str, str, Dict]]) -> Dict[Tuple[str, str], int]:
+    return await run_write(save_sessions, list(items))
@@ -0,0 +1,110 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.core import database
+from src.config import DEDUP_TTL_S, DEDUP_MAX_ENTRIES, DEDUP_SPILL
+
+def message_id(original_message: Optional[Dict[str, Any]]) -> Optional[str]:
+    """The WhatsApp message key id (originalMessage["key"]["id"]), or None if the gateway sent none."""
+    key = (original_message or {}).get("key")
+    value = key.get("id") if isinstance(key, dict) else None
+    return str(value) if value else None
+
+class DedupCache:
+    """
+    Message ids already received, keyed by (client_id, message id), so a message the
+    gateway redelivers (e.g. after a Baileys reconnect) is dropped before triage
+    instead of running the state machine and replying twice.
+
+    A bounded LRU in memory: a lookup is one dict access, and an id is remembered for
+    ttl_s after it was last seen. With spill=True, ids evicted from memory (and all of
+    them on close) are written to the seen_messages table and checked on a miss, but
+    only while some stored id is younger than ttl_s, so fresh messages normally never
+    touch SQLite. Stored ids also survive a restart.
+    """
+
+    def __init__(self, ttl_s: float = DEDUP_TTL_S, max_entries: int = DEDUP_MAX_ENTRIES,
+                 spill: bool = DEDUP_SPILL):
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self.spill = spill
+        self._entries: "OrderedDict[Tuple[str, str], float]" = OrderedDict() # Oldest seen first
+        self._evicted: List[Tuple[str, str, float]] = []
+        self._spilled_until = 0.0 # When the newest spilled id was seen
+        self._lock = threading.Lock()
+        self.duplicates = 0
+        self.spill_hits = 0
+        self.evictions = 0
+
+    def seen(self, client_id: str, msg_id: str, now: Optional[float] = None) -> bool:
+        """In-memory check-and-add: True if the id was seen within ttl_s (a duplicate)."""
+        now = time.time() if now is None else now
+        key = (client_id, msg_id)
+        with self._lock:
+            # Entries are in last-seen order, so expired ones are all at the front
+            while self._entries:
+                oldest_key, oldest_at = next(iter(self._entries.items()))
+                if now - oldest_at <= self.ttl_s:
+                    break
+                del self._entries[oldest_key]
+            duplicate = key in self._entries
+            self._entries[key] = now
+            self._entries.move_to_end(key)
+            if duplicate:
+                self.duplicates += 1
+            while len(self._entries) > self.max_entries:
+                (evicted_client, evicted_id), seen_at = self._entries.popitem(last=False)
+                self.evictions += 1
+                if self.spill:
+                    self._evicted.append((evicted_client, evicted_id, seen_at))
+            return duplicate
+
+    def forget(self, client_id: str, msg_id: str):
+        """Drops an id, e.g. when its message was refused (429) and will be redelivered."""
+        with self._lock:
+            self._entries.pop((client_id, msg_id), None)
+
+    async def check(self, client_id: str, msg_id: str) -> bool:
+        """seen(), plus the spill table when enabled. True means a duplicate."""
+        now = time.time()
+        if self.seen(client_id, msg_id, now):
+            return True
+        if not self.spill:
+            return False
+        duplicate = False
+        if now - self._spilled_until <= self.ttl_s:
+            duplicate = await database.run_read(database.seen_message_since, client_id, msg_id, now - self.ttl_s)
+            if duplicate:
+                with self._lock:
+                    self.duplicates += 1
+                    self.spill_hits += 1
+        await self._flush(now)
+        return duplicate
+
+    async def _flush(self, now: float):
+        with self._lock:
+            evicted, self._evicted = self._evicted, []
+        if evicted:
+            self._spilled_until = max(self._spilled_until, max(seen_at for _, _, seen_at in evicted))
+            await database.run_write(database.save_seen_messages, evicted, now - self.ttl_s)
+
+    async def load(self):
+        """Picks up the ids a previous run spilled (call from an async startup hook)."""
+        if self.spill:
+            self._spilled_until = await database.run_read(database.latest_seen_message) or 0.0
+
+    async def close(self):
+        """Spills every id still in memory, so a restart keeps dropping their redeliveries."""
+        if not self.spill:
+            return
+        with self._lock:
+            self._evicted.extend((client_id, msg_id, seen_at) for (client_id, msg_id), seen_at in self._entries.items())
+            self._entries.clear()
+        await self._flush(time.time())
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"size": len(self._entries), "duplicates": self.duplicates, "spill_hits": self.spill_hits,
+                    "evictions": self.evictions, "spill": self.spill}
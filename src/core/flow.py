@@ -0,0 +1,377 @@
+import json
+import os
+import re
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import quote
+
+from src.config import FLOWS_DIR, FLOW_CHECK_INTERVAL_S
+from src.core.fuzzy import DEFAULT_THRESHOLDS
+from src.core.message import NormalizedMessage
+
+MENU = ("1. Orçamentos 💰\n"
+        "2. Resultados 🧪\n"
+        "3. Agendamento 📆\n"
+        "4. Toxicológico (CNH)\n"
+        "5. Outras dúvidas\n")
+
+# The conversation flow as data. Each state lists its rules in priority order; the
+# first rule whose "when" matches runs (an empty "when" always matches):
+#   when:  media / intent / last_action (value in list), entity (entity type present),
+#          equals (stripped message in list), contains (keyword or "@keyword_set" in the
+#          "field": "folded" by default, or "lower"), longer_than (len of the message),
+#          plan (binds $plan from the entity, else the first matching keyword group),
+#          known_patient (the sender's phone matches a patient in the results store; binds
+#          $patient_key and {results}; looked up before the turn, and only for the intents
+#          of the rules using it, see CompiledFlow.needs_known_patient), any (list of when-dicts, OR). Several keys in one
+#          when-dict are ANDed, in order, so cheap conditions should come first.
+#   then:  goto (new status), action, reply (template with {plan}, {plan_name}, {message}),
+#          set (session["data"] updates; "$plan" / "$message" are replaced by their values).
+# A tenant can override any part with data/flows/<client_id>.json (merged one level deep).
+# A tenant file may also set "fuzzy": triage typo thresholds (see src/core/fuzzy.py).
+DEFAULT_FLOW = {
+    "keywords": {
+        "greeting": ["oi", "ola", "comecar", "menu", "inicio", "bom dia", "boa tarde", "boa noite"],
+        "gratitude": ["obrigado", "obrigada", "obg", "valeu", "grato", "grata", "agradecido", "agradecida",
+                      "joia", "beleza", "tá bem", "ta bem", "certo", "ok", "brigado", "brigada"],
+        "menu_options": ["1", "2", "3", "4", "5"],
+        "short_options": ["1", "2", "3", "4"], # Single-character messages that are not noise
+        "admin_commands": ["#bot", "#reset", "#voltar"],
+    },
+    "replies": {
+        "gratitude": "Disponha! Se precisar de algo, é só chamar. 😉 É sempre um prazer lhe atender.",
+        "admin": ("🤖 Controle retornado ao Robô.\nOlá novamente! 👋\n"
+                  "1. Orçamentos 💰\n"
+                  "2. Resultados 🧪\n"
+                  "3. Agendamento 📆\n"
+                  "4. Toxicológico(CNH)\n"
+                  "5. Outras dúvidas\n"
+                  "• Pedimos que siga as instruções e aguarde nosso atendimento"),
+    },
+    "plan_names": {
+        "CASSI": "CASSI",
+        "BM": "BM",
+        "CLINMELO": "Clinmelo",
+        "PARTICULAR": "Private", # Internal, mapped below
+        "ID_CASSI": "CASSI",
+        "ID_BM": "BM",
+        "ID_CLINMELO": "Clinmelo",
+        "ID_PARTICULAR": "Particular",
+    },
+    "states": {
+        "MENU_PRINCIPAL": [
+            # Global Audio Handoff Rule
+            {"when": {"media": ["audio"]}, "goto": "AGUARDANDO_HUMANO", "action": "HANDOFF_AUDIO",
+             "reply": "Recebi seu áudio! \nVou transferir para um de nossos atendentes dar prosseguimento. \nAguarde que logo retornamos. ⏳"},
+            {"when": {"any": [{"intent": ["GREETING"]}, {"contains": "@greeting"}]}, "action": "SEND_MENU",
+             "reply": "Olá! Tudo bem? ✅\n\n"
+                      "1. Solicitação de orçamentos 💰\n"
+                      "2. Solicitação de resultados 🧪\n"
+                      "3. Agendamento domiciliar 📆\n"
+                      "4. Toxicológico (CNH)\n"
+                      "5. Outras dúvidas\n"
+                      "• Pedimos que siga as instruções e aguarde nosso atendimento"},
+            # Known phone: answer straight away instead of asking for the proof photo
+            {"when": {"intent": ["RESULTADO"], "known_patient": True}, "set": {"protocolo": "$patient_key"},
+             "action": "SEND_RESULTS", "reply": "{results}"},
+            {"when": {"intent": ["RESULTADO"]}, "goto": "RESULTADO_PEDIR_COMPROVANTE", "action": "ASK_PROOF",
+             "reply": "Para verificar seus resultados 🧪, por favor envie a *foto do comprovante* de pagamento/atendimento. 📸"},
+            # Budget with the plan already mentioned: skip the first question
+            {"when": {"plan": {"entity": "PLANO_SAUDE"}}, "set": {"plano": "$plan"},
+             "goto": "ORCAMENTO_PEDIR_PEDIDO", "action": "ASK_ORDER",
+             "reply": "Entendi, plano *{plan_name}*. 🏥\nPara orçamentos, por favor envie uma *foto do pedido médico* 📸 ou digite os exames."},
+            {"when": {"intent": ["ORCAMENTO"]}, "goto": "ORCAMENTO_PEDIR_PLANO", "action": "ASK_PLAN",
+             "reply": "Certo, Orçamentos. 💰\nVocê possui plano de saúde ou pagamento *à vista/sem plano*?\n(Ex: CASSI, BM, CLINMELO, Particular)"},
+            {"when": {"intent": ["AGENDAMENTO"]}, "goto": "AGENDAMENTO_PEDIR_PLANO", "action": "ASK_PLAN_SCHED",
+             "reply": "Agendamento Domiciliar 🏠.\nPara iniciar, qual seu *Plano de Saúde* ou seria *Particular*?\n(Aceitamos: CASSI, BM, CLINMELO ou Particular)"},
+            {"when": {"intent": ["TOXICOLOGICO"]}, "goto": "TOXICOLOGICO_AGUARDANDO_RESPOSTA", "action": "INFO_TOXIC",
+             "reply": "O exame Toxicológico 🚦 é realizado por agendamento.\nAtendimento *somente Particular* (R$ 150,00) ou *Pagamento à vista*.\nNecessário CNH. \nDeseja realizar?"},
+            # Option 5 - Explicit Handoff
+            {"when": {"any": [{"equals": ["5"]}, {"contains": ["outras duvidas"]}]}, "goto": "AGUARDANDO_HUMANO",
+             "action": "HANDOFF_DUVIDAS",
+             "reply": "Entendido! Você será transferido para um de nossos atendentes. Aguarde um momento. ⏳"},
+            # Long Message / Complexity Handoff
+            {"when": {"longer_than": 60}, "goto": "AGUARDANDO_HUMANO", "action": "HANDOFF_COMPLEX",
+             "reply": "Estou transferindo para um de nossos atendentes analisarem sua mensagem. Aguarde um momento. ⏳"},
+            {"when": {"last_action": ["SEND_MENU", "WELCOME", "SENT_SHORT_MENU"]}, "action": "SENT_SHORT_MENU",
+             "reply": "Desculpe, não entendi. 😕\nPoderia repetir ou digitar o número?\n\n" + MENU +
+                      "• Pedimos que siga as instruções ou aguarde um atendente."},
+            {"when": {}, "action": "SEND_MENU",
+             "reply": "Olá! 👋 Em que posso ajudar hoje? ✅\n\n" + MENU +
+                      "• Pedimos que siga as instruções ou aguarde um atendente."},
+        ],
+        "ORCAMENTO_PEDIR_PLANO": [
+            {"when": {"plan": {"entity": "PLANO_SAUDE", "field": "lower", "keywords": [
+                ["PARTICULAR", ["particular", "dinheiro", "pix", "vista", "sem plano"]],
+                ["CASSI", ["cassi"]],
+                ["BM", ["bm", "b m", "militar"]],
+                ["CLINMELO", ["clinmelo"]],
+             ]}},
+             "plan_names": {"PARTICULAR": "Particular"},
+             "set": {"plano": "$plan"}, "goto": "ORCAMENTO_PEDIR_PEDIDO", "action": "ASK_ORDER",
+             "reply": "Certo, plano *{plan_name}*. Agora, tire uma *foto do pedido médico* 📸 ou digite os exames e mande aqui."},
+            {"when": {}, "reply": "Aceitamos somente CASSI, BM, Clinmelo ou Particular (à vista)."},
+        ],
+        "ORCAMENTO_PEDIR_PEDIDO": [
+            {"when": {"media": ["image", "document"]}, "set": {"pedido_recebido": True},
+             "goto": "AGUARDANDO_HUMANO", "action": "ORDER_RECEIVED",
+             "reply": "Recebi o pedido! 📸✅\nVou ver o preço para você. Só um momento."},
+            {"when": {"longer_than": 5}, "set": {"pedido_descricao": "$message"},
+             "goto": "AGUARDANDO_HUMANO", "action": "ORDER_RECEIVED",
+             "reply": "Anotei aqui: {message}\nVou calcular o orçamento. Aguarde que logo entraremos em contato. ⏳"},
+            {"when": {}, "reply": "Mande a *foto do pedido* ou escreva os exames, por favor. 📸"},
+        ],
+        "AGENDAMENTO_PEDIR_PLANO": [
+            {"when": {"plan": {"entity": "PLANO_SAUDE", "field": "lower", "keywords": [
+                ["PARTICULAR", ["particular", "dinheiro", "pix", "vista"]],
+                ["CASSI", ["cassi"]],
+                ["BM", ["bm", "b m", "militar"]],
+                ["CLINMELO", ["clinmelo", "clin melo"]],
+             ]}},
+             "set": {"plano": "$plan"}, "goto": "AGENDAMENTO_PEDIR_DADOS", "action": "ASK_ADDR",
+             "reply": "Certo, plano *{plan_name}*. Agora, qual o seu *Endereço* para a gente ver a rota e agendar o melhor dia para irmos até a residência. 🚐 \nLogo retornaremos!"},
+            {"when": {}, "reply": "Não entendi qual é o plano. Aceitamos somente: CASSI, BM, Clinmelo ou Particular."},
+        ],
+        "RESULTADO_PEDIR_COMPROVANTE": [
+            {"when": {"media": ["image", "document"]}, "goto": "AGUARDANDO_HUMANO", "action": "PROOF_RECEIVED",
+             "reply": "Recebido! 📸\nVou verificar se já ficou pronto. Um momento. 📄✅"},
+            # Textual confirmation (Escape Valve)
+            {"when": {"contains": ["já enviei", "ja mandei", "enviei", "segue", "ta ai", "está aí", "anexo"], "field": "lower"},
+             "goto": "AGUARDANDO_HUMANO", "action": "PROOF_RECEIVED",
+             "reply": "Ah, tudo bem. Vou pedir para as meninas verificarem. Só um instante."},
+            {"when": {}, "reply": "Preciso que você mande a *foto do comprovante* 📸 para eu achar o exame."},
+        ],
+        "AGENDAMENTO_PEDIR_DADOS": [
+            {"when": {}, "set": {"address": "$message"}, "goto": "AGUARDANDO_HUMANO", "action": "HANDOFF",
+             "reply": "Obrigado! Recebi o endereço.\nVamos entrar em contato para confirmar o horário. 🚐"},
+        ],
+        "TOXICOLOGICO_AGUARDANDO_RESPOSTA": [
+            {"when": {"contains": ["sim", "quero", "pode ser", "s", "ok", "agendar", "fazer"]},
+             "goto": "TOXICOLOGICO_PEDIR_CNH", "action": "ASK_CNH",
+             "reply": "Perfeito. Para agendar, preciso da *foto da sua CNH* (Carteira de Motorista) ou dos dados da sua CNH. 📸"},
+            {"when": {"contains": ["nao", "não", "obrigado", "obg", "valeu", "deixa", "cancelar"]},
+             "goto": "MENU_PRINCIPAL", "action": "ACK_CANCEL",
+             "reply": "Sem problemas! Se mudar de ideia, é só chamar. 😉"},
+            {"when": {}, "reply": "Desculpe, não entendi. Deseja realizar o exame Toxicológico? (Responda Sim ou Não)"},
+        ],
+        "TOXICOLOGICO_PEDIR_CNH": [
+            {"when": {"media": ["image", "document"]}, "goto": "AGUARDANDO_HUMANO", "action": "CNH_RECEIVED",
+             "reply": "Recebi sua CNH! 📸✅\nVamos verificar a disponibilidade e entrar em contato. Aguarde. ⏳"},
+            {"when": {}, "reply": "Por favor, envie a *foto da CNH* para prosseguirmos. 📸"},
+        ],
+        "AGUARDANDO_HUMANO": [
+            # Silence mode: only an explicit menu command brings the bot back
+            {"when": {"contains": ["menu", "inicio", "comecar"]}, "goto": "MENU_PRINCIPAL", "action": "SEND_MENU",
+             "reply": "Voltando ao menu principal..."},
+        ],
+    },
+}
+
+class Turn:
+    """What the rules look at for one inbound message."""
+    __slots__ = ("msg", "intent", "entities", "media_type", "last_action", "known_patient")
+
+    def __init__(self, msg: NormalizedMessage, intent: Optional[str], entities: dict, media_type: str, last_action: Optional[str],
+                 known_patient: Optional[Dict[str, Any]] = None):
+        self.msg = msg
+        self.intent = intent
+        self.entities = entities
+        self.media_type = media_type
+        self.last_action = last_action
+        # Bindings for the sender's patient, or None; resolved by the caller (rules do no I/O)
+        self.known_patient = known_patient
+
+# A compiled condition returns its bindings (possibly empty) when it matches, else None
+Matcher = Callable[[Turn], Optional[Dict[str, Any]]]
+
+_NO_BINDINGS: Dict[str, Any] = {}
+_FIELDS = {
+    "folded": lambda turn: turn.msg.folded,
+    "lower": lambda turn: turn.msg.raw.lower(),
+}
+
+def _keyword_search(keywords: List[str]) -> Callable[[str], bool]:
+    """Substring test for any of the keywords, as one precompiled regex."""
+    if not keywords:
+        return lambda text: False
+    search = re.compile("|".join(re.escape(k) for k in keywords)).search
+    return lambda text: search(text) is not None
+
+class CompiledFlow:
+    """A flow spec compiled into per-state tuples of (matcher, rule): dispatch is one dict lookup."""
+
+    def __init__(self, spec: dict):
+        self.spec = spec
+        keywords = spec["keywords"]
+        self.keywords = keywords
+        self.replies = spec["replies"]
+        self.plan_names = spec["plan_names"]
+        self.fuzzy = {**DEFAULT_THRESHOLDS, **spec.get("fuzzy", {})}
+        self.is_greeting = _keyword_search(keywords["greeting"])
+        self.is_gratitude = _keyword_search(keywords["gratitude"])
+        self.menu_options = frozenset(keywords["menu_options"])
+        self.short_options = frozenset(keywords["short_options"])
+        self.admin_commands = frozenset(keywords["admin_commands"])
+        self.states: Dict[str, Tuple[Tuple[Matcher, dict], ...]] = {
+            state: tuple((self._compile_when(rule.get("when", {})), rule) for rule in rules)
+            for state, rules in spec["states"].items()
+        }
+        # Intents a known_patient condition can match under (None: any intent)
+        self._known_patient_intents: Optional[frozenset] = frozenset()
+        for rules in spec["states"].values():
+            for rule in rules:
+                self._collect_known_patient(rule.get("when", {}), None)
+
+    def _collect_known_patient(self, when: dict, intents: Optional[List[str]]):
+        intents = when.get("intent", intents)
+        if "known_patient" in when and self._known_patient_intents is not None:
+            self._known_patient_intents = None if intents is None else self._known_patient_intents | set(intents)
+        for alternative in when.get("any", ()):
+            self._collect_known_patient(alternative, intents)
+
+    def needs_known_patient(self, intent: Optional[str]) -> bool:
+        """Whether a rule could test known_patient for this intent (so the caller must look the patient up)."""
+        return self._known_patient_intents is None or intent in self._known_patient_intents
+
+    def _keywords(self, value) -> List[str]:
+        # "@name" refers to one of the flow's keyword sets
+        if isinstance(value, str) and value.startswith("@"):
+            return self.keywords[value[1:]]
+        return value
+
+    def _compile_when(self, when: dict) -> Matcher:
+        matchers = []
+        field = _FIELDS[when.get("field", "folded")]
+        for key, value in when.items():
+            if key == "field":
+                continue
+            elif key in ("media", "intent", "last_action"):
+                attr, allowed = {"media": "media_type"}.get(key, key), frozenset(value)
+                matchers.append(lambda turn, attr=attr, allowed=allowed:
+                                _NO_BINDINGS if getattr(turn, attr) in allowed else None)
+            elif key == "entity":
+                matchers.append(lambda turn, value=value: _NO_BINDINGS if turn.entities.get(value) else None)
+            elif key == "equals":
+                allowed = frozenset(value)
+                matchers.append(lambda turn, allowed=allowed: _NO_BINDINGS if turn.msg.stripped in allowed else None)
+            elif key == "contains":
+                found = _keyword_search(self._keywords(value))
+                matchers.append(lambda turn, found=found, field=field: _NO_BINDINGS if found(field(turn)) else None)
+            elif key == "longer_than":
+                matchers.append(lambda turn, value=value: _NO_BINDINGS if len(turn.msg.raw) > value else None)
+            elif key == "known_patient":
+                matchers.append(lambda turn: turn.known_patient)
+            elif key == "plan":
+                matchers.append(self._compile_plan(value))
+            elif key == "any":
+                alternatives = [self._compile_when(alt) for alt in value]
+                matchers.append(lambda turn, alternatives=alternatives:
+                                next((b for b in (m(turn) for m in alternatives) if b is not None), None))
+            else:
+                raise ValueError(f"unknown condition {key!r} in flow rule")
+
+        def matches(turn: Turn) -> Optional[Dict[str, Any]]:
+            bindings = _NO_BINDINGS
+            for matcher in matchers:
+                found = matcher(turn)
+                if found is None:
+                    return None
+                if found:
+                    bindings = {**bindings, **found}
+            return bindings
+        return matches
+
+    def _compile_plan(self, spec: dict) -> Matcher:
+        """Binds $plan: the entity if triage found one, else the first keyword group that matches."""
+        entity_type = spec.get("entity")
+        field = _FIELDS[spec.get("field", "folded")]
+        groups = [(plan, _keyword_search(keywords)) for plan, keywords in spec.get("keywords", [])]
+
+        def match_plan(turn: Turn) -> Optional[Dict[str, Any]]:
+            plan = turn.entities.get(entity_type) if entity_type else None
+            if not plan and groups:
+                text = field(turn)
+                plan = next((name for name, found in groups if found(text)), None)
+            return {"plan": plan} if plan else None
+        return match_plan
+
+    def run(self, state: str, turn: Turn, session: dict, action: Optional[str], reply: Optional[str]):
+        """
+        Applies the first matching rule of `state` to the session.
+        Returns (action, reply): each is only replaced when the rule defines it.
+        """
+        for matches, rule in self.states.get(state, ()):
+            bindings = matches(turn)
+            if bindings is None:
+                continue
+            if "plan" in bindings:
+                names = {**self.plan_names, **rule.get("plan_names", {})}
+                bindings = {**bindings, "plan_name": names.get(bindings["plan"], bindings["plan"])}
+            bindings = {**bindings, "message": turn.msg.raw}
+
+            for key, value in rule.get("set", {}).items():
+                if isinstance(value, str) and value.startswith("$"):
+                    value = bindings[value[1:]]
+                session["data"][key] = value
+            if "goto" in rule:
+                session["status"] = rule["goto"]
+            if "action" in rule:
+                action = rule["action"]
+            if "reply" in rule:
+                reply = rule["reply"].format_map(bindings) if rule["reply"] else rule["reply"]
+            break
+        return action, reply
+
+def compile_flow(spec: dict) -> CompiledFlow:
+    return CompiledFlow(spec)
+
+def merge_flow(overrides: dict, base: dict = DEFAULT_FLOW) -> dict:
+    """A tenant flow: top-level keys replace the default, dicts are merged one level deep."""
+    merged = dict(base)
+    for key, value in overrides.items():
+        merged[key] = {**base[key], **value} if isinstance(base.get(key), dict) and isinstance(value, dict) else value
+    return merged
+
+class FlowRegistry:
+    """
+    Compiled flow per tenant. data/flows/<client_id>.json is picked up (and
+    recompiled) when it appears or changes; without one a tenant uses DEFAULT_FLOW.
+    The file is stat()ed at most once per check_interval_s per tenant, so an edit
+    takes up to that long to apply.
+    """
+
+    def __init__(self, flows_dir: str = FLOWS_DIR, check_interval_s: float = FLOW_CHECK_INTERVAL_S,
+                 clock: Callable[[], float] = time.monotonic):
+        self.flows_dir = flows_dir
+        self.check_interval_s = check_interval_s
+        self.clock = clock
+        self.default = compile_flow(DEFAULT_FLOW)
+        # client_id -> (file mtime or None, flow, when the file was last checked)
+        self._tenants: Dict[str, Tuple[Optional[float], CompiledFlow, float]] = {}
+
+    def get(self, client_id: str) -> CompiledFlow:
+        now = self.clock()
+        cached = self._tenants.get(client_id)
+        if cached and now - cached[2] < self.check_interval_s:
+            return cached[1]
+
+        path = os.path.join(self.flows_dir, quote(client_id or "", safe="") + ".json")
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            self._tenants[client_id] = (None, self.default, now)
+            return self.default
+
+        if cached and cached[0] == mtime:
+            self._tenants[client_id] = (mtime, cached[1], now)
+            return cached[1]
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                flow = compile_flow(merge_flow(json.load(f)))
+            print(f"[FLOW] Loaded custom flow for {client_id}.")
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            # A broken file must not take the tenant down: keep answering with the default flow
+            print(f"[FLOW] Invalid flow file {path}: {e}. Using the default flow.")
+            flow = self.default
+        self._tenants[client_id] = (mtime, flow, now)
+        return flow
@@ -0,0 +1,151 @@
+from collections import Counter, defaultdict
+from functools import lru_cache
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from src.config import (FUZZY_MATCHING, FUZZY_MIN_LENGTH, FUZZY_MAX_DISTANCE, FUZZY_LONG_LENGTH,
+                        FUZZY_LONG_MAX_DISTANCE, FUZZY_VOCABULARY_PATH)
+
+# Typo tolerance. A tenant can override any key with "fuzzy" in data/flows/<client_id>.json.
+# Both the word and the keyword must be long enough for an edit count: "especial" (8
+# letters) is 2 edits from "especie", but a 7-letter keyword only tolerates one.
+DEFAULT_THRESHOLDS = {
+    "enabled": FUZZY_MATCHING,
+    "min_length": FUZZY_MIN_LENGTH,             # shorter words must match exactly ("casa" is not "casi")
+    "max_distance": FUZZY_MAX_DISTANCE,         # edits allowed from min_length on
+    "long_length": FUZZY_LONG_LENGTH,
+    "long_max_distance": FUZZY_LONG_MAX_DISTANCE, # edits allowed from long_length on
+}
+
+def load_vocabulary(path: str = FUZZY_VOCABULARY_PATH) -> FrozenSet[str]:
+    """
+    Real words that are never fuzzy-matched, one per line: "word" or "word count" (as
+    src/scripts/build_vocabulary.py writes them), "#" starts a comment. Words are in
+    normalized form. A missing file is an empty vocabulary.
+    """
+    try:
+        with open(path, encoding="utf-8") as f:
+            lines = [line.split("#", 1)[0].split() for line in f]
+    except FileNotFoundError:
+        return frozenset()
+    return frozenset(fields[0].lower() for fields in lines if fields)
+
+def allowed_distance(length: int, thresholds: Dict[str, Any]) -> int:
+    if not thresholds["enabled"] or length < thresholds["min_length"]:
+        return 0
+    if length >= thresholds["long_length"]:
+        return thresholds["long_max_distance"]
+    return thresholds["max_distance"]
+
+def bounded_distance(a: str, b: str, limit: int) -> int:
+    """
+    Edit distance (insert, delete, substitute, swap two neighbours) between a and b,
+    or limit + 1 as soon as it is known to exceed `limit`. Only the diagonal band of
+    width 2*limit+1 is computed, so the cost is O(len * limit).
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    over = limit + 1
+    prev2: Optional[List[int]] = None
+    prev = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        row = [over] * (len(b) + 1)
+        row[0] = i
+        lo, hi = max(1, i - limit), min(len(b), i + limit)
+        for j in range(lo, hi + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            best = min(prev[j] + 1, row[j - 1] + 1, prev[j - 1] + cost)
+            if prev2 is not None and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                best = min(best, prev2[j - 2] + 1)
+            row[j] = best
+        if min(row[lo - 1:hi + 1]) > limit:
+            return over
+        prev2, prev = prev, row
+    return prev[len(b)] if prev[len(b)] <= limit else over
+
+def _trigrams(text: str) -> Counter:
+    padded = f" {text} "
+    return Counter(padded[i:i + 3] for i in range(len(padded) - 2))
+
+class FuzzyIndex:
+    """
+    Trigram index over keywords (single words or phrases), built once. A lookup only
+    runs the edit distance on keywords that pass the q-gram count filter: strings
+    within d edits share at least max(len) - 4*d padded trigrams (an insert, delete or
+    substitution breaks at most 3 of them, a swap of two neighbours 4). Each keyword
+    carries a payload returned with its matches. Lookups are memoized, as chat
+    vocabulary repeats a lot.
+
+    Words of `vocabulary` (see load_vocabulary) are real words, not typos: search()
+    never fuzzy-matches them, unless they are part of a keyword ("exame" in "exame pronto").
+    """
+
+    def __init__(self, vocabulary: Iterable[str] = ()):
+        self.vocabulary = frozenset(vocabulary)
+        self._keyword_words = set()
+        self._keywords: List[Tuple[str, Counter, Any]] = []
+        self._postings: Dict[str, List[int]] = defaultdict(list)
+        self._lengths: Dict[int, Tuple[int, int]] = {} # Word count -> (shortest, longest) keyword
+        self.lookup = lru_cache(maxsize=4096)(self._lookup)
+
+    def add(self, keyword: str, payload: Any):
+        if not keyword or any(c.isdigit() for c in keyword):
+            return # Menu digits are never fuzzy ("2" is not "3")
+        grams = _trigrams(keyword)
+        index = len(self._keywords)
+        self._keywords.append((keyword, grams, payload))
+        self._keyword_words.update(keyword.split(" "))
+        for gram in grams:
+            self._postings[gram].append(index)
+        size = keyword.count(" ") + 1
+        shortest, longest = self._lengths.get(size, (len(keyword), len(keyword)))
+        self._lengths[size] = (min(shortest, len(keyword)), max(longest, len(keyword)))
+        self.lookup.cache_clear()
+
+    def _lookup(self, text: str, limit: int) -> Tuple[Tuple[int, str, Any], ...]:
+        """(distance, keyword, payload) for every keyword within `limit` edits of text, closest first."""
+        if limit <= 0:
+            return ()
+        grams = _trigrams(text)
+        shared: Dict[int, int] = defaultdict(int)
+        for gram, count in grams.items():
+            for index in self._postings.get(gram, ()):
+                shared[index] += min(count, self._keywords[index][1][gram])
+        matches = []
+        for index, common in shared.items():
+            keyword, _, payload = self._keywords[index]
+            if common < max(len(text), len(keyword)) - 4 * limit:
+                continue
+            distance = bounded_distance(text, keyword, limit)
+            if 0 < distance <= limit: # Exact hits are the automaton's job
+                matches.append((distance, keyword, payload))
+        matches.sort(key=lambda match: match[0])
+        return tuple(matches)
+
+    def is_word(self, word: str) -> bool:
+        """True for a vocabulary word that is not part of any keyword: never fuzzy."""
+        return word in self.vocabulary and word not in self._keyword_words
+
+    def search(self, normalized_text: str, thresholds: Dict[str, Any]) -> List[Tuple[int, str, Any]]:
+        """
+        Looks up every window of words as long as some indexed phrase. Returns all
+        matches within both the window's and the keyword's allowed distance.
+        """
+        if not thresholds["enabled"]:
+            return []
+        words = normalized_text.split(" ") if normalized_text else []
+        # A window's threshold follows its shortest word ("a vista" with one edit is "a lista"),
+        # and a word with digits or a vocabulary word is never fuzzy
+        limits = [0 if self.is_word(word) or any(c.isdigit() for c in word) else allowed_distance(len(word), thresholds)
+                  for word in words]
+        matches = []
+        for size, (shortest, longest) in self._lengths.items():
+            for start in range(len(words) - size + 1):
+                limit = min(limits[start:start + size])
+                if not limit:
+                    continue
+                text = " ".join(words[start:start + size])
+                if shortest - limit <= len(text) <= longest + limit:
+                    matches.extend(match for match in self.lookup(text, limit)
+                                   if match[0] <= allowed_distance(len(match[1]), thresholds))
+        matches.sort(key=lambda match: match[0])
+        return matches
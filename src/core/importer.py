@@ -0,0 +1,103 @@
+import csv
+import io
+import json
+import time
+from typing import Callable, Dict, IO, Iterable, Iterator, List, Optional
+
+from src.config import IMPORT_BATCH_SIZE
+from src.core.results import ResultsStore
+
+# LIS exports name columns differently; each canonical field accepts these headers
+FIELD_ALIASES = {
+    "client_id": ("client_id", "clientId", "clinica"),
+    "protocol": ("protocol", "protocolo"),
+    "cpf": ("cpf",),
+    "phone": ("phone", "telefone", "celular"),
+    "name": ("name", "nome", "paciente"),
+    "dob": ("dob", "nascimento", "data_nascimento"),
+    "exam_id": ("exam_id", "examId", "id_exame"),
+    "exam_name": ("exam_name", "examName", "exame"),
+    "date": ("date", "data", "data_exame"),
+    "status": ("status",),
+    "pdf_url": ("pdf_url", "pdfUrl", "laudo"),
+}
+_HEADER_MAP = {alias.lower(): field for field, aliases in FIELD_ALIASES.items() for alias in aliases}
+
+def iter_csv(stream: IO[str]) -> Iterator[Dict]:
+    """One dict per CSV line; the header line names the columns."""
+    yield from csv.DictReader(stream)
+
+def iter_ndjson(stream: IO[str]) -> Iterator[Dict]:
+    """One dict per non-blank line. A malformed line yields {} (counted as an error)."""
+    for line in stream:
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield row if isinstance(row, dict) else {}
+
+def normalize_row(raw: Dict, client_id: Optional[str] = None) -> Optional[Dict]:
+    """
+    Maps an export row onto ResultsStore.apply_exam_rows fields. Blank cells are dropped.
+    The patient is keyed by protocol (else CPF), as in mock_db.json. Returns None if the
+    row has no client or no key.
+    """
+    row = {}
+    for key, value in raw.items():
+        field = _HEADER_MAP.get(str(key).strip().lower())
+        if field and value is not None and str(value).strip():
+            row[field] = str(value).strip()
+    row.setdefault("client_id", client_id)
+    patient_key = row.get("protocol") or row.get("cpf")
+    if not row["client_id"] or not patient_key:
+        return None
+    row["patient_key"] = patient_key
+    return row
+
+def import_rows(store: ResultsStore, rows: Iterable[Dict], client_id: Optional[str] = None,
+                batch_size: int = IMPORT_BATCH_SIZE, source: str = "import",
+                on_batch: Optional[Callable[[Dict], None]] = None) -> Dict:
+    """
+    Streams rows into the store, one short transaction per batch so the webhook's
+    reads never wait long. Only the current batch is held in memory.
+    Returns a report: rows, written, skipped (unchanged), errors, seconds, rows_per_s.
+    """
+    report = {"rows": 0, "written": 0, "skipped": 0, "errors": 0}
+    started = time.monotonic()
+    batch: List[Dict] = []
+
+    def flush():
+        written, skipped = store.apply_exam_rows(batch, source)
+        report["written"] += written
+        report["skipped"] += skipped
+        batch.clear()
+        _finish(report, started)
+        if on_batch:
+            on_batch(report)
+
+    for raw in rows:
+        report["rows"] += 1
+        row = normalize_row(raw, client_id)
+        if row is None:
+            report["errors"] += 1
+            continue
+        batch.append(row)
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    return _finish(report, started)
+
+def import_stream(store: ResultsStore, stream: IO, fmt: str = "csv", **kwargs) -> Dict:
+    """import_rows over a CSV or NDJSON text/binary stream (read line by line)."""
+    if not isinstance(stream, io.TextIOBase):
+        stream = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    rows = iter_csv(stream) if fmt == "csv" else iter_ndjson(stream)
+    return import_rows(store, rows, **kwargs)
+
+def _finish(report: Dict, started: float) -> Dict:
+    report["seconds"] = round(time.monotonic() - started, 3)
+    report["rows_per_s"] = round(report["rows"] / report["seconds"], 1) if report["seconds"] else float(report["rows"])
+    return report
@@ -0,0 +1,127 @@
+import asyncio
+import time
+import zlib
+from typing import Awaitable, Callable, Dict, List
+
+from src.core import database
+from src.config import (INGEST_WORKERS, INGEST_MAX_DEPTH, INGEST_PERSIST, INGEST_RETRY_AFTER_S,
+                        INGEST_DRAIN_TIMEOUT_S)
+
+class IngestQueue:
+    """
+    Bounded queue between /webhook and the message pipeline (triage, session, reply),
+    so the endpoint answers as soon as the payload is validated.
+    - Messages are partitioned by conversation over `workers` tasks: a conversation's
+      messages are handled one at a time, in arrival order, while different
+      conversations run in parallel.
+    - At most max_depth messages wait. Beyond that submit() sheds the message and the
+      endpoint answers 429 with Retry-After, so the gateway backs off and redelivers.
+    - With persist=True each accepted message is stored in the inbox table until it is
+      handled, and start() replays what a crash or restart left behind.
+    Runs as tasks on the app's event loop.
+    """
+
+    def __init__(self, handler: Callable[[Dict], Awaitable], workers: int = INGEST_WORKERS,
+                 max_depth: int = INGEST_MAX_DEPTH, persist: bool = INGEST_PERSIST,
+                 retry_after_s: int = INGEST_RETRY_AFTER_S, drain_timeout_s: float = INGEST_DRAIN_TIMEOUT_S):
+        self.handler = handler
+        self.workers = workers
+        self.max_depth = max_depth
+        self.persist = persist
+        self.retry_after_s = retry_after_s
+        self.drain_timeout_s = drain_timeout_s
+        self.depth = 0 # Accepted and not handled yet (waiting or being handled)
+        self.stats = {"accepted": 0, "processed": 0, "failed": 0, "shed": 0}
+        self._waited = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._queues: List[asyncio.Queue] = [asyncio.Queue() for _ in range(workers)]
+        self._tasks: List[asyncio.Task] = []
+
+    def _partition(self, client_id: str, conversation: str) -> asyncio.Queue:
+        # crc32, not hash(): the same conversation maps to the same worker across restarts
+        return self._queues[zlib.crc32(f"{client_id}:{conversation}".encode("utf-8")) % self.workers]
+
+    async def submit(self, client_id: str, conversation: str, item: Dict) -> bool:
+        """Queues a message (a JSON-able dict for the handler). Returns False if it was shed."""
+        if self.depth >= self.max_depth:
+            self.stats["shed"] += 1
+            return False
+        self.depth += 1 # Reserved before any await, so concurrent submits cannot overshoot
+        inbox_id = None
+        if self.persist:
+            try:
+                inbox_id = await database.run_write(database.add_inbox, client_id, conversation, item)
+            except BaseException:
+                self.depth -= 1
+                raise
+        self._partition(client_id, conversation).put_nowait((time.monotonic(), inbox_id, client_id, item))
+        self.stats["accepted"] += 1
+        return True
+
+    async def _work(self, queue: asyncio.Queue):
+        while True:
+            enqueued_at, inbox_id, client_id, item = await queue.get()
+            wait = time.monotonic() - enqueued_at
+            self._waited += 1
+            self._wait_total += wait
+            self._wait_max = max(self._wait_max, wait)
+            try:
+                try:
+                    await self.handler(item)
+                    self.stats["processed"] += 1
+                except Exception as e:
+                    # Not retried: a message that breaks the pipeline would break it again
+                    self.stats["failed"] += 1
+                    print(f"[INGEST] [{client_id}] Failed to handle message: {e!r}")
+                # Only once handled: a message cancelled by stop() stays in the inbox for the next start
+                if inbox_id is not None:
+                    await self._clear(client_id, inbox_id)
+            finally:
+                self.depth -= 1
+                queue.task_done()
+
+    async def _clear(self, client_id: str, inbox_id: int):
+        try:
+            await database.run_write(database.delete_inbox, client_id, inbox_id)
+        except Exception as e:
+            print(f"[INGEST] Could not clear inbox row {inbox_id}: {e}")
+
+    async def start(self):
+        """Starts the workers on the running event loop (call from an async startup hook)."""
+        if self._tasks:
+            return
+        if self.persist:
+            pending = await database.run_read(database.list_inbox)
+            now = time.monotonic()
+            for row in pending: # Already acknowledged: replayed even beyond max_depth
+                self.depth += 1
+                self._partition(row["client_id"], row["conversation"]).put_nowait(
+                    (now, row["id"], row["client_id"], row["payload"]))
+            if pending:
+                print(f"[INGEST] Replaying {len(pending)} messages from the inbox.")
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._work(queue)) for queue in self._queues]
+
+    async def join(self):
+        """Waits until every queued message has been handled."""
+        await asyncio.gather(*(queue.join() for queue in self._queues))
+
+    async def stop(self):
+        """Gives the queued messages drain_timeout_s to be handled, then stops the workers."""
+        if not self._tasks:
+            return
+        try:
+            await asyncio.wait_for(self.join(), self.drain_timeout_s)
+        except asyncio.TimeoutError:
+            print(f"[INGEST] Stopping with {self.depth} messages unhandled"
+                  f"{' (kept in the inbox)' if self.persist else ''}.")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def health(self) -> Dict:
+        return {**self.stats, "depth": self.depth, "max_depth": self.max_depth, "workers": self.workers,
+                "wait_ms_avg": round(1000 * self._wait_total / self._waited, 1) if self._waited else 0.0,
+                "wait_ms_max": round(1000 * self._wait_max, 1)}
@@ -0,0 +1,38 @@
+import asyncio
+import threading
+import weakref
+from contextlib import asynccontextmanager, contextmanager
+from typing import List
+
+class StripedLocks:
+    """
+    Serializes work per conversation without a global lock: each (client_id, phone)
+    hashes to one of `stripes` locks, so two messages from the same phone run one
+    after the other while other conversations proceed in parallel (two conversations
+    only wait for each other when they share a stripe).
+
+    hold() is for threads, hold_async() for coroutines; asyncio locks are kept per
+    event loop, since a lock cannot be shared between loops.
+    """
+
+    def __init__(self, stripes: int = 256):
+        self.stripes = stripes
+        self._thread_locks = [threading.Lock() for _ in range(stripes)]
+        self._async_locks: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, List[asyncio.Lock]]" = weakref.WeakKeyDictionary()
+
+    def _stripe(self, client_id: str, phone: str) -> int:
+        return hash((client_id, phone)) % self.stripes
+
+    @contextmanager
+    def hold(self, client_id: str, phone: str):
+        with self._thread_locks[self._stripe(client_id, phone)]:
+            yield
+
+    @asynccontextmanager
+    async def hold_async(self, client_id: str, phone: str):
+        loop = asyncio.get_running_loop()
+        locks = self._async_locks.get(loop)
+        if locks is None:
+            locks = self._async_locks[loop] = [asyncio.Lock() for _ in range(self.stripes)]
+        async with locks[self._stripe(client_id, phone)]:
+            yield
@@ -0,0 +1,64 @@
+import re
+from dataclasses import dataclass, field
+from typing import FrozenSet
+from unidecode import unidecode
+
+_URL_RE = re.compile(r"https?://\S+|www\.\S+")
+_ELONGATION_RE = re.compile(r"(.)\1{2,}")
+_NON_ALNUM_RE = re.compile(r'[^a-z0-9\s]')
+
+def fold_text(text: str) -> str:
+    """ASCII-folds and lowercases text, dropping URLs (punctuation and spacing are kept)."""
+    if not text:
+        return ""
+    return _URL_RE.sub("", unidecode(text).lower())
+
+def normalize_text(text: str) -> str:
+    """
+    Normalizes text for regex matching:
+    1. Fix Unicode/Accents (unidecode).
+    2. Remove URLs (http/https/www).
+    3. Normalize repeated characters (elongation).
+    4. Remove non-alphanumeric characters (except spaces).
+    5. Collapse multiple spaces.
+    """
+    # 1. Remove accents and lowercase / 2. Remove URLs
+    return normalize_folded(fold_text(text))
+
+def normalize_folded(text: str) -> str:
+    """Steps 3-5 of normalize_text, for text that fold_text already folded."""
+    if not text:
+        return ""
+    
+    # 3. Fix Elongated Words (e.g., "bombooomm" -> "bom")
+    # Reduces words with 3+ repeated characters to 1
+    text = _ELONGATION_RE.sub(r"\1", text)
+
+    # 4. Keep only letters, numbers, spaces
+    text = _NON_ALNUM_RE.sub('', text)
+    
+    # 5. Collapse whitespace
+    return " ".join(text.split())
+
+@dataclass(frozen=True)
+class NormalizedMessage:
+    """
+    Every form of an inbound message the bot looks at, computed once per message
+    (in the webhook) and shared by triage and the session state machine.
+    """
+    raw: str
+    stripped: str = field(init=False)    # raw without surrounding whitespace (menu digits, #bot...)
+    folded: str = field(init=False)      # ASCII-folded, lowercase, URLs removed
+    normalized: str = field(init=False)  # folded, alphanumeric words joined by single spaces (triage)
+    tokens: FrozenSet[str] = field(init=False)
+    digits: str = field(init=False)      # only the digits of raw (protocols, CPFs, phones)
+
+    def __post_init__(self):
+        raw = self.raw or ""
+        folded = fold_text(raw)
+        normalized = normalize_folded(folded) # Same as normalize_text(raw), without folding twice
+        object.__setattr__(self, "stripped", raw.strip())
+        object.__setattr__(self, "folded", folded)
+        object.__setattr__(self, "normalized", normalized)
+        object.__setattr__(self, "tokens", frozenset(normalized.split()))
+        object.__setattr__(self, "digits", "".join(c for c in raw if c.isdigit()))
@@ -0,0 +1,149 @@
+import asyncio
+import random
+import time
+import uuid
+from typing import Dict, Optional, Tuple
+
+from src.core import database
+from src.core.replier import CIRCUIT_OPEN, AsyncReplier
+from src.config import (OUTBOX_BATCH_SIZE, OUTBOX_POLL_INTERVAL_S, OUTBOX_MAX_ATTEMPTS, OUTBOX_BACKOFF_BASE_S,
+                        OUTBOX_BACKOFF_MAX_S, OUTBOX_KEEP_SENT_S)
+
+class OutboxWorker:
+    """
+    Delivers the replies queued in the outbox table (data/sessions.db), so a reply
+    survives gateway errors and restarts instead of being printed and dropped.
+    - Each reply has an idempotency key: queueing it again is a no-op.
+    - A recipient's replies go out one at a time, in order (see list_due_outbox).
+    - Failures are retried with exponential backoff and jitter; after max_attempts,
+      or on an error that retrying cannot fix, the reply is dead-lettered (status "dead").
+    - While a tenant's circuit is open its replies simply stay queued (no attempt is
+      spent), and go out once a probe finds the gateway back.
+    Runs as a task on the app's event loop, with up to batch_size sends in flight.
+    """
+
+    def __init__(self, replier: AsyncReplier, batch_size: int = OUTBOX_BATCH_SIZE,
+                 poll_interval_s: float = OUTBOX_POLL_INTERVAL_S, max_attempts: int = OUTBOX_MAX_ATTEMPTS,
+                 backoff_base_s: float = OUTBOX_BACKOFF_BASE_S, backoff_max_s: float = OUTBOX_BACKOFF_MAX_S,
+                 keep_sent_s: int = OUTBOX_KEEP_SENT_S):
+        self.replier = replier
+        self.batch_size = batch_size
+        self.poll_interval_s = poll_interval_s
+        self.max_attempts = max_attempts
+        self.backoff_base_s = backoff_base_s
+        self.backoff_max_s = backoff_max_s
+        self.keep_sent_s = keep_sent_s
+        self.stats = {"sent": 0, "retried": 0, "dead": 0}
+        self._in_flight: Dict[Tuple[str, str], asyncio.Task] = {}
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._last_prune = 0.0
+
+    async def enqueue(self, client_id: str, recipient: str, text: str, idempotency_key: Optional[str] = None) -> bool:
+        """Queues a reply (one short transaction on the writer thread). Returns False for a duplicate idempotency key."""
+        queued = await database.run_write(database.enqueue_outbox, client_id, recipient, text,
+                                          idempotency_key or uuid.uuid4().hex)
+        if queued and self._wake is not None:
+            self._wake.set()
+        return queued
+
+    def backoff(self, attempts: int) -> float:
+        """Delay before the next attempt; the jitter spreads retries out after a gateway restart."""
+        delay = min(self.backoff_max_s, self.backoff_base_s * 2 ** (attempts - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+    async def drain_once(self, now: Optional[float] = None) -> int:
+        """Starts a send for every due reply while there is room in flight. Returns how many started."""
+        now = time.time() if now is None else now
+        room = self.batch_size - len(self._in_flight)
+        if room <= 0:
+            return 0
+        # Tenants whose circuit is open are left out of the query, and the rows being
+        # sent are fetched on top of `room`: neither may crowd out replies that can go now
+        blocked = [client_id for client_id in self.replier.breakers if not self.replier.available(client_id)]
+        due = await database.run_read(database.list_due_outbox, now, room + len(self._in_flight), blocked)
+        started = 0
+        for row in due:
+            recipient = (row["client_id"], row["recipient"])
+            if recipient in self._in_flight: # Its head reply is still being sent
+                continue
+            if not self.replier.available(row["client_id"]):
+                continue
+            self._in_flight[recipient] = asyncio.get_running_loop().create_task(self._send(row, now))
+            started += 1
+            if started >= room:
+                break
+        return started
+
+    async def _send(self, row: Dict, now: float):
+        try:
+            try:
+                sent, error, retryable = await self.replier.deliver(row["client_id"], row["recipient"], row["text"])
+            except Exception as e:
+                sent, error, retryable = False, repr(e), True
+            if error != CIRCUIT_OPEN: # Lost the half-open probe to another send: just stay queued
+                await database.run_write(self._record, row, now, sent, error, retryable)
+        except Exception as e:
+            print(f"[OUTBOX] Could not record delivery of reply {row['id']}: {e}")
+        finally:
+            self._in_flight.pop((row["client_id"], row["recipient"]), None)
+            if self._wake is not None:
+                self._wake.set() # The recipient's next reply can go now
+
+    def _record(self, row: Dict, now: float, sent: bool, error: Optional[str], retryable: bool):
+        attempts = row["attempts"] + 1
+        if sent:
+            database.mark_outbox(row["client_id"], row["id"], "sent", now)
+            self.stats["sent"] += 1
+        elif retryable and attempts < self.max_attempts:
+            database.mark_outbox(row["client_id"], row["id"], "pending", now, now + self.backoff(attempts), error)
+            self.stats["retried"] += 1
+        else:
+            database.mark_outbox(row["client_id"], row["id"], "dead", now, error=error)
+            self.stats["dead"] += 1
+            print(f"[OUTBOX] [{row['client_id']}] Dead-lettered reply {row['id']} to {row['recipient']} "
+                  f"after {attempts} attempts: {error}")
+
+    async def flush(self, now: Optional[float] = None):
+        """Sends everything due at `now`, waiting for each recipient's queue in turn."""
+        while await self.drain_once(now) or self._in_flight:
+            await asyncio.gather(*list(self._in_flight.values()), return_exceptions=True)
+
+    def _prune(self, now: float):
+        if now - self._last_prune >= 60:
+            self._last_prune = now
+            database.prune_outbox_batch(now - self.keep_sent_s)
+
+    async def _run(self):
+        while True:
+            try:
+                started = await self.drain_once()
+                await database.run_write(self._prune, time.time())
+            except Exception as e:
+                print(f"[OUTBOX] Drain error: {e}")
+                started = 0
+            if started >= self.batch_size:
+                continue # More may be due already
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.poll_interval_s)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    def start(self):
+        """Starts draining on the running event loop (call from an async startup hook)."""
+        if self._task is None:
+            self._wake = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Stops draining and waits for the sends in flight; undelivered replies stay queued."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._in_flight:
+            await asyncio.gather(*list(self._in_flight.values()), return_exceptions=True)
+
+    def health(self) -> Dict:
+        return {**self.stats, "in_flight": len(self._in_flight), "queue": database.outbox_counts()}
@@ -1,8 +1,14 @@
+import asyncio
 import requests
 import json
 import urllib.parse
+from typing import Dict, Optional, Set, Tuple
 
-from src.config import EVOLUTION_API_URL, EVOLUTION_API_KEY
+import httpx
+
+from src.core.breaker import CircuitBreaker
+from src.config import (EVOLUTION_API_URL, EVOLUTION_API_KEY, GATEWAY_URL, REPLY_TIMEOUT_S,
+                        REPLY_MAX_CONNECTIONS, REPLY_CONCURRENCY_PER_CLIENT)
 
 class Replier:
     def __init__(self):
@@ -15,7 +21,7 @@ class Replier:
         """
         Sends a text message to the specified remoteJid via local Node gateway.
         """
-        url = f"http://localhost:3000/send-message/{client_id}"
+        url = f"{GATEWAY_URL}/send-message/{client_id}"
         
         payload = {
             "number": remote_jid,
@@ -30,5 +36,116 @@ class Replier:
                 print(f"[REPLIER] [{client_id}] Gateway Error {response.status_code}: {response.text}")
         except Exception as e:
             print(f"[REPLIER] [{client_id}] Error sending: {e}")
-        
 
+# deliver()'s error when a tenant's circuit is open: nothing was sent, nothing was attempted
+CIRCUIT_OPEN = "circuit open"
+
+class AsyncReplier:
+    """
+    Replier for the event loop: one pooled httpx.AsyncClient keeps keep-alive
+    connections to the gateway, and each tenant has at most
+    REPLY_CONCURRENCY_PER_CLIENT sends in flight (one busy clinic cannot take the
+    whole pool). send_text_nowait lets the webhook return without waiting.
+    Each tenant also has a CircuitBreaker: while the gateway keeps failing for a
+    client (e.g. its WhatsApp socket is reconnecting), sends fail fast instead of
+    each waiting out the timeout.
+    """
+
+    def __init__(self, base_url: str = GATEWAY_URL, concurrency: int = REPLY_CONCURRENCY_PER_CLIENT,
+                 transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.base_url = base_url
+        self.concurrency = concurrency
+        self.transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._pending: Set[asyncio.Task] = set()
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.stats = {"sent": 0, "failed": 0, "rejected": 0}
+
+    def breaker(self, client_id: str) -> CircuitBreaker:
+        breaker = self.breakers.get(client_id)
+        if breaker is None:
+            breaker = self.breakers[client_id] = CircuitBreaker(client_id)
+        return breaker
+
+    def available(self, client_id: str) -> bool:
+        """False while the tenant's circuit is open (a send would be refused)."""
+        return self.breaker(client_id).available()
+
+    def circuits(self) -> Dict[str, Dict]:
+        return {client_id: breaker.snapshot() for client_id, breaker in self.breakers.items()}
+
+    def _get_client(self) -> httpx.AsyncClient:
+        # The client and semaphores belong to the loop that created them
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url, transport=self.transport,
+                timeout=httpx.Timeout(REPLY_TIMEOUT_S, connect=5.0),
+                limits=httpx.Limits(max_connections=REPLY_MAX_CONNECTIONS,
+                                    max_keepalive_connections=REPLY_MAX_CONNECTIONS),
+            )
+            self._loop = loop
+            self._semaphores = {}
+        return self._client
+
+    async def deliver(self, client_id, remote_jid, text) -> Tuple[bool, Optional[str], bool]:
+        """
+        Sends a text message to the specified remoteJid via local Node gateway.
+        Returns (sent, error, retryable): network errors, timeouts, 429 and 5xx are
+        worth retrying; other gateway answers (bad number, unknown client) are not.
+        They also feed the tenant's circuit breaker; while it is open the result is
+        (False, CIRCUIT_OPEN, True) without touching the network.
+        """
+        breaker = self.breaker(client_id)
+        if not breaker.allow():
+            self.stats["rejected"] += 1
+            return False, CIRCUIT_OPEN, True
+        client = self._get_client()
+        semaphore = self._semaphores.setdefault(client_id, asyncio.Semaphore(self.concurrency))
+        async with semaphore:
+            try:
+                response = await client.post(f"/send-message/{client_id}", json={"number": remote_jid, "text": text})
+            except httpx.HTTPError as e:
+                print(f"[REPLIER] [{client_id}] Error sending: {e!r}")
+                self.stats["failed"] += 1
+                breaker.record_failure()
+                return False, repr(e), True
+            except BaseException:
+                breaker.record_failure() # e.g. cancelled: do not leave a half-open probe claimed
+                raise
+        if response.status_code == 200:
+            print(f"[REPLIER] [{client_id}] Sent to {remote_jid}: {text}")
+            self.stats["sent"] += 1
+            breaker.record_success()
+            return True, None, False
+        print(f"[REPLIER] [{client_id}] Gateway Error {response.status_code}: {response.text}")
+        self.stats["failed"] += 1
+        retryable = response.status_code == 429 or response.status_code >= 500
+        # A 4xx about one message still means the gateway is up
+        if retryable:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        return False, f"HTTP {response.status_code}: {response.text[:200]}", retryable
+
+    async def send_text(self, client_id, remote_jid, text) -> bool:
+        """deliver() without the details: True if the gateway accepted the message."""
+        return (await self.deliver(client_id, remote_jid, text))[0]
+
+    def send_text_nowait(self, client_id, remote_jid, text) -> asyncio.Task:
+        """Schedules send_text on the running loop and returns at once (delivery is logged)."""
+        task = asyncio.get_running_loop().create_task(self.send_text(client_id, remote_jid, text))
+        # The loop only keeps weak references to tasks
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+        return task
+
+    async def aclose(self):
+        """Waits for the sends in flight, then closes the pooled connections."""
+        if self._pending:
+            await asyncio.gather(*self._pending, return_exceptions=True)
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
@@ -0,0 +1,263 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from src.core import database
+from src.config import RESULTS_DB_PATH
+
+_NON_DIGITS = re.compile(r"\D")
+
+def phone_key(phone: Optional[str]) -> Optional[str]:
+    """
+    The part of a Brazilian number that identifies the line: DDD + last 8 digits.
+    "+55 (81) 99999-9999", "558199999999@s.whatsapp.net" and "81 9999-9999" share a key
+    (country code, trunk 0, the mobile 9th digit and JID suffixes are ignored).
+    Returns None if there are too few digits.
+    """
+    digits = _NON_DIGITS.sub("", str(phone or "").split("@")[0]).lstrip("0")
+    if len(digits) >= 12 and digits.startswith("55"):
+        digits = digits[2:]
+    if len(digits) < 10:
+        return None
+    return digits[:2] + digits[-8:]
+
+class ResultsStore:
+    """
+    Patients and exam results in their own SQLite file (data/results.db), so lookups
+    are index seeks (O(log n)) however large the lab's export is, and nothing is held
+    in RAM. Patients are indexed by their key (the protocol/CPF the lab filed them
+    under), protocol, CPF and phone_key (see phone_key), so a sender's own number
+    finds their results without asking for a protocol.
+
+    Rows come from sources: mock_db.json is re-synced when its mtime changes
+    (sync_json); LIS exports are streamed in with apply_exam_rows (see src/core/importer.py).
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or RESULTS_DB_PATH
+        self._local = threading.local()
+        self._conns: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self._schema_ready = False
+        self._synced_mtimes: Dict[str, float] = {}
+        self._sync_lock = threading.Lock() # One sync_json at a time (reader threads and check_results)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = database._connect(self.path)
+            conn.create_function("phone_key", 1, phone_key, deterministic=True)
+            with self._lock:
+                self._conns.append(conn)
+                if not self._schema_ready:
+                    self._init_schema(conn)
+                    self._schema_ready = True
+        return conn
+
+    def _init_schema(self, conn: sqlite3.Connection):
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS patients (
+                client_id TEXT NOT NULL,
+                patient_key TEXT NOT NULL,
+                protocol TEXT,
+                cpf TEXT,
+                phone TEXT,
+                name TEXT,
+                dob TEXT,
+                source TEXT,
+                content_hash TEXT,
+                phone_key TEXT,
+                PRIMARY KEY (client_id, patient_key)
+            )
+        ''')
+        if "phone_key" not in [row[1] for row in conn.execute("PRAGMA table_info(patients)")]:
+            conn.execute("ALTER TABLE patients ADD COLUMN phone_key TEXT")
+            conn.execute("UPDATE patients SET phone_key = phone_key(phone) WHERE phone IS NOT NULL")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_patients_protocol ON patients (client_id, protocol)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_patients_cpf ON patients (client_id, cpf)")
+        # Phone lookups go through the 10-character key; the raw-phone index is not needed
+        conn.execute("DROP INDEX IF EXISTS idx_patients_phone")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_patients_phone_key ON patients (client_id, phone_key) WHERE phone_key IS NOT NULL")
+        # Exams clustered per patient, in the order the lab listed them
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS exams (
+                client_id TEXT NOT NULL,
+                patient_key TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                exam_id TEXT,
+                name TEXT,
+                date TEXT,
+                status TEXT,
+                pdf_url TEXT,
+                content_hash TEXT,
+                PRIMARY KEY (client_id, patient_key, position)
+            ) WITHOUT ROWID
+        ''')
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(exams)")]
+        if "content_hash" not in columns:
+            conn.execute("ALTER TABLE exams ADD COLUMN content_hash TEXT")
+        conn.commit()
+
+    def close(self):
+        with self._lock:
+            conns, self._conns = self._conns, []
+        for conn in conns:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        self._local = threading.local()
+
+    # --- Writes ---
+
+    def upsert_patients(self, client_id: str, patients: Iterable[Tuple[str, Dict]], source: str) -> int:
+        """
+        Inserts/replaces (patient_key, patient) pairs in one transaction. A patient whose
+        content is unchanged (same hash) is skipped. Returns how many were written.
+        """
+        conn = self._conn()
+        written = 0
+        with conn:
+            for patient_key, patient in patients:
+                patient_key = str(patient_key)
+                content_hash = hashlib.sha1(json.dumps(patient, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+                row = conn.execute("SELECT content_hash FROM patients WHERE client_id = ? AND patient_key = ?",
+                                   (client_id, patient_key)).fetchone()
+                if row and row[0] == content_hash:
+                    continue
+                conn.execute('''
+                    INSERT OR REPLACE INTO patients (client_id, patient_key, protocol, cpf, phone, name, dob, source, content_hash, phone_key)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, phone_key(?5))
+                ''', (client_id, patient_key, patient.get("protocol"), patient.get("cpf"), patient.get("phone"),
+                      patient.get("name"), patient.get("dob"), source, content_hash))
+                conn.execute("DELETE FROM exams WHERE client_id = ? AND patient_key = ?", (client_id, patient_key))
+                conn.executemany('''
+                    INSERT INTO exams (client_id, patient_key, position, exam_id, name, date, status, pdf_url)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ''', [(client_id, patient_key, position, exam.get("id"), exam.get("name"), exam.get("date"),
+                       exam.get("status"), exam.get("pdf_url"))
+                      for position, exam in enumerate(patient.get("exams") or [])])
+                written += 1
+        return written
+
+    def apply_exam_rows(self, rows: Iterable[Dict], source: str) -> Tuple[int, int]:
+        """
+        Upserts one exam per row (patient fields included) in a single transaction.
+        Rows need client_id and patient_key; exams are matched on exam_id within the patient.
+        A row whose content hash is unchanged is skipped. Returns (written, skipped).
+        """
+        conn = self._conn()
+        written = skipped = 0
+        with conn:
+            for row in rows:
+                client_id, patient_key = row["client_id"], row["patient_key"]
+                exam_id = row.get("exam_id") or f"{row.get('exam_name')}|{row.get('date')}"
+                content_hash = hashlib.sha1(json.dumps(row, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+                existing = {e["exam_id"]: e for e in conn.execute(
+                    "SELECT position, exam_id, content_hash FROM exams WHERE client_id = ? AND patient_key = ?",
+                    (client_id, patient_key))}
+                current = existing.get(exam_id)
+                if current is not None and current["content_hash"] == content_hash:
+                    skipped += 1
+                    continue
+
+                # content_hash = NULL: the patient no longer matches any mock_db.json snapshot
+                conn.execute('''
+                    INSERT INTO patients (client_id, patient_key, protocol, cpf, phone, name, dob, source, phone_key)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, phone_key(?5))
+                    ON CONFLICT(client_id, patient_key) DO UPDATE SET
+                        protocol = COALESCE(excluded.protocol, protocol), cpf = COALESCE(excluded.cpf, cpf),
+                        phone = COALESCE(excluded.phone, phone), name = COALESCE(excluded.name, name),
+                        dob = COALESCE(excluded.dob, dob), source = excluded.source, content_hash = NULL,
+                        phone_key = COALESCE(excluded.phone_key, phone_key)
+                ''', (client_id, patient_key, row.get("protocol"), row.get("cpf"), row.get("phone"),
+                      row.get("name"), row.get("dob"), source))
+                if current is not None:
+                    position = current["position"]
+                else:
+                    position = max((e["position"] for e in existing.values()), default=-1) + 1
+                conn.execute('''
+                    INSERT OR REPLACE INTO exams (client_id, patient_key, position, exam_id, name, date, status, pdf_url, content_hash)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (client_id, patient_key, position, exam_id, row.get("exam_name"), row.get("date"),
+                      row.get("status"), row.get("pdf_url"), content_hash))
+                written += 1
+        return written, skipped
+
+    def _delete_missing(self, client_id: str, source: str, keep: Iterable[str]) -> int:
+        conn = self._conn()
+        keep = set(keep)
+        stale = [row[0] for row in conn.execute(
+            "SELECT patient_key FROM patients WHERE client_id = ? AND source = ?", (client_id, source)
+        ) if row[0] not in keep]
+        with conn:
+            for patient_key in stale:
+                conn.execute("DELETE FROM exams WHERE client_id = ? AND patient_key = ?", (client_id, patient_key))
+                conn.execute("DELETE FROM patients WHERE client_id = ? AND patient_key = ?", (client_id, patient_key))
+        return len(stale)
+
+    def sync_json(self, path: str) -> bool:
+        """
+        Loads a mock_db.json-style file ({client_id: {"patients": {key: patient}}}) if it
+        changed since the last sync (mtime). Only changed patients are rewritten and
+        patients removed from the file are deleted. Returns True if a sync ran.
+        """
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return False
+        if self._synced_mtimes.get(path) == mtime:
+            return False # Unchanged: no lock taken
+
+        with self._sync_lock:
+            # Another thread may have imported this version while we waited
+            if self._synced_mtimes.get(path) == mtime:
+                return False
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            source = os.path.basename(path)
+            written = removed = 0
+            for client_id, clinica_data in data.items():
+                patients = (clinica_data or {}).get("patients", {})
+                written += self.upsert_patients(client_id, patients.items(), source)
+                removed += self._delete_missing(client_id, source, patients.keys())
+            self._synced_mtimes[path] = mtime
+        if written or removed:
+            print(f"[RESULTS] Synced {path}: {written} patients updated, {removed} removed.")
+        return True
+
+    # --- Lookups ---
+
+    def _patient(self, client_id: str, row: sqlite3.Row) -> Dict:
+        exams = self._conn().execute('''
+            SELECT exam_id, name, date, status, pdf_url FROM exams
+            WHERE client_id = ? AND patient_key = ? ORDER BY position
+        ''', (client_id, row["patient_key"])).fetchall()
+        return {
+            "key": row["patient_key"], "name": row["name"], "dob": row["dob"], "phone": row["phone"],
+            "protocol": row["protocol"], "cpf": row["cpf"],
+            "exams": [{"id": e["exam_id"], "name": e["name"], "date": e["date"], "status": e["status"],
+                       "pdf_url": e["pdf_url"]} for e in exams],
+        }
+
+    def find_patient(self, client_id: str, protocol_or_cpf: str) -> Optional[Dict]:
+        """Patient filed under this key, else with this protocol, else with this CPF (each an index seek)."""
+        conn = self._conn()
+        for column in ("patient_key", "protocol", "cpf"):
+            row = conn.execute(f"SELECT * FROM patients WHERE client_id = ? AND {column} = ? LIMIT 1",
+                               (client_id, protocol_or_cpf)).fetchone()
+            if row:
+                return self._patient(client_id, row)
+        return None
+
+    def find_by_phone(self, client_id: str, phone: str) -> List[Dict]:
+        """Patients whose phone has the same phone_key as `phone` (one index seek)."""
+        key = phone_key(phone)
+        if key is None:
+            return []
+        rows = self._conn().execute("SELECT * FROM patients WHERE client_id = ? AND phone_key = ?", (client_id, key)).fetchall()
+        return [self._patient(client_id, row) for row in rows]
@@ -0,0 +1,88 @@
+import sys
+import threading
+import time
+from typing import Dict, Optional
+
+from src.core import database
+from src.config import (RETENTION_DAYS, RETENTION_DAYS_BY_CLIENT, RETENTION_BATCH_SIZE,
+                        RETENTION_INTERVAL_S, RETENTION_START_DELAY_S)
+
+class RetentionJob:
+    """
+    Background retention: deletes sessions/messages older than each tenant's
+    retention window in small batches (each one a short transaction, with a pause
+    in between so webhook writes interleave), then reclaims the freed pages
+    with PRAGMA incremental_vacuum.
+    """
+
+    def __init__(self, default_days: int = RETENTION_DAYS, days_by_client: Optional[Dict[str, int]] = None,
+                 batch_size: int = RETENTION_BATCH_SIZE, interval_s: float = RETENTION_INTERVAL_S,
+                 start_delay_s: float = RETENTION_START_DELAY_S, pause_s: float = 0.05):
+        self.default_days = default_days
+        self.days_by_client = RETENTION_DAYS_BY_CLIENT if days_by_client is None else days_by_client
+        self.batch_size = batch_size
+        self.interval_s = interval_s
+        self.start_delay_s = start_delay_s
+        self.pause_s = pause_s
+        self.last_report: Optional[Dict] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def retention_days(self, client_id: str) -> int:
+        return self.days_by_client.get(client_id, self.default_days)
+
+    def run_once(self) -> Dict:
+        """One full pass over every tenant. Returns {"rows", "bytes", "clients": {client_id: rows}}."""
+        now = time.time()
+        report = {"rows": 0, "bytes": 0, "clients": {}}
+        clients = set(database.list_client_ids()) | set(self.days_by_client)
+        for client_id in sorted(clients):
+            cutoff = now - self.retention_days(client_id) * 86400
+            deleted = 0
+            for prune in (database.prune_sessions_batch, database.prune_messages_batch):
+                while not self._stop.is_set():
+                    n = prune(client_id, cutoff, self.batch_size)
+                    deleted += n
+                    if n < self.batch_size:
+                        break
+                    self._stop.wait(self.pause_s)
+            if deleted:
+                report["clients"][client_id] = deleted
+                report["rows"] += deleted
+                # Per client, so each shard gets its pages back (same file otherwise: later calls reclaim 0)
+                if database.get_auto_vacuum_mode(client_id) == 2:
+                    report["bytes"] += database.incremental_vacuum(client_id)
+                else:
+                    print(f"[DB] Retention: auto_vacuum is not INCREMENTAL for {client_id}, freed pages are kept "
+                          "for reuse (run `python -m src.core.retention --enable-incremental` once to convert).")
+
+        if report["rows"]:
+            print(f"[DB] Retention pruned {report['rows']} rows {report['clients']}, reclaimed {report['bytes']} bytes.")
+        self.last_report = report
+        return report
+
+    def _run(self):
+        if self._stop.wait(self.start_delay_s):
+            return
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"[DB] Retention job error: {e}")
+            self._stop.wait(self.interval_s)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="session-retention", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+if __name__ == "__main__":
+    database.init_db()
+    if "--enable-incremental" in sys.argv:
+        database.enable_incremental_vacuum()
+    print(RetentionJob().run_once())
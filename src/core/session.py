@@ -1,14 +1,23 @@
-import json
 import os
 import time
+import uuid
 from datetime import datetime
 from src.core import database
-from src.config import IGNORED_NUMBERS, TEST_PREFIX
+from src.core.writebehind import WriteBehindBuffer
+from src.core.retention import RetentionJob
+from src.core.cache import SessionCache
+from src.core.message import NormalizedMessage
+from src.core.flow import CompiledFlow, FlowRegistry, Turn
+from src.core.sweeper import TimeoutSweeper
+from src.core.locks import StripedLocks
+from src.core.results import ResultsStore
+from src.config import (IGNORED_NUMBERS, TEST_PREFIX, SESSION_WRITE_BEHIND,
+                        WRITE_BEHIND_FLUSH_MS, WRITE_BEHIND_MAX_BATCH, SESSION_CACHE_MAX_ENTRIES,
+                        SESSION_TIMEOUT, HUMAN_SESSION_TIMEOUT, SESSION_SWEEPER,
+                        SESSION_LOCK_STRIPES, SESSION_SAVE_RETRIES)
 
 SESSION_FILE = os.path.join("data", "sessions.json")
 MOCK_DB_FILE = os.path.join("data", "mock_db.json")
-SESSION_TIMEOUT = 900 # 15 minutes for automated flows
-HUMAN_SESSION_TIMEOUT = 7200 # 2 hours for human mode (7200s)
 
 PLAN_NAMES = {
     "CASSI": "CASSI",
@@ -18,60 +27,214 @@ PLAN_NAMES = {
 }
 
 class SessionManager:
-    def __init__(self):
+    def __init__(self, write_behind: bool = SESSION_WRITE_BEHIND, sweeper: bool = SESSION_SWEEPER, retention: bool = True):
         # Initialize DB on startup
         database.init_db()
-        # Auto-maintenance: Prune old sesions (>120 days / 4 months)
-        database.prune_old_sessions(120)
+        # Auto-maintenance: Prune old sessions (RETENTION_DAYS, per tenant) in the background
+        self.retention = RetentionJob()
+        if retention:
+            self.retention.start()
         
-        # Mock DB for results lookup (read-only json)
+        # Results lookup: indexed store, kept in sync with mock_db.json (reloaded when the file changes)
         self.mock_db_path = MOCK_DB_FILE
+        self.results = ResultsStore()
         self._load_mock_db()
 
-    def get_session(self, client_id: str, phone: str) -> dict:
-        """Loads session from DB or creates new."""
-        session = database.get_session(client_id, phone)
-        if not session:
-             session = {
-                "client_id": client_id,
-                "phone": phone,
-                "status": "MENU_PRINCIPAL",
-                "data": {},
-                "history": [],
-                "last_updated": 0,
-                "interaction_count": 0,
-                "last_action": None
-            }
+        # Optional group commit: sessions are flushed in batches by a background thread
+        self.write_behind = WriteBehindBuffer(WRITE_BEHIND_FLUSH_MS, WRITE_BEHIND_MAX_BATCH) if write_behind else None
+
+        # Conversation flows (DEFAULT_FLOW, or data/flows/<client_id>.json), compiled once
+        self.flows = FlowRegistry()
+
+        # Timeouts applied in the background too, so the dashboard never shows stale queues
+        self.sweeper = None
+        if sweeper:
+            self.sweeper = TimeoutSweeper(skip=self.write_behind.is_pending if self.write_behind else None)
+            self.sweeper.start()
+
+        # Decoded sessions kept between messages (write-through), checked against the row version
+        self.cache = SessionCache(SESSION_CACHE_MAX_ENTRIES, SESSION_TIMEOUT)
+
+        # Messages of one conversation are processed one at a time; different conversations in parallel
+        self.locks = StripedLocks(SESSION_LOCK_STRIPES)
+        self.save_retries = SESSION_SAVE_RETRIES
+
+    def close(self):
+        """Stops background jobs and flushes pending writes. Safe to call more than once."""
+        self.retention.stop()
+        self.results.close()
+        if self.sweeper:
+            self.sweeper.stop()
+        if self.write_behind:
+            self.write_behind.close()
+
+    def _persist(self, client_id: str, phone: str, session: dict, force: bool = False):
+        """
+        Saves a session. In write-through mode the save is conditional on the version it was
+        loaded at (database.StaleSessionError otherwise), unless `force` is set.
+        """
+        if self.write_behind:
+            # The buffer now holds the newest copy (the cached one is outdated once it flushes)
+            self.cache.invalidate(client_id, phone)
+            self.write_behind.put(client_id, phone, session)
+        else:
+            expected_version = None if force else session.get("version", 0)
+            session["version"] = database.save_session(client_id, phone, session, expected_version)
+            self.cache.put(client_id, phone, session)
+
+    async def _persist_async(self, client_id: str, phone: str, session: dict, force: bool = False):
+        if self.write_behind:
+            self.cache.invalidate(client_id, phone)
+            self.write_behind.put(client_id, phone, session)
+        else:
+            expected_version = None if force else session.get("version", 0)
+            session["version"] = await database.save_session_async(client_id, phone, session, expected_version)
+            self.cache.put(client_id, phone, session)
+
+    def _load(self, client_id: str, phone: str):
+        """
+        Returns the stored session: from the cache if its version is still current
+        (one primary-key lookup, no blob decode), otherwise from SQLite.
+        """
+        if self.cache.max_entries <= 0:
+            return database.get_session(client_id, phone)
+        version = database.get_session_version(client_id, phone)
+        if version is None:
+            # Deleted (or never saved), e.g. from the dashboard
+            self.cache.invalidate(client_id, phone)
+            return None
+        session = self.cache.get(client_id, phone, version)
+        if session is None:
+            session = database.get_session(client_id, phone)
+            if session is not None:
+                self.cache.put(client_id, phone, session)
         return session
 
+    def get_session(self, client_id: str, phone: str) -> dict:
+        """Loads session from cache/DB or creates new."""
+        session = self.write_behind.get(client_id, phone) if self.write_behind else None
+        if session is None:
+            session = self._load(client_id, phone)
+        return session or self._new_session(client_id, phone)
+
+    async def get_session_async(self, client_id: str, phone: str) -> dict:
+        """Same as get_session, but the SQLite reads run on a reader thread."""
+        session = self.write_behind.get(client_id, phone) if self.write_behind else None
+        if session is None:
+            session = await database.run_read(self._load, client_id, phone)
+        return session or self._new_session(client_id, phone)
+
+    def _new_session(self, client_id: str, phone: str) -> dict:
+        return {
+            "client_id": client_id,
+            "phone": phone,
+            "status": "MENU_PRINCIPAL",
+            "data": {},
+            "history": [],
+            "last_updated": 0,
+            "interaction_count": 0,
+            "last_action": None
+        }
+
     def _load_mock_db(self):
-        if os.path.exists(self.mock_db_path):
-             with open(self.mock_db_path, "r", encoding='utf-8') as f:
-                 self.mock_db = json.load(f)
-        else:
-            self.mock_db = {"patients": {}}
+        try:
+            self.results.sync_json(self.mock_db_path)
+        except (OSError, ValueError) as e:
+            # Keep serving the last good copy
+            print(f"[RESULTS] Could not load {self.mock_db_path}: {e}")
 
     def check_results(self, client_id: str, protocol_or_cpf: str):
-        # Implement Logic to check Mock DB within client scope
-        clinica_data = self.mock_db.get(client_id, {})
-        patients = clinica_data.get("patients", {})
+        # Picks up edits to mock_db.json without a restart (one stat() when unchanged)
+        self._load_mock_db()
+        patient = self.results.find_patient(client_id, protocol_or_cpf)
         
-        # Simple search
-        if protocol_or_cpf in patients:
-            patient = patients[protocol_or_cpf]
-            results = []
-            for exam in patient["exams"]:
-                status_icon = "✅" if exam["status"] == "PRONTO" else "🕒"
-                results.append(f"{status_icon} *{exam['name']}*: {exam['status']}")
-            
-            if not results:
-                return f"Olá *{patient['name']}*. Ainda não há exames prontos neste protocolo."
-                
-            return f"Resultados para *{patient['name']}*:\n" + "\n".join(results)
+        if patient:
+            return self._format_results(patient)
         
         return None
 
-    def update_session(self, client_id: str, phone: str, message: str, intent: str, entities: dict, contact_name: str = None, media_type: str = "text", from_me: bool = False):
+    def _format_results(self, patient: dict) -> str:
+        results = []
+        for exam in patient["exams"]:
+            status_icon = "✅" if exam["status"] == "PRONTO" else "🕒"
+            results.append(f"{status_icon} *{exam['name']}*: {exam['status']}")
+        
+        if not results:
+            return f"Olá *{patient['name']}*. Ainda não há exames prontos neste protocolo."
+            
+        return f"Resultados para *{patient['name']}*:\n" + "\n".join(results)
+
+    def known_patient(self, client_id: str, phone: str):
+        """
+        Flow bindings for the patients registered under the sender's phone (see
+        ResultsStore.phone_key): patient_key of the first one and the formatted results
+        of all of them (a parent may have several children on one number). None if unknown.
+        """
+        self._load_mock_db()
+        patients = self.results.find_by_phone(client_id, phone)
+        if not patients:
+            return None
+        return {"patient_key": patients[0]["key"], "results": "\n\n".join(self._format_results(p) for p in patients)}
+
+    def update_session(self, client_id: str, phone: str, message: str, intent: str, entities: dict, contact_name: str = None, media_type: str = "text", from_me: bool = False, normalized: NormalizedMessage = None,
+                       flow: CompiledFlow = None):
+        """`flow` is the tenant's flow if the caller already resolved it (e.g. for triage)."""
+        message = self._admit(phone, message)
+        if message is None:
+            return None
+        flow = flow or self.flows.get(client_id)
+        known = self.known_patient(client_id, phone) if self._needs_patient(flow, intent, from_me) else None
+
+        # One message per conversation at a time (two webhooks for the same phone would
+        # otherwise both load, mutate and save, and the last write would win)
+        with self.locks.hold(client_id, phone):
+            for attempt in range(self.save_retries + 1):
+                session = self.get_session(client_id, phone)
+                result, dirty = self._advance(session, client_id, phone, message, intent, entities, media_type, from_me, normalized, known, flow)
+                if not dirty:
+                    return result
+                try:
+                    # Persist to SQLite (the last attempt saves unconditionally, so the message is never dropped)
+                    self._persist(client_id, phone, session, force=attempt == self.save_retries)
+                    return result
+                except database.StaleSessionError as e:
+                    # Another process (dashboard, second worker) saved first: replay on its version
+                    print(f"   [SESSION] {e}, retrying.")
+                    self.cache.invalidate(client_id, phone)
+
+    async def update_session_async(self, client_id: str, phone: str, message: str, intent: str, entities: dict, contact_name: str = None, media_type: str = "text", from_me: bool = False, normalized: NormalizedMessage = None,
+                                   flow: CompiledFlow = None):
+        """
+        Async twin of update_session for the FastAPI handlers: the session read and
+        write run on the database threads, so the event loop keeps serving other webhooks.
+        """
+        message = self._admit(phone, message)
+        if message is None:
+            return None
+        flow = flow or self.flows.get(client_id)
+        known = None
+        if self._needs_patient(flow, intent, from_me):
+            # results.db lookups (and a mock_db.json re-sync) stay off the event loop
+            known = await database.run_read(self.known_patient, client_id, phone)
+
+        async with self.locks.hold_async(client_id, phone):
+            for attempt in range(self.save_retries + 1):
+                session = await self.get_session_async(client_id, phone)
+                result, dirty = self._advance(session, client_id, phone, message, intent, entities, media_type, from_me, normalized, known, flow)
+                if not dirty:
+                    return result
+                try:
+                    await self._persist_async(client_id, phone, session, force=attempt == self.save_retries)
+                    return result
+                except database.StaleSessionError as e:
+                    print(f"   [SESSION] {e}, retrying.")
+                    self.cache.invalidate(client_id, phone)
+
+    def _needs_patient(self, flow: CompiledFlow, intent: str, from_me: bool) -> bool:
+        return not from_me and flow.needs_known_patient(intent)
+
+    def _admit(self, phone: str, message: str):
+        """Applies the ignored-number / test-mode rules. Returns the message to process, or None."""
         # --- IGNORED NUMBERS / TEST MODE ---
         is_ignored = phone in IGNORED_NUMBERS
         is_test_mode = message.startswith(TEST_PREFIX)
@@ -86,18 +249,27 @@ class SessionManager:
             else:
                 print(f"   [SESSION] Ignoring message from ignored number: {phone}")
                 return None
-
-        session = self.get_session(client_id, phone)
-        
+        return message
+
+    def _advance(self, session: dict, client_id: str, phone: str, message: str, intent: str, entities: dict, media_type: str, from_me: bool, normalized: NormalizedMessage = None,
+                 known_patient: dict = None, flow: CompiledFlow = None):
+        """
+        Runs the state machine on an already loaded session (no I/O).
+        Returns (result, dirty): dirty tells the caller whether the session must be persisted.
+        `normalized` is the webhook's NormalizedMessage; it is rebuilt if _admit rewrote the message.
+        `known_patient` is the sender's known_patient() bindings, looked up beforehand when the flow needs them.
+        `flow` is the tenant's flow, resolved once per message by the caller.
+        """
+        msg = normalized if normalized is not None and normalized.raw == message else NormalizedMessage(message)
+        flow = flow or self.flows.get(client_id)
         # --- HUMAN HANDOFF (fromMe) ---
         # If message is from the attendant, mark as AGUARDANDO_HUMANO and renew timeout
         if from_me:
             print(f"   [SESSION] Detected message from attendant for {phone}. Setting AGUARDANDO_HUMANO.")
             session["status"] = "AGUARDANDO_HUMANO"
             session["last_updated"] = time.time()
-            database.save_session(client_id, phone, session)
             # No reply needed as this was the reply
-            return None
+            return None, True
         
         # Increment Interaction Count (new conversations)
         if intent == "GREETING" or session["interaction_count"] == 0:
@@ -111,16 +283,16 @@ class SessionManager:
         # 0. STRICT FILTER: Ignore empty/whitespace messages or emoji-only/symbol-only if no intent
         if not intent and media_type == "text":
              # Normalize heavily to see if there are actual letters/numbers
-             clean_text = normalize_text_simple(message)
+             clean_text = msg.folded
              clean_text = ''.join(c for c in clean_text if c.isalnum()) # Keep only alnum
              
              if len(clean_text) < 2:
                  # Check if it was a critical digit like '1', '2' (Intents would usually catch this, but just in case)
-                 if message.strip() in ["1", "2", "3", "4"]:
+                 if msg.stripped in flow.short_options:
                      pass # Allow
                  else:
                      print(f"   [SESSION] Ignoring invalid/empty message: {message}")
-                     return None
+                     return None, False
 
 
         # --- TIMEOUT CHECK ---
@@ -155,6 +327,7 @@ class SessionManager:
 
 
         session["history"].append({
+            "id": uuid.uuid4().hex, # Saving the session again must not log the message twice
             "timestamp": now,
             "role": "user",
             "message": message,
@@ -180,9 +353,9 @@ class SessionManager:
         # For this POC, strong reset on specific keywords helps navigation.
         # RESET logic (if user says "oi", "ola", "menu" intentionally)
         # Note: We now allow reset even in 'AGUARDANDO_HUMANO' if the input is an explicit command (1-5) or greeting.
-        is_reset_input = (intent == "GREETING" or 
-                          any(x in normalize_text_simple(message) for x in ["oi", "ola", "comecar", "menu", "inicio", "bom dia", "boa tarde", "boa noite"]) or 
-                          message.strip() in ["1", "2", "3", "4", "5"])
+        is_greeting = intent == "GREETING" or flow.is_greeting(msg.folded)
+        is_menu_opt = msg.stripped in flow.menu_options
+        is_reset_input = is_greeting or is_menu_opt
         
         if is_reset_input:
              current_status = "MENU_PRINCIPAL"
@@ -193,315 +366,49 @@ class SessionManager:
         
         # ADMIN COMMAND (Human Override)
         # Allows the human attendant to type "#bot" or "#reset" to return control to AI
-        if message.strip().lower() in ["#bot", "#reset", "#voltar"]:
+        if msg.stripped.lower() in flow.admin_commands:
              current_status = "MENU_PRINCIPAL"
              reply_action = "SEND_MENU"
-             reply_message = ("🤖 Controle retornado ao Robô.\nOlá novamente! 👋\n"
-                              "1. Orçamentos 💰\n"
-                              "2. Resultados 🧪\n"
-                              "3. Agendamento 📆\n"
-                              "4. Toxicológico(CNH)\n"
-                              "5. Outras dúvidas\n"
-                              "• Pedimos que siga as instruções e aguarde nosso atendimento")
+             reply_message = flow.replies["admin"]
              
              # Reset session data
              session["data"] = {}
 
-        # Helper for Friendly Plan Names
-        PLAN_NAMES = {
-            "CASSI": "CASSI",
-            "BM": "BM",
-            "CLINMELO": "Clinmelo",
-            "PARTICULAR": "Private", # Internal, mapped below
-            "ID_CASSI": "CASSI",
-            "ID_BM": "BM",
-            "ID_CLINMELO": "Clinmelo",
-            "ID_PARTICULAR": "Particular"
-        }
-        
-        
-        # LOGIC
- 
         # LOGIC
         # 0. STRICT FILTER: Ignore empty/whitespace messages (Double check)
-        if not message or not message.strip():
-            return None # Do nothing
+        if not message or not msg.stripped:
+            return None, False # Do nothing
 
         # 1. INTELLIGENT SILENT RESET (Priority 1)
         # If we just came from a timeout in AGUARDANDO_HUMANO, we stay silent UNLESS
         # the user sends a greeting, a clear intent, or an explicit menu option.
-        is_greeting = (intent == "GREETING" or any(x in normalize_text_simple(message) for x in ["oi", "ola", "comecar", "inicio", "bom dia", "boa tarde", "boa noite", "menu"]))
-        is_menu_opt = message.strip() in ["1", "2", "3", "4", "5"]
-        
         if session["data"].get("was_stale_human"):
             # If it's NOT a greeting, NOT a menu option, and NO clear intent found
             if not is_greeting and not is_menu_opt and not intent:
                 session["data"].pop("was_stale_human", None)
                 print(f"   [SESSION] Intelligent Silent Reset for {phone}")
-                database.save_session(client_id, phone, session)
-                return None
+                return None, True
             else:
                 # User interacted with something valid, clear the flag and proceed
                 session["data"].pop("was_stale_human", None)
 
         # 2. GLOBAL GRATITUDE HANDLER (Runs in ALL states, except AGUARDANDO_HUMANO)
         # If user says "obrigado", "valeu", etc., just reply politely and keep state.
-        gratitude_words = ["obrigado", "obrigada", "obg", "valeu", "grato", "grata", "agradecido", "agradecida", "joia", "beleza", "tá bem", "ta bem", "certo", "ok", "brigado", "brigada"]
-        if current_status != "AGUARDANDO_HUMANO" and any(x in normalize_text_simple(message) for x in gratitude_words) and len(message) < 20: 
+        if current_status != "AGUARDANDO_HUMANO" and flow.is_gratitude(msg.folded) and len(message) < 20: 
              reply_action = "ACK"
-             reply_message = "Disponha! Se precisar de algo, é só chamar. 😉 É sempre um prazer lhe atender."
+             reply_message = flow.replies["gratitude"]
              return {
                 "status": current_status,
                 "reply_message": reply_message,
                 "action": reply_action
-             }
-
-        if current_status == "MENU_PRINCIPAL":
-            # 0. Global Audio Handoff Rule
-            if media_type == "audio":
-                 session["status"] = "AGUARDANDO_HUMANO"
-                 reply_action = "HANDOFF_AUDIO"
-                 reply_message = "Recebi seu áudio! \nVou transferir para um de nossos atendentes dar prosseguimento. \nAguarde que logo retornamos. ⏳"
-            
-            # 1. Greetings / Reset Explicitly
-            elif intent == "GREETING" or any(x in normalize_text_simple(message) for x in ["oi", "ola", "comecar", "inicio", "bom dia", "boa tarde", "boa noite", "menu"]):
-                  reply_action = "SEND_MENU"
-                  reply_message = ("Olá! Tudo bem? ✅\n\n"
-                               "1. Solicitação de orçamentos 💰\n"
-                               "2. Solicitação de resultados 🧪\n"
-                               "3. Agendamento domiciliar 📆\n"
-                               "4. Toxicológico (CNH)\n"
-                               "5. Outras dúvidas\n"
-                               "• Pedimos que siga as instruções e aguarde nosso atendimento")
-            
-            # 2. Results Intent
-            elif intent == "RESULTADO":
-                session["status"] = "RESULTADO_PEDIR_COMPROVANTE"
-                reply_action = "ASK_PROOF"
-                reply_message = "Para verificar seus resultados 🧪, por favor envie a *foto do comprovante* de pagamento/atendimento. 📸"
-            
-            # 3. Budget Intent
-            elif intent == "ORCAMENTO" or entities.get("PLANO_SAUDE"):
-                # If they already mentioned a plan, skip the first question
-                if entities.get("PLANO_SAUDE"):
-                    plan = entities["PLANO_SAUDE"]
-                    session["data"]["plano"] = plan
-                    session["status"] = "ORCAMENTO_PEDIR_PEDIDO"
-                    reply_action = "ASK_ORDER"
-                    friendly_plan = PLAN_NAMES.get(plan, plan)
-                    reply_message = f"Entendi, plano *{friendly_plan}*. 🏥\nPara orçamentos, por favor envie uma *foto do pedido médico* 📸 ou digite os exames."
-                else:
-                    session["status"] = "ORCAMENTO_PEDIR_PLANO"
-                    reply_action = "ASK_PLAN"
-                    reply_message = "Certo, Orçamentos. 💰\nVocê possui plano de saúde ou pagamento *à vista/sem plano*?\n(Ex: CASSI, BM, CLINMELO, Particular)"
-
-            # 4. Schedule Intent
-            elif intent == "AGENDAMENTO":
-                session["status"] = "AGENDAMENTO_PEDIR_PLANO"
-                reply_action = "ASK_PLAN_SCHED"
-                reply_message = "Agendamento Domiciliar 🏠.\nPara iniciar, qual seu *Plano de Saúde* ou seria *Particular*?\n(Aceitamos: CASSI, BM, CLINMELO ou Particular)"
-                
-            # 5. Toxic Intent
-            elif intent == "TOXICOLOGICO":
-                reply_action = "INFO_TOXIC"
-                reply_message = "O exame Toxicológico 🚦 é realizado por agendamento.\nAtendimento *somente Particular* (R$ 150,00) ou *Pagamento à vista*.\nNecessário CNH. \nDeseja realizar?"
-                session["status"] = "TOXICOLOGICO_AGUARDANDO_RESPOSTA"
-
-            # 6. Option 5 - Explicit Handoff
-            elif message.strip() == "5" or "outras duvidas" in normalize_text_simple(message):
-                session["status"] = "AGUARDANDO_HUMANO"
-                reply_action = "HANDOFF_DUVIDAS"
-                reply_message = "Entendido! Você será transferido para um de nossos atendentes. Aguarde um momento. ⏳"
-
-            # 7. Fallback (Normal MENU loop or handoff)
-            else:
-                # Long Message / Complexity Handoff
-                if len(message) > 60:
-                        session["status"] = "AGUARDANDO_HUMANO"
-                        reply_action = "HANDOFF_COMPLEX"
-                        reply_message = "Estou transferindo para um de nossos atendentes analisarem sua mensagem. Aguarde um momento. ⏳"
-                else:
-                    last_act = session.get("last_action")
-                    if last_act in ["SEND_MENU", "WELCOME", "SENT_SHORT_MENU"]:
-                        reply_action = "SENT_SHORT_MENU"
-                        reply_message = ("Desculpe, não entendi. 😕\nPoderia repetir ou digitar o número?\n\n"
-                                        "1. Orçamentos 💰\n"
-                                        "2. Resultados 🧪\n"
-                                        "3. Agendamento 📆\n"
-                                        "4. Toxicológico (CNH)\n"
-                                        "5. Outras dúvidas\n"
-                                        "• Pedimos que siga as instruções ou aguarde um atendente.")
-                    else:
-                        reply_action = "SEND_MENU"
-                        reply_message = ("Olá! 👋 Em que posso ajudar hoje? ✅\n\n"
-                                        "1. Orçamentos 💰\n"
-                                        "2. Resultados 🧪\n"
-                                        "3. Agendamento 📆\n"
-                                        "4. Toxicológico (CNH)\n"
-                                        "5. Outras dúvidas\n"
-                                        "• Pedimos que siga as instruções ou aguarde um atendente.")
-
-
-        elif current_status == "ORCAMENTO_PEDIR_PLANO":
-            # Capture Plan (Regex/Keyword Logic)
-            msg_lower = message.lower()
-            chosen_plan = None
-            
-            # 1. Try Entity Extraction first
-            if entities.get("PLANO_SAUDE"):
-                chosen_plan = entities.get("PLANO_SAUDE")
-            
-            # 2. Fallback to simple keyword match if entity failed
-            elif any(x in msg_lower for x in ["particular", "dinheiro", "pix", "vista", "sem plano"]):
-                chosen_plan = "PARTICULAR"
-            elif "cassi" in msg_lower:
-                chosen_plan = "CASSI"
-            elif any(x in msg_lower for x in ["bm", "b m", "militar"]):
-                chosen_plan = "BM"
-            elif "clinmelo" in msg_lower:
-                chosen_plan = "CLINMELO"
-
-            if chosen_plan:
-                # Map Internal ID to Friendly Name
-                friendly_plan = PLAN_NAMES.get(chosen_plan, chosen_plan)
-                if chosen_plan == "PARTICULAR": friendly_plan = "Particular" # Override internal ID if needed
-
-                session["data"]["plano"] = chosen_plan
-                session["status"] = "ORCAMENTO_PEDIR_PEDIDO"
-                reply_action = "ASK_ORDER"
-                reply_message = f"Certo, plano *{friendly_plan}*. Agora, tire uma *foto do pedido médico* 📸 ou digite os exames e mande aqui."
-            else:
-                reply_message = "Aceitamos somente CASSI, BM, Clinmelo ou Particular (à vista)."
-
-        elif current_status == "ORCAMENTO_PEDIR_PEDIDO":
-            # Check for Media (Photo or Document)
-            if media_type in ["image", "document"]:
-                session["status"] = "AGUARDANDO_HUMANO"
-                # Save Order Info (mock)
-                session["data"]["pedido_recebido"] = True
-                reply_action = "ORDER_RECEIVED"
-                reply_message = "Recebi o pedido! 📸✅\nVou ver o preço para você. Só um momento."
-            
-            # Check for Text Description
-            elif len(message) > 5:
-                 session["status"] = "AGUARDANDO_HUMANO"
-                 session["data"]["pedido_descricao"] = message
-                 reply_action = "ORDER_RECEIVED"
-                 reply_message = "Anotei aqui: " + message + "\nVou calcular o orçamento. Aguarde que logo entraremos em contato. ⏳"
-            
-            else:
-                 reply_message = "Mande a *foto do pedido* ou escreva os exames, por favor. 📸"
-
-
-
-        elif current_status == "AGENDAMENTO_PEDIR_PLANO":
-            # Reuse logic or simplify
-            msg_lower = message.lower()
-            valid_plan = False
-            chosen_plan = "PARTICULAR"
-
-            if any(x in msg_lower for x in ["particular", "dinheiro", "pix", "vista"]):
-                chosen_plan = "PARTICULAR"
-                valid_plan = True
-            elif "cassi" in msg_lower:
-                chosen_plan = "CASSI"
-                valid_plan = True
-            elif any(x in msg_lower for x in ["bm", "b m", "militar"]):
-                chosen_plan = "BM"
-                valid_plan = True
-            elif "clinmelo" in msg_lower or "clin melo" in msg_lower:
-                chosen_plan = "CLINMELO"
-                valid_plan = True
-            
-            # Check Entity
-            plan_ent = entities.get("PLANO_SAUDE")
-            if plan_ent:
-                chosen_plan = plan_ent
-                valid_plan = True
-            
-            if valid_plan:
-                friendly_plan = PLAN_NAMES.get(chosen_plan, chosen_plan)
-
-                session["data"]["plano"] = chosen_plan
-                session["status"] = "AGENDAMENTO_PEDIR_DADOS"
-                reply_action = "ASK_ADDR"
-                reply_message = f"Certo, plano *{friendly_plan}*. Agora, qual o seu *Endereço* para a gente ver a rota e agendar o melhor dia para irmos até a residência. 🚐 \nLogo retornaremos!"
-            else:
-                 reply_message = "Não entendi qual é o plano. Aceitamos somente: CASSI, BM, Clinmelo ou Particular."
-
-        elif current_status == "RESULTADO_PEDIR_COMPROVANTE":
-             # 1. Accept valid Media
-             if media_type in ["image", "document"]:
-                 session["status"] = "AGUARDANDO_HUMANO"
-                 reply_action = "PROOF_RECEIVED"
-                 reply_message = "Recebido! 📸\nVou verificar se já ficou pronto. Um momento. 📄✅"
-             
-             # 2. Accept textual confirmation (Escape Valve)
-             elif any(k in message.lower() for k in ["já enviei", "ja mandei", "enviei", "segue", "ta ai", "está aí", "anexo"]):
-                 session["status"] = "AGUARDANDO_HUMANO"
-                 reply_action = "PROOF_RECEIVED"
-                 reply_message = "Ah, tudo bem. Vou pedir para as meninas verificarem. Só um instante."
+             }, False
 
-             # 3. Reject unrelated text/audio
-             else:
-                 reply_message = "Preciso que você mande a *foto do comprovante* 📸 para eu achar o exame."
-
-        elif current_status == "AGENDAMENTO_PEDIR_DADOS":
-            session["data"]["address"] = message
-            session["status"] = "AGUARDANDO_HUMANO"
-            reply_action = "HANDOFF"
-            reply_message = "Obrigado! Recebi o endereço.\nVamos entrar em contato para confirmar o horário. 🚐"
-
-        elif current_status == "TOXICOLOGICO_AGUARDANDO_RESPOSTA":
-            msg_lower = normalize_text_simple(message)
-            # 1. Positive
-            if any(x in msg_lower for x in ["sim", "quero", "pode ser", "s", "ok", "agendar", "fazer"]):
-                 session["status"] = "TOXICOLOGICO_PEDIR_CNH"
-                 reply_action = "ASK_CNH"
-                 reply_message = "Perfeito. Para agendar, preciso da *foto da sua CNH* (Carteira de Motorista) ou dos dados da sua CNH. 📸"
-            
-            # 2. Negative / Gratitude
-            elif any(x in msg_lower for x in ["nao", "não", "obrigado", "obg", "valeu", "deixa", "cancelar"]):
-                 session["status"] = "MENU_PRINCIPAL"
-                 reply_action = "ACK_CANCEL"
-                 reply_message = "Sem problemas! Se mudar de ideia, é só chamar. 😉"
-            
-            else:
-                 reply_message = "Desculpe, não entendi. Deseja realizar o exame Toxicológico? (Responda Sim ou Não)"
-
-        elif current_status == "TOXICOLOGICO_PEDIR_CNH":
-             if media_type in ["image", "document"]:
-                 session["status"] = "AGUARDANDO_HUMANO"
-                 reply_action = "CNH_RECEIVED"
-                 reply_message = "Recebi sua CNH! 📸✅\nVamos verificar a disponibilidade e entrar em contato. Aguarde. ⏳"
-             else:
-                  reply_message = "Por favor, envie a *foto da CNH* para prosseguirmos. 📸"
-
-        elif current_status == "AGUARDANDO_HUMANO":
-            # Silence mode: If human is talking, bot expects human to reply.
-            # Only reset if explicit menu command
-            if any(x in normalize_text_simple(message) for x in ["menu", "inicio", "comecar"]):
-                 session["status"] = "MENU_PRINCIPAL"
-                 reply_action = "SEND_MENU"
-                 reply_message = "Voltando ao menu principal..."
-            else:
-                 # SILENCE
-                 reply_message = None 
+        # 3. STATE RULES (see src/core/flow.py): the first matching rule of the current state runs
+        turn = Turn(msg, intent, entities, media_type, session.get("last_action"), known_patient=known_patient)
+        reply_action, reply_message = flow.run(current_status, turn, session, reply_action, reply_message)
 
-        # Persist to SQLite
-        database.save_session(client_id, phone, session)
-        
         return {
             "status": session["status"],
             "reply_message": reply_message,
             "action": reply_action
-        }
-
-def normalize_text_simple(text):
-    import re
-    from unidecode import unidecode
-    if not text: return ""
-    text = unidecode(text).lower()
-    # Remove URLs
-    text = re.sub(r"https?://\S+|www\.\S+", "", text)
-    return text
+        }, True
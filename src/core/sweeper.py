@@ -0,0 +1,103 @@
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from src.core import database
+from src.config import SESSION_SWEEP_INTERVAL_S, SESSION_SWEEP_BATCH_SIZE
+
+# Called with {"client_id", "phone", "from", "to", "at"} for every session the sweeper moves
+TimeoutListener = Callable[[Dict], None]
+
+def expire(session: Dict) -> Dict:
+    """
+    The timeout transition SessionManager applies lazily, done ahead of time:
+    - robot flows -> AGUARDANDO_HUMANO, keeping last_updated so the human timeout
+      still counts from the patient's last message;
+    - AGUARDANDO_HUMANO -> MENU_PRINCIPAL with was_stale_human (silent reset) and
+      last_updated = 0, so the lazy check does not fire a second time.
+    Flow data is cleared and a new interaction starts, as in the lazy path.
+    """
+    session = dict(session)
+    if session.get("status") == "AGUARDANDO_HUMANO":
+        session["status"] = "MENU_PRINCIPAL"
+        session["data"] = {"was_stale_human": True}
+        session["last_updated"] = 0
+    else:
+        session["status"] = "AGUARDANDO_HUMANO"
+        session["data"] = {k: v for k, v in (session.get("data") or {}).items() if k == "was_stale_human"}
+    session["interaction_count"] = (session.get("interaction_count") or 0) + 1
+    return session
+
+class TimeoutSweeper:
+    """
+    Background job that applies session timeouts proactively, so the dashboard's
+    queues and counts are right even if the patient never writes again.
+    Each pass walks idx_sessions_expires per tenant in small batches; updates are
+    conditional on the row version, so a message that lands meanwhile always wins.
+    """
+
+    def __init__(self, interval_s: float = SESSION_SWEEP_INTERVAL_S, batch_size: int = SESSION_SWEEP_BATCH_SIZE,
+                 skip: Optional[Callable[[str, str], bool]] = None):
+        self.interval_s = interval_s
+        self.batch_size = batch_size
+        # e.g. WriteBehindBuffer.is_pending: the stored row is not the latest state
+        self.skip = skip
+        self.listeners: List[TimeoutListener] = []
+        self.last_report: Optional[Dict] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def add_listener(self, listener: TimeoutListener):
+        self.listeners.append(listener)
+
+    def _emit(self, event: Dict):
+        for listener in self.listeners:
+            try:
+                listener(event)
+            except Exception as e:
+                print(f"[SESSION] Timeout listener error: {e}")
+
+    def run_once(self, now: Optional[float] = None) -> Dict:
+        """One pass over every tenant. Returns {"moved", "clients": {client_id: moved}}."""
+        now = time.time() if now is None else now
+        report = {"moved": 0, "clients": {}}
+        for client_id in database.list_client_ids():
+            moved = 0
+            while not self._stop.is_set():
+                expired = database.list_expired_sessions(client_id, now, self.batch_size)
+                # Sessions with an unflushed write-behind update are left to the next pass
+                moves = [(s["status"], expire(s)) for s in expired if not (self.skip and self.skip(client_id, s["phone"]))]
+                applied = set(database.expire_sessions(client_id, [new for _, new in moves])) if moves else set()
+                for old_status, new in moves:
+                    if new["phone"] in applied:
+                        self._emit({"client_id": client_id, "phone": new["phone"], "from": old_status,
+                                    "to": new["status"], "at": now})
+                moved += len(applied)
+                # Skipped/raced rows stay expired: stop instead of fetching them again
+                if len(expired) < self.batch_size or len(applied) < len(expired):
+                    break
+            if moved:
+                report["clients"][client_id] = moved
+                report["moved"] += moved
+
+        if report["moved"]:
+            print(f"[SESSION] Timeout sweeper moved {report['moved']} sessions {report['clients']}.")
+        self.last_report = report
+        return report
+
+    def _run(self):
+        while not self._stop.wait(self.interval_s):
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"[SESSION] Timeout sweeper error: {e}")
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="session-timeout-sweeper", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
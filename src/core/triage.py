@@ -1,5 +1,10 @@
-import re
-from unidecode import unidecode
+from collections import deque
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from src.config import CLASSIFIER_MODEL_PATH, CLASSIFIER_THRESHOLD
+from src.core.classifier import IntentClassifier, load_classifier
+from src.core.fuzzy import DEFAULT_THRESHOLDS, FuzzyIndex, load_vocabulary
+from src.core.message import NormalizedMessage, normalize_text
 
 ONTOLOGY = {
     "intents": {
@@ -18,68 +23,171 @@ ONTOLOGY = {
     }
 }
 
-def normalize_text(text: str) -> str:
+class KeywordAutomaton:
     """
-    Normalizes text for regex matching:
-    1. Fix Unicode/Accents (unidecode).
-    2. Remove URLs (http/https/www).
-    3. Normalize repeated characters (elongation).
-    4. Remove non-alphanumeric characters (except spaces).
-    5. Collapse multiple spaces.
+    Aho-Corasick automaton: finds every occurrence of every keyword (overlaps
+    included) in a single left-to-right pass over the text, whatever the
+    number of keywords. Each keyword carries a payload returned with its matches.
     """
-    if not text:
-        return ""
-    
-    # 1. Remove accents and lowercase
-    text = unidecode(text).lower()
-    
-    # 2. Remove URLs
-    text = re.sub(r"https?://\S+|www\.\S+", "", text)
-    
-    # 3. Fix Elongated Words (e.g., "bombooomm" -> "bom")
-    # Reduces words with 3+ repeated characters to 1
-    text = re.sub(r"(.)\1{2,}", r"\1", text)
 
-    # 4. Keep only letters, numbers, spaces
-    text = re.sub(r'[^a-z0-9\s]', '', text)
-    
-    # 5. Collapse whitespace
-    return " ".join(text.split())
+    def __init__(self):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[Tuple[int, Any]]] = [[]] # (keyword length, payload)
+
+    def add(self, keyword: str, payload: Any):
+        state = 0
+        for char in keyword:
+            nxt = self._goto[state].get(char)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][char] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = nxt
+        self._out[state].append((len(keyword), payload))
+
+    def build(self) -> "KeywordAutomaton":
+        """Computes failure links (breadth-first). Call once after the last add()."""
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(char, 0)
+                # A state also reports the keywords that end at its failure state
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+        return self
+
+    def find(self, text: str) -> Iterator[Tuple[int, int, Any]]:
+        """Yields (start, end, payload) for every match, text[start:end] being the keyword."""
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for i, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for length, payload in out[state]:
+                yield i + 1 - length, i + 1, payload
+
+_INTENT, _ENTITY = 0, 1
+
+def compile_ontology(ontology: dict) -> KeywordAutomaton:
+    """
+    One automaton for every intent and entity keyword (normalized once, here).
+    Payloads keep each keyword's rank so matching can reproduce the ontology order.
+    """
+    automaton = KeywordAutomaton()
+    for rank, (intent, keywords) in enumerate(ontology["intents"].items()):
+        for keyword in keywords:
+            automaton.add(normalize_text(keyword), (_INTENT, rank, intent))
+    for entity_type, mapping in ontology["entities"].items():
+        for rank, (entity_id, keywords) in enumerate(mapping.items()):
+            for keyword in keywords:
+                automaton.add(normalize_text(keyword), (_ENTITY, rank, (entity_type, entity_id)))
+    return automaton.build()
+
+def compile_fuzzy_index(ontology: dict, vocabulary: Iterable[str] = ()) -> FuzzyIndex:
+    """The same keywords and payloads as compile_ontology, for the typo-tolerant fallback."""
+    index = FuzzyIndex(vocabulary)
+    for rank, (intent, keywords) in enumerate(ontology["intents"].items()):
+        for keyword in keywords:
+            index.add(normalize_text(keyword), (_INTENT, rank, intent))
+    for entity_type, mapping in ontology["entities"].items():
+        for rank, (entity_id, keywords) in enumerate(mapping.items()):
+            for keyword in keywords:
+                index.add(normalize_text(keyword), (_ENTITY, rank, (entity_type, entity_id)))
+    return index
+
+_NO_CLASSIFIER = object()
 
 class Triage:
-    def __init__(self):
+    def __init__(self, classifier: Optional[IntentClassifier] = _NO_CLASSIFIER,
+                 classifier_threshold: float = CLASSIFIER_THRESHOLD, vocabulary: Optional[Iterable[str]] = None):
         self.ontology = ONTOLOGY
+        self.automaton = compile_ontology(self.ontology)
+        # Real words are never read as typos of a keyword (data/vocabulary.txt by default)
+        self.fuzzy_index = compile_fuzzy_index(self.ontology, load_vocabulary() if vocabulary is None else vocabulary)
+        # Last resort for free text: the trained model if there is one (and numpy)
+        self.classifier = load_classifier(CLASSIFIER_MODEL_PATH) if classifier is _NO_CLASSIFIER else classifier
+        self.classifier_threshold = classifier_threshold
+
+    def analyze(self, text: Union[str, NormalizedMessage], fuzzy: Optional[dict] = None) -> Tuple[Optional[str], dict]:
+        """
+        Returns (intent, entities) from a single pass over the normalized text.
+        - Intent: the first intent of the ontology with a keyword on word boundaries
+          (e.g. 'um' does not match inside 'nenhum'), or None.
+        - Entities: per entity type, the last ID of the ontology with a keyword
+          anywhere in the text (substring match).
+        Only when no intent (or no entity of a type) matched exactly, words within the
+        `fuzzy` thresholds' edit distance of a keyword count too ("climelo", "resultdo");
+        the closest keyword wins. `fuzzy` defaults to DEFAULT_THRESHOLDS.
+        If there is still no intent, the classifier's prediction is used when its
+        probability reaches classifier_threshold.
+        """
+        normalized_text = text.normalized if isinstance(text, NormalizedMessage) else normalize_text(text)
+        end_of_text = len(normalized_text)
+        intent, intent_rank = None, None
+        entity_ranks: Dict[str, Tuple[int, str]] = {}
+
+        for start, end, (kind, rank, value) in self.automaton.find(normalized_text):
+            if kind == _INTENT:
+                # Normalized text is [a-z0-9] words joined by single spaces, so a
+                # word boundary is a neighbouring space or either end of the text
+                if intent_rank is not None and rank >= intent_rank:
+                    continue
+                if (start == 0 or normalized_text[start - 1] == " ") and \
+                   (end == end_of_text or normalized_text[end] == " "):
+                    intent, intent_rank = value, rank
+            else:
+                entity_type, entity_id = value
+                if entity_type not in entity_ranks or rank > entity_ranks[entity_type][0]:
+                    entity_ranks[entity_type] = (rank, entity_id)
+
+        entity_types = self.ontology["entities"].keys()
+        if intent is None or len(entity_ranks) < len(entity_types):
+            fuzzy_intent, fuzzy_entities = self._fuzzy(normalized_text, fuzzy or DEFAULT_THRESHOLDS)
+            intent = intent or fuzzy_intent
+            for entity_type, entity_id in fuzzy_entities.items():
+                entity_ranks.setdefault(entity_type, (None, entity_id))
+        if intent is None and self.classifier is not None and normalized_text:
+            predicted, probability = self.classifier.predict_one(text)
+            if probability >= self.classifier_threshold:
+                intent = predicted
+
+        return intent, {entity_type: entity_id for entity_type, (_, entity_id) in entity_ranks.items()}
+
+    def _fuzzy(self, normalized_text: str, thresholds: dict) -> Tuple[Optional[str], dict]:
+        # Matches come closest first; on a tie the ontology order decides as in analyze()
+        best_intent: Optional[Tuple[int, int, str]] = None
+        best_entities: Dict[str, Tuple[int, int, str]] = {}
+        for distance, _, (kind, rank, value) in self.fuzzy_index.search(normalized_text, thresholds):
+            if kind == _INTENT:
+                if best_intent is None or (distance, rank) < best_intent[:2]:
+                    best_intent = (distance, rank, value)
+            else:
+                entity_type, entity_id = value
+                current = best_entities.get(entity_type)
+                if current is None or (distance, -rank) < current[:2]:
+                    best_entities[entity_type] = (distance, -rank, entity_id)
+        return (best_intent[2] if best_intent else None,
+                {entity_type: entity_id for entity_type, (_, _, entity_id) in best_entities.items()})
     
-    def detect_intent(self, text: str) -> str:
+    def detect_intent(self, text: Union[str, NormalizedMessage]) -> str:
         """
         Detects the intent of the message based on keywords.
         Returns the first matching intent key or None.
-        Uses Regex Word Boundaries (\b) to avoid partial matches (e.g., 'um' inside 'nenhum').
+        Uses word boundaries to avoid partial matches (e.g., 'um' inside 'nenhum').
         """
-        normalized_text = normalize_text(text)
-        
-        for intent, keywords in self.ontology["intents"].items():
-            for keyword in keywords:
-                # Use WORD BOUNDARY regex
-                # Escape keyword just in case it has regex chars, though normalize removes them.
-                pattern = rf"\b{re.escape(normalize_text(keyword))}\b"
-                if re.search(pattern, normalized_text):
-                    return intent
-        return None
-
-    def extract_entities(self, text: str) -> dict:
+        return self.analyze(text)[0]
+
+    def extract_entities(self, text: Union[str, NormalizedMessage]) -> dict:
         """
         Extracts entities like Health Plans.
         Returns a dictionary of found entities.
         """
-        normalized_text = normalize_text(text)
-        found_entities = {}
-        
-        for entity_type, mapping in self.ontology["entities"].items():
-            for entity_id, keywords in mapping.items():
-                for keyword in keywords:
-                    if normalize_text(keyword) in normalized_text:
-                        found_entities[entity_type] = entity_id
-                        # Optimization: Break inner loop if specific ID found? 
-                        # For now, let's allow finding multiple if they exist, but overwrite for same type.
-        return found_entities
+        return self.analyze(text)[1]
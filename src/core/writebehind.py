@@ -0,0 +1,114 @@
+import atexit
+import copy
+import threading
+from typing import Dict, Optional, Set, Tuple
+
+from src.core import database
+
+class WriteBehindBuffer:
+    """
+    Keeps dirty sessions in memory and flushes them to SQLite in batched
+    transactions (group commit), every `flush_ms` or as soon as `max_batch`
+    sessions are dirty - whichever comes first.
+
+    Repeated updates to the same conversation between flushes coalesce into a
+    single row write. On a clean shutdown (atexit / close()) everything is
+    flushed; on a hard crash at most `flush_ms` of updates are lost.
+
+    A flush swaps the dirty set out and writes it without holding the lock, so
+    put()/get() (called from the event loop) never wait on the transaction's
+    fsync; the batch in flight stays readable until it is committed.
+    """
+
+    def __init__(self, flush_ms: int = 200, max_batch: int = 50):
+        self.flush_interval = flush_ms / 1000
+        self.max_batch = max_batch
+        self._dirty: Dict[Tuple[str, str], dict] = {}
+        self._flushing: Dict[Tuple[str, str], dict] = {} # The batch being written
+        self._discarded: Set[Tuple[str, str]] = set()    # Discarded while in _flushing
+        # Guards the dicts only (never held during I/O); _flush_lock serializes flushes
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="session-write-behind", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def put(self, client_id: str, phone: str, session: dict):
+        """Marks a session dirty. A snapshot is taken, so callers may keep mutating it."""
+        with self._lock:
+            self._dirty[(client_id, phone)] = copy.deepcopy(session)
+            full = len(self._dirty) >= self.max_batch
+        if full:
+            self._wakeup.set()
+
+    def get(self, client_id: str, phone: str) -> Optional[dict]:
+        """Returns the pending (not yet flushed) version of a session, if any."""
+        key = (client_id, phone)
+        with self._lock:
+            session = self._dirty.get(key)
+            if session is None:
+                session = self._flushing.get(key)
+            return copy.deepcopy(session) if session is not None else None
+
+    def discard(self, client_id: str, phone: str):
+        """Drops a pending write (e.g. the session was deleted)."""
+        key = (client_id, phone)
+        with self._lock:
+            self._dirty.pop(key, None)
+            if self._flushing.pop(key, None) is not None:
+                self._discarded.add(key) # Its write may land anyway: deleted again after the flush
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._dirty.keys() | self._flushing.keys())
+
+    def is_pending(self, client_id: str, phone: str) -> bool:
+        """True while a session has an unflushed write (its stored row is outdated)."""
+        key = (client_id, phone)
+        with self._lock:
+            return key in self._dirty or key in self._flushing
+
+    def flush(self) -> int:
+        """Writes every dirty session in one transaction. Returns how many were written."""
+        with self._flush_lock:
+            with self._lock:
+                if not self._dirty:
+                    return 0
+                self._flushing, self._dirty = self._dirty, {}
+                batch = [(client_id, phone, session) for (client_id, phone), session in self._flushing.items()]
+            try:
+                database.save_sessions(batch)
+            except Exception as e:
+                # Back to dirty (unless updated meanwhile); the next tick retries
+                print(f"[DB] Write-behind flush failed ({len(batch)} sessions): {e}")
+                with self._lock:
+                    for key, session in self._flushing.items():
+                        self._dirty.setdefault(key, session)
+                    self._flushing, self._discarded = {}, set()
+                return 0
+            with self._lock:
+                self._flushing = {}
+                discarded, self._discarded = self._discarded, set()
+            for client_id, phone in discarded:
+                database.delete_session(client_id, phone)
+            return len(batch)
+
+    def _run(self):
+        while not self._stopped:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def close(self):
+        """Stops the flusher thread and flushes what is left (flush-on-exit)."""
+        if self._stopped:
+            return
+        self._stopped = True
+        self._wakeup.set()
+        self._thread.join(timeout=5)
+        flushed = self.flush()
+        if flushed:
+            print(f"[DB] Write-behind flushed {flushed} sessions on shutdown.")
+        atexit.unregister(self.close)
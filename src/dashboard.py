@@ -28,10 +28,29 @@ if not st.session_state.auth:
 
 # --- CONFIG ---
 REFRESH_RATE = 10 # seconds (Updated to prevent flickering)
+PAGE_SIZE = 200 # Max cards per column
+DONE_STATUSES = ["AGUARDANDO_HUMANO", "FINALIZADO"] # Everything else is with the robot
 
 # --- DATA LOADER ---
-def load_data(client_id=None):
-    return database.get_all_sessions(client_id)
+# Counts and column filters run on indexed columns; only the listed cards are decoded.
+def load_counts(client_id):
+    return database.count_by_status(client_id)
+
+def load_sessions(client_id, status=None, exclude_status=None):
+    return database.list_sessions(client_id, status=status, exclude_status=exclude_status, limit=PAGE_SIZE)
+
+def finalize_session(client_id, session):
+    """
+    Closes a waiting session, unless the bot saved a turn since the card was loaded
+    (the card can be REFRESH_RATE seconds old). Returns False in that case.
+    """
+    # history only holds the card's copy of the last message, already stored
+    closed = dict(session, status="FINALIZADO", history=[])
+    try:
+        database.save_session(client_id, session["phone"], closed, expected_version=session["version"])
+        return True
+    except database.StaleSessionError:
+        return False
 
 def clear_data(client_id):
     database.clear_all_sessions(client_id)
@@ -42,14 +61,8 @@ def clear_data(client_id):
 # --- SIDEBAR: CLIENT SELECTION ---
 with st.sidebar:
     st.title("🏥 Unidades")
-    # Get all sessions to find unique clientIds
-    all_raw = database.get_all_sessions()
-    # Note: our get_all_sessions returns dict {phone: data}, and data now has client_id
-    # Wait, in database.py get_all_sessions returns all. 
-    # Let's adjust logic to find distinct client_ids.
-    
-    # We'll just list some common ones for now or extract from data
-    available_clients = sorted(list(set(s.get("client_id", "desconhecido") for s in all_raw.values())))
+    # Distinct clientIds straight from the primary key index
+    available_clients = database.list_client_ids()
     if not available_clients:
         available_clients = ["clinica_teste"]
         
@@ -71,13 +84,14 @@ with col_actions:
         st.rerun()
 
 # Load specific client data
-sessions = load_data(selected_client)
+counts = load_counts(selected_client)
 
+placeholder = st.empty()
 with placeholder.container():
     # KPI Row
-    total = len(sessions)
-    waiting = sum(1 for s in sessions.values() if s.get("status") == "AGUARDANDO_HUMANO")
-    in_progress = sum(1 for s in sessions.values() if s.get("status") not in ["AGUARDANDO_HUMANO", "FINALIZADO"])
+    total = sum(counts.values())
+    waiting = counts.get("AGUARDANDO_HUMANO", 0)
+    in_progress = total - waiting - counts.get("FINALIZADO", 0)
     
     c1, c2, c3 = st.columns(3)
     c1.metric("Total Sessões", total)
@@ -91,7 +105,7 @@ with placeholder.container():
     
     with col_robot:
         st.subheader("🤖 Em Atendimento")
-        robot_sessions = [s for s in sessions.values() if s.get("status") not in ["AGUARDANDO_HUMANO", "FINALIZADO"]]
+        robot_sessions = load_sessions(selected_client, exclude_status=DONE_STATUSES)
         if not robot_sessions:
             st.info("Nenhuma sessão ativa.")
         
@@ -114,14 +128,14 @@ with placeholder.container():
 
     with col_human:
         st.subheader("👨‍⚕️ Aguardando Humano")
-        human_sessions = [s for s in sessions.values() if s.get("status") == "AGUARDANDO_HUMANO"]
+        human_sessions = load_sessions(selected_client, status="AGUARDANDO_HUMANO")
         if not human_sessions:
             st.info("Fila vazia. 🙌")
         
         for data in human_sessions:
             phone = data.get("phone")
-            created_at = data.get("created_at", time.time())
-            elapsed_min = (time.time() - created_at) / 60
+            waiting_since = data.get("waiting_since") or time.time()
+            elapsed_min = (time.time() - waiting_since) / 60
             
             with st.container(border=True):
                 patient_name = data.get("data", {}).get("name")
@@ -136,15 +150,17 @@ with placeholder.container():
                     st.info("Dentro do prazo")
                 
                 if st.button("✅ Finalizar", key=f"btn_finalize_{selected_client}_{phone}"):
-                    data["status"] = "FINALIZADO"
-                    database.save_session(selected_client, phone, data)
-                    st.toast(f"Sessão {phone} finalizada!")
+                    if finalize_session(selected_client, data):
+                        st.toast(f"Sessão {phone} finalizada!")
+                    else:
+                        st.warning(f"⚠️ A sessão {phone} mudou (nova mensagem) desde que foi carregada. "
+                                   "Recarregando - confira antes de finalizar.")
                     time.sleep(1)
                     st.rerun()
 
     with col_done:
         st.subheader("✅ Finalizados")
-        finalized_count = sum(1 for s in sessions.values() if s.get("status") == "FINALIZADO")
+        finalized_count = counts.get("FINALIZADO", 0)
         if finalized_count > 0:
             st.metric("Atendimentos Concluídos", finalized_count)
         else:
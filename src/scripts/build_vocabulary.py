@@ -0,0 +1,89 @@
+import argparse
+import os
+import sys
+from collections import Counter
+from typing import Dict, Iterable, Optional
+
+# Allow running as a plain script from the repo root
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from src.config import FUZZY_VOCABULARY_PATH
+from src.core import database
+from src.core.fuzzy import DEFAULT_THRESHOLDS, allowed_distance, bounded_distance
+from src.core.message import NormalizedMessage, normalize_text
+from src.core.triage import ONTOLOGY
+
+def count_words(client_id=None, max_rows=None) -> Counter:
+    """How often each normalized word occurs in the user messages logged in the messages table."""
+    counts = Counter()
+    for rows, entry in enumerate(database.iter_messages(client_id, role="user"), 1):
+        counts.update(NormalizedMessage(entry["message"]).normalized.split())
+        if max_rows and rows >= max_rows:
+            break
+    return counts
+
+def keyword_words(ontology: dict = ONTOLOGY) -> set:
+    keywords = [k for keywords in ontology["intents"].values() for k in keywords]
+    keywords += [k for mapping in ontology["entities"].values() for keywords in mapping.values() for k in keywords]
+    return {word for keyword in keywords for word in normalize_text(keyword).split(" ")}
+
+def build_vocabulary(counts: Dict[str, int], keywords: Iterable[str], min_count: int = 5, typo_share: float = 0.1,
+                     thresholds: Optional[dict] = None) -> Dict[str, int]:
+    """
+    Words seen at least min_count times, with their counts. Only words fuzzy matching
+    could misread are kept: letters only, at least min_length long, not a keyword word.
+    A word within a keyword's edit distance is taken for a misspelling of it (and left
+    out) while it is rarer than typo_share of that keyword: "resultdo" next to
+    "resultado". A real word that is rare in this corpus is missed the same way; add
+    it to the file by hand.
+    """
+    thresholds = thresholds or DEFAULT_THRESHOLDS
+    limits = {word: allowed_distance(len(word), thresholds) for word in keywords if word.isalpha()}
+    vocabulary = {}
+    for word, count in counts.items():
+        if count < min_count or word in limits or not word.isalpha() or len(word) < thresholds["min_length"]:
+            continue
+        misspelling = any(count < typo_share * counts.get(keyword, 0) and bounded_distance(word, keyword, limit) <= limit
+                          for keyword, limit in limits.items() if limit)
+        if not misspelling:
+            vocabulary[word] = count
+    return vocabulary
+
+def read_vocabulary_file(path: str) -> Dict[str, int]:
+    """The file's words with their counts (0 for a word listed by hand without one)."""
+    words = {}
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                fields = line.split("#", 1)[0].split()
+                if fields:
+                    words[fields[0].lower()] = int(fields[1]) if len(fields) > 1 and fields[1].isdigit() else 0
+    return words
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Add the real words of the logged messages to the fuzzy vocabulary.")
+    parser.add_argument("--client", help="only this client_id's messages")
+    parser.add_argument("--output", default=FUZZY_VOCABULARY_PATH)
+    parser.add_argument("--min-count", type=int, default=5, help="occurrences before a word counts as real")
+    parser.add_argument("--typo-share", type=float, default=0.1,
+                        help="a word near a keyword and rarer than this share of it is a misspelling")
+    parser.add_argument("--max-rows", type=int)
+    args = parser.parse_args()
+
+    counts = count_words(args.client, args.max_rows)
+    found = build_vocabulary(counts, keyword_words(), args.min_count, args.typo_share)
+    # Words already in the file (including the ones listed by hand) are kept
+    words = read_vocabulary_file(args.output)
+    added = sorted(set(found) - set(words))
+    for word, count in found.items():
+        words[word] = max(words.get(word, 0), count)
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        f.write("# Real words never fuzzy-matched by triage (src/core/fuzzy.py): \"word [count]\" per line.\n")
+        f.write("# Written by src/scripts/build_vocabulary.py; words without a count were added by hand.\n")
+        for word, count in sorted(words.items(), key=lambda item: (-item[1], item[0])):
+            f.write(f"{word} {count}\n" if count else f"{word}\n")
+    print(f"[VOCABULARY] {sum(counts.values())} words read, {len(added)} added: {', '.join(added[:20])}"
+          f"{' ...' if len(added) > 20 else ''}")
+    print(f"[VOCABULARY] {len(words)} words written to {args.output}.")
@@ -0,0 +1,54 @@
+import argparse
+import csv
+import json
+import os
+import sys
+from typing import Optional, Sequence, TextIO
+
+# Allow running as a plain script from the repo root
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from src.core import database
+
+# CSV needs a fixed header; these come straight from columns (no blob decode)
+DEFAULT_CSV_FIELDS = ("client_id", "phone", "status", "last_updated", "waiting_since", "interaction_count")
+
+def export_sessions(out: TextIO, fmt: str = "ndjson", client_id: Optional[str] = None,
+                    fields: Optional[Sequence[str]] = None, batch_size: int = 500) -> int:
+    """
+    Streams sessions to `out` as NDJSON (one session per line) or CSV.
+    Memory stays constant: rows are read in batches and written one by one.
+    Returns how many sessions were written.
+    """
+    if fmt == "csv":
+        fields = list(fields or DEFAULT_CSV_FIELDS)
+        writer = csv.DictWriter(out, fieldnames=fields)
+        writer.writeheader()
+    count = 0
+    for session in database.iter_sessions(client_id, fields=fields, batch_size=batch_size):
+        if fmt == "csv":
+            # Nested values (e.g. "data") are written as JSON inside the cell
+            writer.writerow({k: json.dumps(v, ensure_ascii=False) if isinstance(v, (dict, list)) else v
+                             for k, v in session.items()})
+        else:
+            out.write(json.dumps(session, ensure_ascii=False) + "\n")
+        count += 1
+    return count
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stream sessions out of the database as NDJSON or CSV.")
+    parser.add_argument("--client", help="only this client_id")
+    parser.add_argument("--format", choices=("ndjson", "csv"), default="ndjson")
+    parser.add_argument("--fields", help="comma-separated keys, e.g. phone,status,data")
+    parser.add_argument("--output", help="file to write (default: stdout)")
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    fields = args.fields.split(",") if args.fields else None
+    out = open(args.output, "w", encoding="utf-8", newline="") if args.output else sys.stdout
+    try:
+        written = export_sessions(out, args.format, args.client, fields, args.batch_size)
+    finally:
+        if args.output:
+            out.close()
+    print(f"[EXPORT] {written} sessions written.", file=sys.stderr)
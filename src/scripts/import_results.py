@@ -0,0 +1,36 @@
+import argparse
+import os
+import sys
+
+# Allow running as a plain script from the repo root
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from src.config import IMPORT_BATCH_SIZE
+from src.core.importer import import_stream
+from src.core.results import ResultsStore
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stream an LIS export (CSV or NDJSON) into the results store.")
+    parser.add_argument("path", help="export file ('-' for stdin)")
+    parser.add_argument("--format", choices=("csv", "ndjson"), help="default: from the file extension")
+    parser.add_argument("--client", help="client_id for rows that carry none")
+    parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE)
+    parser.add_argument("--db", help="results database (default: RESULTS_DB_PATH)")
+    args = parser.parse_args()
+
+    fmt = args.format or ("ndjson" if args.path.endswith((".ndjson", ".jsonl")) else "csv")
+    store = ResultsStore(args.db) if args.db else ResultsStore()
+    stream = sys.stdin.buffer if args.path == "-" else open(args.path, "rb")
+
+    def progress(report):
+        print(f"[IMPORT] ... {report['rows']} rows ({report['rows_per_s']} rows/s)", file=sys.stderr)
+
+    try:
+        report = import_stream(store, stream, fmt, client_id=args.client, batch_size=args.batch_size,
+                               source=f"import:{os.path.basename(args.path)}", on_batch=progress)
+    finally:
+        if stream is not sys.stdin.buffer:
+            stream.close()
+        store.close()
+    print(f"[IMPORT] {report['rows']} rows in {report['seconds']}s ({report['rows_per_s']} rows/s): "
+          f"{report['written']} written, {report['skipped']} unchanged, {report['errors']} rejected.", file=sys.stderr)
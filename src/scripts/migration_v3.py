@@ -0,0 +1,67 @@
+import os
+import sys
+
+# Allow running as a plain script from the repo root
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from src.core import database, codec
+
+BATCH_SIZE = 500
+
+def migrate(batch_size: int = BATCH_SIZE):
+    """Moves inline session["history"] lists into the append-only messages table."""
+    if not os.path.exists(database.DB_PATH):
+        print(f"[MIGRATION] Database {database.DB_PATH} does not exist. Skipping.")
+        return
+
+    # Creates the messages table if needed
+    database.init_db()
+    conn = database.get_connection()
+
+    print("[MIGRATION] Starting migration to v3 (history -> messages table)...")
+
+    # Stream the table in rowid order, one batch per transaction, so memory stays
+    # flat and the webhook can keep writing between batches.
+    last_rowid = 0
+    migrated_sessions = 0
+    migrated_messages = 0
+    while True:
+        rows = conn.execute('''
+            SELECT rowid, client_id, phone, data, updated_at FROM sessions
+            WHERE rowid > ? ORDER BY rowid LIMIT ?
+        ''', (last_rowid, batch_size)).fetchall()
+        if not rows:
+            break
+        last_rowid = rows[-1]["rowid"]
+
+        with conn:
+            for row in rows:
+                try:
+                    s_data = codec.decode(row["data"])
+                except ValueError as e:
+                    print(f" [ERR] Failed to decode session {row['client_id']}/{row['phone']}: {e}")
+                    continue
+
+                history = s_data.pop("history", None)
+                if history is None:
+                    continue # Already migrated
+
+                # Entries without a timestamp are dated by the session's last save (kept in order by row id)
+                conn.executemany(database._APPEND_MESSAGE_SQL, [
+                    (row["client_id"], row["phone"], entry.get("timestamp") or row["updated_at"] or 0, entry.get("role"),
+                     entry.get("message"), entry.get("intent"), entry.get("id"))
+                    for entry in history
+                ])
+                # Rewrite the blob without history; updated_at is left alone so retention is unaffected
+                conn.execute("UPDATE sessions SET data = ?, version = version + 1 WHERE rowid = ?",
+                             (codec.encode(s_data), row["rowid"]))
+                migrated_sessions += 1
+                migrated_messages += len(history)
+
+        print(f"[MIGRATION] ... up to rowid {last_rowid}: {migrated_sessions} sessions, {migrated_messages} messages")
+
+    print(f"[MIGRATION] Successfully moved {migrated_messages} messages out of {migrated_sessions} sessions.")
+    print("[MIGRATION] Done.")
+
+if __name__ == "__main__":
+    migrate()
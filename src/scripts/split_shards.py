@@ -0,0 +1,66 @@
+import argparse
+import os
+import sys
+
+# Allow running as a plain script from the repo root
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from src.core import database
+
+# Per-client tables; in shard mode each is read from the client's shard only
+TABLES = ("sessions", "messages", "outbox", "inbox", "seen_messages")
+
+def _copy(conn, table: str, client_id: str) -> int:
+    # Explicit column list: the main file may have gained its columns in a different order
+    columns = ", ".join(row[1] for row in conn.execute(f"PRAGMA main.table_info({table})"))
+    return conn.execute(f'''
+        INSERT OR IGNORE INTO main.{table} ({columns})
+        SELECT {columns} FROM main_db.{table} WHERE client_id = ?
+    ''', (client_id,)).rowcount
+
+def split(purge: bool = False):
+    """
+    Copies every client's rows (sessions, messages, and the outbox, inbox and
+    seen_messages queues, which shard mode also reads from the shards only) from
+    data/sessions.db into its own shard (DB_SHARD_DIR/<client_id>.db).
+    Safe to re-run: existing rows are kept.
+    """
+    if not os.path.exists(database.DB_PATH):
+        print(f"[SHARDS] Database {database.DB_PATH} does not exist. Skipping.")
+        return
+
+    # Main database stays the source; shards are reached through the router
+    database.SHARD_MODE = False
+    database.init_db()
+    main = database.get_connection()
+    # Not just list_client_ids(): a client may have queued replies or messages and no session
+    client_ids = sorted({row[0] for table in TABLES for row in main.execute(f"SELECT DISTINCT client_id FROM {table}")})
+    database.SHARD_MODE = True
+    os.makedirs(database.SHARD_DIR, exist_ok=True)
+
+    print(f"[SHARDS] Splitting {len(client_ids)} clients into {database.SHARD_DIR} ...")
+    for client_id in client_ids:
+        conn = database.get_connection(client_id)
+        # ATTACH lets SQLite copy the rows file-to-file without decoding any blob
+        conn.execute("ATTACH DATABASE ? AS main_db", (database.DB_PATH,))
+        try:
+            with conn:
+                copied = {table: _copy(conn, table, client_id) for table in TABLES}
+        finally:
+            conn.execute("DETACH DATABASE main_db")
+        print(f"[SHARDS] ... {client_id}: " + ", ".join(f"{count} {table}" for table, count in copied.items()))
+
+    if purge:
+        database.SHARD_MODE = False
+        database.clear_all_sessions()
+        with main:
+            for table in TABLES[2:]:
+                main.executemany(f"DELETE FROM {table} WHERE client_id = ?", [(client_id,) for client_id in client_ids])
+        print(f"[SHARDS] Purged the copied rows from {database.DB_PATH}.")
+
+    print("[SHARDS] Done. Set DB_SHARD_MODE=true to serve from the shards.")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Split data/sessions.db into one SQLite file per client_id.")
+    parser.add_argument("--purge", action="store_true", help="delete the rows from the main database once copied")
+    split(purge=parser.parse_args().purge)
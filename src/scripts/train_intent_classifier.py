@@ -0,0 +1,124 @@
+import argparse
+import csv
+import json
+import os
+import random
+import sys
+import time
+from collections import Counter
+
+# Allow running as a plain script from the repo root
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from src.config import CLASSIFIER_MODEL_PATH, CLASSIFIER_FEATURE_BITS, CLASSIFIER_THRESHOLD
+from src.core import database
+from src.core.classifier import NO_INTENT, IntentClassifier
+from src.core.message import NormalizedMessage
+from src.core.triage import Triage
+
+def load_labeled(path: str):
+    """
+    (normalized message, label) pairs labeled by people: a CSV with "text" and "intent"
+    columns, or NDJSON lines {"text": ..., "intent": ...}. A blank intent is NO_INTENT.
+    """
+    with open(path, encoding="utf-8", newline="") as f:
+        if path.endswith((".ndjson", ".jsonl")):
+            rows = [json.loads(line) for line in f if line.strip()]
+        else:
+            rows = list(csv.DictReader(f))
+    examples = []
+    for row in rows:
+        msg = NormalizedMessage(row.get("text") or "")
+        if msg.normalized:
+            examples.append((msg.normalized, (row.get("intent") or "").strip() or NO_INTENT))
+    return examples
+
+def load_examples(client_id=None, max_rows=None):
+    """
+    (normalized message, label) pairs from the user messages logged in the messages
+    table. The logged intent is only kept where the keyword rules alone still give
+    it: an intent the classifier (or an older rule) supplied would train the model
+    on its own output. These labels copy the keyword rules, see class_balance().
+    """
+    keywords = Triage(classifier=None)
+    examples, skipped = [], 0
+    for entry in database.iter_messages(client_id, role="user"):
+        msg = NormalizedMessage(entry["message"])
+        if not msg.normalized:
+            continue
+        if keywords.detect_intent(msg) != entry["intent"]:
+            skipped += 1
+            continue
+        examples.append((msg.normalized, entry["intent"] or NO_INTENT))
+        if max_rows and len(examples) >= max_rows:
+            break
+    if skipped:
+        print(f"[TRAIN] Skipped {skipped} messages whose logged intent the keyword rules do not give.")
+    return examples
+
+def class_balance(examples):
+    """Examples per label, most common first."""
+    return Counter(label for _, label in examples).most_common()
+
+def evaluate(model: IntentClassifier, examples, threshold: float, batch_size: int = 1024):
+    """Replays held-out messages in batches: accuracy, coverage above the threshold, and speed."""
+    correct = confident = confident_correct = 0
+    started = time.perf_counter()
+    for start in range(0, len(examples), batch_size):
+        batch = examples[start:start + batch_size]
+        for (_, label), (predicted, probability) in zip(batch, model.predict([text for text, _ in batch])):
+            hit = (predicted or NO_INTENT) == label
+            correct += hit
+            if probability >= threshold:
+                confident += 1
+                confident_correct += hit
+    elapsed = time.perf_counter() - started
+    total = max(len(examples), 1)
+    print(f"[TRAIN] Held-out: {len(examples)} messages, accuracy {correct / total:.3f}, "
+          f"{confident / total:.1%} above {threshold} with accuracy {confident_correct / max(confident, 1):.3f}, "
+          f"{elapsed / total * 1e6:.1f} us/message")
+
+if __name__ == "__main__":
+    # The model only helps on messages the keywords miss, and the logged intents of those
+    # are all NONE: without --labels it learns to repeat the keyword rules and adds nothing.
+    parser = argparse.ArgumentParser(description="Train the hashed n-gram intent classifier on labeled messages.")
+    parser.add_argument("--labels", action="append", default=[],
+                        help="CSV (text,intent) or NDJSON file of messages labeled by people; repeatable")
+    parser.add_argument("--from-messages", action="store_true",
+                        help="also use the logged messages, labeled by the keyword rules (bootstrap only)")
+    parser.add_argument("--client", help="only this client_id's messages")
+    parser.add_argument("--output", default=CLASSIFIER_MODEL_PATH)
+    parser.add_argument("--feature-bits", type=int, default=CLASSIFIER_FEATURE_BITS)
+    parser.add_argument("--epochs", type=int, default=10)
+    parser.add_argument("--holdout", type=float, default=0.1, help="share of messages kept for evaluation")
+    parser.add_argument("--max-rows", type=int)
+    args = parser.parse_args()
+
+    if not args.labels and not args.from_messages:
+        parser.error("give --labels (messages labeled by people) and/or --from-messages")
+    examples = [example for path in args.labels for example in load_labeled(path)]
+    print(f"[TRAIN] {len(examples)} labeled messages from {', '.join(args.labels) or 'no file'}.")
+    if args.from_messages:
+        examples += load_examples(args.client, args.max_rows)
+        if not args.labels:
+            print("[TRAIN] WARNING: keyword-derived labels only. The model will mimic the keyword rules and "
+                  "predict NONE for the messages they miss; add --labels before relying on it.")
+    balance = class_balance(examples)
+    print("[TRAIN] Class balance: " + ", ".join(f"{label} {count} ({count / max(len(examples), 1):.0%})"
+                                                for label, count in balance))
+    labels = sorted(label for label, _ in balance)
+    if len(labels) < 2:
+        print(f"[TRAIN] Need messages of at least two intents, found {labels}. Nothing written.")
+        sys.exit(1)
+    random.Random(0).shuffle(examples)
+    cut = int(len(examples) * (1 - args.holdout))
+    train, held_out = examples[:cut], examples[cut:]
+
+    started = time.perf_counter()
+    model = IntentClassifier(labels, 1 << args.feature_bits)
+    model.fit([text for text, _ in train], [label for _, label in train], epochs=args.epochs)
+    print(f"[TRAIN] {len(train)} messages, labels {labels}, trained in {time.perf_counter() - started:.1f}s")
+    if held_out:
+        evaluate(model, held_out, CLASSIFIER_THRESHOLD)
+    model.save(args.output)
+    print(f"[TRAIN] Model written to {args.output} ({os.path.getsize(args.output) // 1024} KB).")
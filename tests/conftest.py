@@ -0,0 +1,33 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# Adjust path to import src
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from src.core import database, results
+
+def pytest_configure(config):
+    # Some test modules build the app (and its SessionManager) at import time: point
+    # the stores at a throwaway directory before any of them is collected, so a test
+    # run never writes data/sessions.db or data/results.db
+    scratch = tempfile.mkdtemp(prefix="lab-tests-")
+    database.DB_PATH = os.path.join(scratch, "sessions.db")
+    database.SHARD_DIR = os.path.join(scratch, "shards")
+    results.RESULTS_DB_PATH = os.path.join(scratch, "results.db")
+
+@pytest.fixture
+def temp_db(tmp_path, monkeypatch):
+    """
+    A fresh, initialized sessions.db (plus shard dir and results.db) under tmp_path.
+    The previous paths are restored after the test. Yields tmp_path.
+    """
+    monkeypatch.setattr(database, "DB_PATH", str(tmp_path / "sessions.db"))
+    monkeypatch.setattr(database, "SHARD_DIR", str(tmp_path / "shards"))
+    monkeypatch.setattr(database, "SHARD_MODE", False)
+    monkeypatch.setattr(results, "RESULTS_DB_PATH", str(tmp_path / "results.db"))
+    database.init_db()
+    yield tmp_path
+    database.close_connections()
@@ -0,0 +1,135 @@
+import sys
+import os
+import asyncio
+import time
+
+import httpx
+
+# Adjust path to import src
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from src.core import database
+from src.core.breaker import CircuitBreaker, CLOSED, OPEN, HALF_OPEN
+from src.core.outbox import OutboxWorker
+from src.core.replier import CIRCUIT_OPEN, AsyncReplier
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def test_opens_after_threshold_and_probes_once():
+    clock = FakeClock()
+    breaker = CircuitBreaker("c1", failure_threshold=3, reset_timeout_s=30, clock=clock)
+    for _ in range(2):
+        assert breaker.allow()
+        breaker.record_failure()
+    assert breaker.state == CLOSED
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow() and not breaker.available()
+    assert breaker.snapshot() == {"state": OPEN, "failures": 3, "rejected": 1, "retry_in_s": 30.0}
+
+    clock.now = 30.0
+    assert breaker.available()
+    assert breaker.allow() # The probe
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow() and not breaker.available() # Only one probe at a time
+    breaker.record_failure()
+    assert breaker.state == OPEN # A failed probe opens it for another reset_timeout_s
+    clock.now = 59.0
+    assert not breaker.allow()
+
+    clock.now = 60.0
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.snapshot()["state"] == CLOSED and breaker.failures == 0
+    assert breaker.allow()
+
+def test_success_resets_the_failure_count():
+    breaker = CircuitBreaker("c1", failure_threshold=2, clock=FakeClock())
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+
+def failing_gateway(calls, status=503):
+    async def handle(request):
+        calls.append(request.url.path)
+        return httpx.Response(status, text="down")
+    return AsyncReplier(transport=httpx.MockTransport(handle))
+
+def test_replier_fails_fast_per_client_when_open():
+    calls = []
+    replier = failing_gateway(calls)
+    replier.breakers["c1"] = CircuitBreaker("c1", failure_threshold=2, reset_timeout_s=60)
+
+    async def scenario():
+        for _ in range(4):
+            await replier.deliver("c1", "A", "oi")
+        assert await replier.deliver("c1", "A", "oi") == (False, CIRCUIT_OPEN, True)
+        assert (await replier.deliver("c2", "A", "oi"))[1] != CIRCUIT_OPEN # Other tenants are unaffected
+        await replier.aclose()
+    asyncio.run(scenario())
+    assert len([path for path in calls if path.endswith("/c1")]) == 2
+    assert replier.stats["rejected"] == 3
+    assert replier.circuits()["c1"]["state"] == OPEN
+    assert replier.circuits()["c2"]["state"] == CLOSED
+
+def test_client_errors_do_not_open_the_circuit():
+    replier = failing_gateway([], status=400)
+    replier.breakers["c1"] = CircuitBreaker("c1", failure_threshold=1)
+
+    async def scenario():
+        for _ in range(3):
+            assert (await replier.deliver("c1", "A", "oi"))[2] is False
+        await replier.aclose()
+    asyncio.run(scenario())
+    assert replier.circuits()["c1"]["state"] == CLOSED
+
+def test_outbox_holds_replies_while_open(temp_db):
+    calls = []
+    replier = failing_gateway(calls)
+    breaker = replier.breakers["c1"] = CircuitBreaker("c1", failure_threshold=1, reset_timeout_s=60)
+    worker = OutboxWorker(replier, max_attempts=2, backoff_base_s=0)
+
+    async def scenario():
+        await worker.enqueue("c1", "A", "first")
+        now = time.time()
+        await worker.flush(now) # Fails and opens the circuit
+        await worker.enqueue("c1", "B", "other")
+        await worker.flush(now + 1000) # Both held: the circuit stays open for 60 s
+        await replier.aclose()
+    asyncio.run(scenario())
+    assert len(calls) == 1
+    assert breaker.state == OPEN
+    conn = database.get_connection()
+    attempts = sorted(row[0] for row in conn.execute("SELECT attempts FROM outbox WHERE status = 'pending'"))
+    assert attempts == [0, 1] # Nothing dead-lettered, no attempts spent while open
+
+def test_open_tenant_does_not_block_others(temp_db):
+    calls = []
+    async def handle(request):
+        calls.append(request.url.path)
+        return httpx.Response(200, text="ok")
+    replier = AsyncReplier(transport=httpx.MockTransport(handle))
+    replier.breakers["bad"] = CircuitBreaker("bad", failure_threshold=1, reset_timeout_s=60)
+    replier.breakers["bad"].record_failure()
+    worker = OutboxWorker(replier, batch_size=5)
+
+    async def scenario():
+        for i in range(10): # Older than the good tenant's reply, so first in line
+            await worker.enqueue("bad", f"R{i}", "oi")
+        await worker.enqueue("good", "A", "oi")
+        assert await worker.drain_once() == 1
+        await worker.flush()
+        await replier.aclose()
+    asyncio.run(scenario())
+    assert [path.rsplit("/", 1)[-1] for path in calls] == ["good"]
+
+if __name__ == "__main__":
+    import pytest # temp_db is a fixture (tests/conftest.py)
+    sys.exit(pytest.main([__file__, "-q"]))
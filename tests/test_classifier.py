@@ -0,0 +1,74 @@
+import sys
+import os
+import tempfile
+
+import pytest
+
+# Adjust path to import src
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+np = pytest.importorskip("numpy") # Optional dependency (pip install .[ml])
+
+from src.core import database
+from src.core.classifier import NO_INTENT, IntentClassifier, features
+from src.core.triage import Triage
+from src.scripts.train_intent_classifier import class_balance, load_examples, load_labeled
+
+EXAMPLES = [
+    ("quanto fica o exame de sangue", "ORCAMENTO"), ("me passa o precinho do hemograma", "ORCAMENTO"),
+    ("saiu o exame da minha filha", "RESULTADO"), ("ja posso pegar o exame da minha filha", "RESULTADO"),
+    ("voces vem em casa fazer a coleta", "AGENDAMENTO"), ("podem vir em casa amanha cedo", "AGENDAMENTO"),
+    ("voces abrem no sabado", NO_INTENT), ("qual o endereco de voces", NO_INTENT),
+]
+
+def train():
+    labels = sorted({label for _, label in EXAMPLES})
+    return IntentClassifier(labels, 1 << 12).fit([text for text, _ in EXAMPLES] * 20,
+                                                 [label for _, label in EXAMPLES] * 20, epochs=5)
+
+def test_features_are_stable_and_bounded():
+    ids = features("saiu o exame", 1 << 12)
+    assert ids == features("saiu o exame", 1 << 12) # crc32, not hash(): same ids in every process
+    assert all(0 <= i < 1 << 12 for i in ids) and features("", 1 << 12) == []
+
+def test_train_predict_and_reload():
+    model = train()
+    predictions = model.predict(["quanto fica o hemograma", "saiu o exame do meu filho", "voces abrem domingo", ""])
+    assert [intent for intent, _ in predictions[:3]] == ["ORCAMENTO", "RESULTADO", None]
+    assert 0 < predictions[3][1] < 1 # No features: scored on the bias alone
+
+    path = os.path.join(tempfile.mkdtemp(), "intent_model.npz")
+    model.save(path)
+    assert IntentClassifier.load(path).predict(["saiu o exame"]) == model.predict(["saiu o exame"])
+
+def test_triage_falls_back_on_confident_predictions():
+    model = train()
+    assert Triage(classifier=None).analyze("me passa o precinho do exame") == (None, {})
+    assert Triage(classifier=model, classifier_threshold=0.5).analyze("me passa o precinho do exame")[0] == "ORCAMENTO"
+    assert Triage(classifier=model, classifier_threshold=1.01).analyze("me passa o precinho do exame")[0] is None
+    # Keywords still win
+    assert Triage(classifier=model, classifier_threshold=0.0).detect_intent("resultado") == "RESULTADO"
+
+def test_load_examples_from_messages_table(temp_db):
+    database.save_session("c1", "5581", {"status": "MENU_PRINCIPAL", "data": {}, "history": [
+        {"timestamp": 1.0, "role": "user", "message": "Quero o Orçamento!", "intent": "ORCAMENTO"},
+        {"timestamp": 2.0, "role": "bot", "message": "Certo", "intent": None},
+        {"timestamp": 3.0, "role": "user", "message": "voces abrem sabado", "intent": None},
+        # Intent supplied by the classifier itself (no keyword gives it): never trained on
+        {"timestamp": 4.0, "role": "user", "message": "me passa o precinho", "intent": "ORCAMENTO"},
+    ]})
+    examples = load_examples()
+    assert examples == [("quero o orcamento", "ORCAMENTO"), ("voces abrem sabado", NO_INTENT)]
+    assert class_balance(examples + [("oi", NO_INTENT)]) == [(NO_INTENT, 2), ("ORCAMENTO", 1)]
+
+def test_load_labeled_file(tmp_path):
+    path = tmp_path / "labels.csv"
+    path.write_text("text,intent\nMe passa o precinho?,ORCAMENTO\nvoces abrem sabado,\n,RESULTADO\n", encoding="utf-8")
+    assert load_labeled(str(path)) == [("me passa o precinho", "ORCAMENTO"), ("voces abrem sabado", NO_INTENT)]
+    path = tmp_path / "labels.ndjson"
+    path.write_text('{"text": "saiu o exame?", "intent": "RESULTADO"}\n\n', encoding="utf-8")
+    assert load_labeled(str(path)) == [("saiu o exame", "RESULTADO")]
+
+if __name__ == "__main__":
+    import pytest # temp_db is a fixture (tests/conftest.py)
+    sys.exit(pytest.main([__file__, "-q"]))
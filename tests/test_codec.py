@@ -0,0 +1,52 @@
+import sys
+import os
+import json
+
+# Adjust path to import src
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from src.core import codec
+
+SESSION = {
+    "client_id": "clinica_teste",
+    "phone": "558199999999",
+    "status": "ORCAMENTO_PEDIR_PLANO",
+    "data": {"plano": "CASSI", "status": "kept as-is inside data"},
+    "last_updated": 1767225600.5,
+    "interaction_count": 3,
+    "last_action": None,
+}
+
+def test_roundtrip_and_legacy_json():
+    encoded = codec.encode(SESSION)
+    assert isinstance(encoded, bytes) and encoded[0] == codec.CODEC_COMPACT
+    assert codec.decode(encoded) == SESSION
+    assert len(encoded) < len(json.dumps(SESSION, ensure_ascii=False).encode("utf-8"))
+
+    # Rows written before codecs existed are plain JSON text
+    assert codec.decode(json.dumps(SESSION, ensure_ascii=False)) == SESSION
+    assert codec.decode(codec.encode(SESSION, codec="json")) == SESSION
+
+def test_large_history_is_compressed():
+    big = dict(SESSION, history=[
+        {"timestamp": 1767225600 + i, "role": "user", "message": "Quero saber o preço do hemograma", "intent": "ORCAMENTO"}
+        for i in range(200)
+    ])
+    encoded = codec.encode(big)
+    assert encoded[0] in (codec.CODEC_ZLIB, codec.CODEC_ZSTD)
+    assert codec.decode(encoded) == big
+    assert len(encoded) < len(json.dumps(big, ensure_ascii=False)) / 5
+
+def test_corrupt_blob_raises_value_error():
+    for raw in (b"", b"\x7f{}", bytes((codec.CODEC_ZLIB,)) + b"not zlib"):
+        try:
+            codec.decode(raw)
+        except ValueError:
+            continue
+        raise AssertionError(f"decode({raw!r}) should fail")
+
+if __name__ == "__main__":
+    test_roundtrip_and_legacy_json()
+    test_large_history_is_compressed()
+    test_corrupt_blob_raises_value_error()
+    print("✅ Codec tests passed")
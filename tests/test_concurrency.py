@@ -0,0 +1,89 @@
+import sys
+import os
+import asyncio
+import time
+
+# Adjust path to import src
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from src.core import database
+from src.core.locks import StripedLocks
+from src.core.session import SessionManager
+
+def test_save_session_expected_version(temp_db):
+    assert database.save_session("clinica_teste", "5581", {"status": "MENU_PRINCIPAL"}, expected_version=0) == 1
+    assert database.save_session("clinica_teste", "5581", {"status": "MENU_PRINCIPAL"}, expected_version=1) == 2
+    for expected in (0, 1):
+        try:
+            database.save_session("clinica_teste", "5581", {"status": "LOST"}, expected_version=expected)
+            assert False, "stale save must raise"
+        except database.StaleSessionError:
+            pass
+    assert database.get_session("clinica_teste", "5581")["status"] == "MENU_PRINCIPAL"
+
+    # A session deleted meanwhile is not resurrected
+    database.delete_session("clinica_teste", "5581")
+    try:
+        database.save_session("clinica_teste", "5581", {"status": "LOST"}, expected_version=2)
+        assert False, "stale save must raise"
+    except database.StaleSessionError:
+        assert database.get_session("clinica_teste", "5581") is None
+
+def test_listed_version_guards_an_operator_save(temp_db):
+    database.save_session("clinica_teste", "5581", {"status": "AGUARDANDO_HUMANO", "last_updated": 1})
+    card = database.list_sessions("clinica_teste", status="AGUARDANDO_HUMANO")[0]
+    assert card["version"] == 1
+
+    # A bot turn lands after the dashboard loaded the card: closing it must not overwrite that turn
+    database.save_session("clinica_teste", "5581", {"status": "MENU_PRINCIPAL", "last_updated": 2}, expected_version=1)
+    try:
+        database.save_session("clinica_teste", "5581", dict(card, status="FINALIZADO", history=[]),
+                              expected_version=card["version"])
+        assert False, "stale save must raise"
+    except database.StaleSessionError:
+        pass
+    assert database.get_session("clinica_teste", "5581")["status"] == "MENU_PRINCIPAL"
+
+def test_striped_locks_serialize_one_conversation_only():
+    locks = StripedLocks(stripes=64)
+    trace = []
+
+    async def handle(phone, tag):
+        async with locks.hold_async("clinica_teste", phone):
+            trace.append(("start", phone, tag))
+            await asyncio.sleep(0.01)
+            trace.append(("end", phone, tag))
+
+    async def scenario():
+        await asyncio.gather(handle("1", "a"), handle("1", "b"), handle("2", "c"))
+
+    asyncio.run(scenario())
+    same = [event for event in trace if event[1] == "1"]
+    assert same in ([("start", "1", "a"), ("end", "1", "a"), ("start", "1", "b"), ("end", "1", "b")],
+                    [("start", "1", "b"), ("end", "1", "b"), ("start", "1", "a"), ("end", "1", "a")])
+    if locks._stripe("clinica_teste", "2") != locks._stripe("clinica_teste", "1"):
+        assert trace.index(("start", "2", "c")) < trace.index(("end", "1", "a")) # Ran in parallel
+
+def test_update_session_replays_on_a_concurrent_write(temp_db):
+    database.save_session("clinica_teste", "5581", {"status": "AGUARDANDO_HUMANO", "data": {},
+                                                    "last_updated": time.time(), "interaction_count": 1})
+    manager = SessionManager(write_behind=False, sweeper=False, retention=False)
+    try:
+        load = manager.get_session
+        def racing_get_session(client_id, phone):
+            session = load(client_id, phone)
+            if session["status"] == "AGUARDANDO_HUMANO":
+                # The dashboard finishes the conversation while the message is being processed
+                database.save_session(client_id, phone, {**session, "status": "FINALIZADO", "history": []})
+            return session
+        manager.get_session = racing_get_session
+
+        result = manager.update_session("clinica_teste", "5581", "alguem pode me ajudar", None, {})
+        assert result["action"] == "SEND_MENU" # Re-engaged from FINALIZADO, not silenced as AGUARDANDO_HUMANO
+        assert [m["message"] for m in database.get_history("clinica_teste", "5581")] == ["alguem pode me ajudar"]
+    finally:
+        manager.close()
+
+if __name__ == "__main__":
+    import pytest # temp_db is a fixture (tests/conftest.py)
+    sys.exit(pytest.main([__file__, "-q"]))
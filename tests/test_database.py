@@ -0,0 +1,259 @@
+import sys
+import os
+import threading
+import json
+import time
+
+# Adjust path to import src
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from src.core import database, codec
+
+def test_connection_is_pooled_and_tuned(temp_db):
+    conn = database.get_connection()
+    assert database.get_connection() is conn
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1 # NORMAL
+    assert conn.execute("PRAGMA busy_timeout").fetchone()[0] > 0
+
+    # Other threads get their own connection
+    other = []
+    t = threading.Thread(target=lambda: other.append(database.get_connection()))
+    t.start()
+    t.join()
+    assert other[0] is not conn
+
+def test_save_get_delete_roundtrip(temp_db):
+    database.save_session("clinica_teste", "5581", {"status": "MENU_PRINCIPAL", "data": {}})
+    assert database.get_session("clinica_teste", "5581")["status"] == "MENU_PRINCIPAL"
+    assert "5581" in database.get_all_sessions("clinica_teste")
+
+    database.delete_session("clinica_teste", "5581")
+    assert database.get_session("clinica_teste", "5581") is None
+
+def test_close_connections_reconnects(temp_db):
+    conn = database.get_connection()
+    database.close_connections()
+    assert database.get_connection() is not conn
+    database.save_session("clinica_teste", "5581", {"status": "MENU_PRINCIPAL"})
+    assert database.get_session("clinica_teste", "5581") is not None
+
+def test_history_is_stored_in_messages_table(temp_db):
+    session = {"status": "MENU_PRINCIPAL", "data": {}, "history": [
+        {"id": "m1", "timestamp": 1.0, "role": "user", "message": "oi", "intent": "GREETING"},
+    ]}
+    database.save_session("clinica_teste", "5581", session)
+
+    # The row only keeps state-machine fields
+    raw = database.get_connection().execute("SELECT data FROM sessions").fetchone()["data"]
+    assert "history" not in codec.decode(raw)
+    assert database.get_session("clinica_teste", "5581")["history"] == []
+
+    # Appending: re-saving an entry with the same id is a no-op, new ones are added
+    session["history"].append({"id": "m2", "timestamp": 2.0, "role": "user", "message": "1", "intent": "ORCAMENTO"})
+    database.save_session("clinica_teste", "5581", session)
+    history = database.get_history("clinica_teste", "5581")
+    assert [h["message"] for h in history] == ["oi", "1"]
+    assert database.get_history("clinica_teste", "5581", limit=1)[0]["message"] == "1"
+
+    # Messages sharing a timestamp (a burst in the same instant) are all kept, in order
+    database.save_session("clinica_teste", "5581", {"status": "MENU_PRINCIPAL", "history": [
+        {"id": "m3", "timestamp": 3.0, "role": "user", "message": "a"},
+        {"id": "m4", "timestamp": 3.0, "role": "user", "message": "b"},
+        {"timestamp": 3.0, "role": "user", "message": "c"},
+    ]})
+    history = database.get_history("clinica_teste", "5581")
+    assert [h["message"] for h in history] == ["oi", "1", "a", "b", "c"]
+    assert [h["message"] for h in database.get_history("clinica_teste", "5581", limit=2)] == ["b", "c"]
+
+    # Dashboard view carries only the latest message
+    listed = database.get_all_sessions("clinica_teste")["5581"]
+    assert listed["history"] == [history[-1]]
+
+def test_migration_v3_moves_inline_history(temp_db):
+    from src.scripts import migration_v3
+    legacy = {"status": "MENU_PRINCIPAL", "history": [
+        {"timestamp": 1.0, "role": "user", "message": "oi", "intent": None},
+        {"timestamp": 2.0, "role": "user", "message": "2", "intent": "RESULTADO"},
+        {"role": "user", "message": "sem data"},
+        {"role": "user", "message": "tambem sem data"},
+    ]}
+    conn = database.get_connection()
+    with conn:
+        conn.execute("INSERT INTO sessions (client_id, phone, data, updated_at) VALUES (?, ?, ?, ?)",
+                     ("clinica_teste", "5581", json.dumps(legacy), 5.0))
+
+    migration_v3.migrate(batch_size=1)
+
+    raw = conn.execute("SELECT data, updated_at FROM sessions").fetchone()
+    assert "history" not in codec.decode(raw["data"])
+    assert raw["updated_at"] == 5.0
+    history = database.get_history("clinica_teste", "5581")
+    assert [h["message"] for h in history] == ["oi", "2", "sem data", "tambem sem data"]
+    assert [h["timestamp"] for h in history[2:]] == [5.0, 5.0] # Dated by the row's updated_at
+
+def test_legacy_messages_table_is_rekeyed(temp_db, monkeypatch):
+    monkeypatch.setattr(database, "DB_PATH", str(temp_db / "legacy.db"))
+    conn = database.get_connection()
+    with conn:
+        conn.execute('''
+            CREATE TABLE messages (client_id TEXT NOT NULL, phone TEXT NOT NULL, ts REAL NOT NULL,
+                                   role TEXT, message TEXT, intent TEXT, PRIMARY KEY (client_id, phone, ts)) WITHOUT ROWID
+        ''')
+        conn.executemany("INSERT INTO messages VALUES ('c1', '1', ?, 'user', ?, NULL)", [(2.0, "b"), (1.0, "a")])
+    database.init_db()
+
+    assert [h["message"] for h in database.get_history("c1", "1")] == ["a", "b"]
+    database.save_session("c1", "1", {"status": "MENU_PRINCIPAL", "history": [
+        {"timestamp": 2.0, "role": "user", "message": "c"}]})
+    assert [h["message"] for h in database.get_history("c1", "1")] == ["a", "b", "c"]
+
+def test_indexed_status_queries(temp_db):
+    database.save_session("clinica_teste", "1", {"status": "MENU_PRINCIPAL", "last_updated": 10, "interaction_count": 1})
+    database.save_session("clinica_teste", "2", {"status": "AGUARDANDO_HUMANO", "last_updated": 20, "interaction_count": 2})
+    database.save_session("clinica_teste", "3", {"status": "FINALIZADO", "last_updated": 30, "interaction_count": 1})
+    database.save_session("outra_clinica", "4", {"status": "AGUARDANDO_HUMANO", "last_updated": 40})
+
+    assert database.list_client_ids() == ["clinica_teste", "outra_clinica"]
+    assert database.count_by_status("clinica_teste") == {"MENU_PRINCIPAL": 1, "AGUARDANDO_HUMANO": 1, "FINALIZADO": 1}
+
+    waiting = database.list_sessions("clinica_teste", status="AGUARDANDO_HUMANO")
+    assert [s["phone"] for s in waiting] == ["2"]
+    since = waiting[0]["waiting_since"]
+    assert since is not None
+
+    # waiting_since is kept while the session stays in the human queue, cleared when it leaves
+    database.save_session("clinica_teste", "2", waiting[0])
+    again = database.list_sessions("clinica_teste", status="AGUARDANDO_HUMANO")[0]
+    assert again["waiting_since"] == since
+    database.save_session("clinica_teste", "2", {"status": "FINALIZADO", "last_updated": 50})
+    assert database.list_sessions("clinica_teste", status="FINALIZADO")[0]["waiting_since"] is None
+
+    robot = database.list_sessions("clinica_teste", exclude_status=["AGUARDANDO_HUMANO", "FINALIZADO"])
+    assert [s["phone"] for s in robot] == ["1"]
+    paged = database.list_sessions("clinica_teste", limit=1, offset=1)
+    assert [s["phone"] for s in paged] == ["3"] # Ordered by last_updated DESC: 2 (50), 3 (30), 1 (10)
+
+def test_indexed_columns_are_backfilled(temp_db, monkeypatch):
+    monkeypatch.setattr(database, "DB_PATH", str(temp_db / "legacy.db")) # Not initialized yet
+    conn = database.get_connection()
+    with conn:
+        conn.execute("CREATE TABLE sessions (client_id TEXT NOT NULL, phone TEXT NOT NULL, data TEXT NOT NULL, updated_at REAL, PRIMARY KEY (client_id, phone))")
+        conn.execute("INSERT INTO sessions VALUES ('clinica_teste', '1', ?, 1.0)",
+                     (json.dumps({"status": "AGUARDANDO_HUMANO", "last_updated": 5.0, "interaction_count": 3}),))
+    database.init_db()
+    assert database.count_by_status("clinica_teste") == {"AGUARDANDO_HUMANO": 1}
+    assert database.list_sessions("clinica_teste")[0]["waiting_since"] == 5.0
+
+def test_retention_prunes_in_batches_per_tenant(temp_db):
+    from src.core.retention import RetentionJob
+    assert database.get_auto_vacuum_mode() == 2 # New databases use INCREMENTAL
+
+    old = time.time() - 40 * 86400
+    conn = database.get_connection()
+    for i in range(25):
+        database.save_session("clinica_a", str(i), {"status": "FINALIZADO", "history": [
+            {"timestamp": old, "role": "user", "message": "x" * 2000, "intent": None}]})
+        database.save_session("clinica_b", str(i), {"status": "FINALIZADO"})
+    with conn:
+        conn.execute("UPDATE sessions SET updated_at = ?", (old,))
+
+    # clinica_a keeps 30 days, everyone else the default 120
+    job = RetentionJob(default_days=120, days_by_client={"clinica_a": 30}, batch_size=10, pause_s=0)
+    report = job.run_once()
+    assert report["rows"] == 50 # 25 sessions + 25 messages
+    assert report["clients"] == {"clinica_a": 50}
+    assert report["bytes"] > 0
+    assert database.count_by_status("clinica_a") == {}
+    assert database.count_by_status("clinica_b") == {"FINALIZADO": 25}
+
+def test_async_api_uses_writer_and_reader_threads(temp_db):
+    import asyncio
+
+    async def scenario():
+        await asyncio.gather(*(
+            database.save_session_async("clinica_teste", str(i), {"status": "MENU_PRINCIPAL"}) for i in range(20)
+        ))
+        sessions = await asyncio.gather(*(database.get_session_async("clinica_teste", str(i)) for i in range(20)))
+        assert all(s["status"] == "MENU_PRINCIPAL" for s in sessions)
+        thread_name = await database.run_write(lambda: threading.current_thread().name)
+        assert thread_name.startswith("db-writer")
+
+    asyncio.run(scenario())
+    assert database.count_by_status("clinica_teste") == {"MENU_PRINCIPAL": 20}
+
+def test_iter_sessions_streams_and_projects(temp_db):
+    database.save_sessions([("clinica_teste", str(i), {"status": "MENU_PRINCIPAL", "data": {"i": i}}) for i in range(7)])
+    database.save_session("outra", "9", {"status": "FINALIZADO"})
+
+    sessions = list(database.iter_sessions("clinica_teste", batch_size=3))
+    assert sorted(s["data"]["i"] for s in sessions) == list(range(7))
+    assert all(s["version"] == 1 for s in sessions)
+
+    # Column-only projections never touch the blob
+    database.get_connection().execute("UPDATE sessions SET data = x'ff' WHERE client_id = 'outra'")
+    assert list(database.iter_sessions("outra", fields=["phone", "status"])) == [{"phone": "9", "status": "FINALIZADO"}]
+    assert list(database.iter_sessions("outra")) == [] # Corrupt blob is skipped
+
+def test_export_sessions_ndjson_and_csv(temp_db):
+    import io
+    from src.scripts.export_sessions import export_sessions
+    database.save_session("clinica_teste", "5581", {"status": "MENU_PRINCIPAL", "data": {"name": "Ana"}})
+
+    out = io.StringIO()
+    assert export_sessions(out, "ndjson") == 1
+    assert json.loads(out.getvalue())["data"] == {"name": "Ana"}
+
+    out = io.StringIO()
+    export_sessions(out, "csv", fields=["phone", "data"])
+    assert out.getvalue().splitlines() == ["phone,data", '5581,"{""name"": ""Ana""}"']
+
+def test_shard_mode_routes_each_client_to_its_own_file(temp_db):
+    database.SHARD_MODE = True
+    try:
+        database.save_sessions([
+            ("clinica/a", "1", {"status": "MENU_PRINCIPAL", "history": [{"timestamp": 1.0, "role": "user", "message": "oi"}]}),
+            ("clinica_b", "2", {"status": "AGUARDANDO_HUMANO"}),
+        ])
+        assert database.list_client_ids() == ["clinica/a", "clinica_b"]
+        assert os.path.exists(database.shard_path("clinica/a"))
+        assert database.get_history("clinica/a", "1")[0]["message"] == "oi"
+        assert database.count_by_status("clinica_b") == {"AGUARDANDO_HUMANO": 1}
+        assert set(database.get_all_sessions()) == {"1", "2"}
+
+        # Nothing lands in the main database
+        assert database.get_connection().execute("SELECT COUNT(*) FROM sessions").fetchone()[0] == 0
+
+        database.clear_all_sessions("clinica_b")
+        assert database.get_session("clinica_b", "2") is None
+        assert database.get_session("clinica/a", "1") is not None
+    finally:
+        database.SHARD_MODE = False
+
+def test_split_shards_copies_rows_per_client(temp_db):
+    from src.scripts import split_shards
+    database.save_session("clinica_a", "1", {"status": "MENU_PRINCIPAL", "history": [{"timestamp": 1.0, "role": "user", "message": "oi"}]})
+    database.save_session("clinica_b", "2", {"status": "FINALIZADO"})
+    # Queued work of a client with no session yet
+    database.enqueue_outbox("clinica_c", "3", "oi", "key-1", now=100.0)
+    database.add_inbox("clinica_c", "3", {"text": "oi"})
+    database.save_seen_messages([("clinica_c", "3EB0", 100.0)], cutoff=0.0)
+    try:
+        split_shards.split(purge=True)
+        main = database.get_connection()
+        for table in split_shards.TABLES:
+            assert main.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] == 0
+
+        database.SHARD_MODE = True
+        assert database.get_session("clinica_a", "1")["status"] == "MENU_PRINCIPAL"
+        assert len(database.get_history("clinica_a", "1")) == 1
+        assert database.count_by_status("clinica_b") == {"FINALIZADO": 1}
+        assert [row["text"] for row in database.list_due_outbox(200.0)] == ["oi"]
+        assert [row["payload"] for row in database.list_inbox()] == [{"text": "oi"}]
+        assert database.seen_message_since("clinica_c", "3EB0", 50.0)
+    finally:
+        database.SHARD_MODE = False
+
+if __name__ == "__main__":
+    import pytest # temp_db is a fixture (tests/conftest.py)
+    sys.exit(pytest.main([__file__, "-q"]))
@@ -0,0 +1,57 @@
+import sys
+import os
+import asyncio
+
+# Adjust path to import src
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from src.core import database
+from src.core.dedup import DedupCache, message_id
+
+def test_message_id():
+    assert message_id({"key": {"remoteJid": "5581@s.whatsapp.net", "id": "3EB0ABC", "fromMe": False}}) == "3EB0ABC"
+    assert message_id(None) is None
+    assert message_id({"key": {}}) is None
+    assert message_id({"key": "3EB0ABC"}) is None
+
+def test_duplicates_within_ttl_per_client():
+    cache = DedupCache(ttl_s=60, max_entries=100, spill=False)
+    assert cache.seen("c1", "m1", now=1000.0) is False
+    assert cache.seen("c1", "m1", now=1030.0) is True
+    assert cache.seen("c2", "m1", now=1030.0) is False # Ids are per client
+    assert cache.seen("c1", "m1", now=1089.0) is True # TTL counts from the last sighting
+    assert cache.seen("c1", "m1", now=1150.0) is False # Expired
+    cache.forget("c1", "m1")
+    assert cache.seen("c1", "m1", now=1151.0) is False
+    assert cache.stats()["duplicates"] == 2
+
+def test_lru_is_bounded():
+    cache = DedupCache(ttl_s=60, max_entries=3, spill=False)
+    for i in range(5):
+        cache.seen("c1", f"m{i}", now=1000.0 + i)
+    assert cache.stats()["size"] == 3 and cache.evictions == 2
+    assert cache.seen("c1", "m0", now=1010.0) is False # Evicted, so forgotten
+    assert cache.seen("c1", "m4", now=1010.0) is True
+
+def test_spill_keeps_evicted_ids_and_survives_restart(temp_db):
+
+    async def first_run():
+        cache = DedupCache(ttl_s=3600, max_entries=2, spill=True)
+        await cache.load()
+        for i in range(4):
+            assert await cache.check("c1", f"m{i}") is False
+        assert await cache.check("c1", "m0") is True # Evicted from memory, found in SQLite
+        assert cache.spill_hits == 1
+        await cache.close()
+
+    async def second_run():
+        cache = DedupCache(ttl_s=3600, max_entries=2, spill=True)
+        await cache.load()
+        assert await cache.check("c1", "m3") is True # Was in memory at shutdown
+        assert await cache.check("c1", "m9") is False
+    asyncio.run(first_run())
+    asyncio.run(second_run())
+
+if __name__ == "__main__":
+    import pytest # temp_db is a fixture (tests/conftest.py)
+    sys.exit(pytest.main([__file__, "-q"]))
@@ -0,0 +1,110 @@
+import sys
+import os
+import json
+import tempfile
+
+# Adjust path to import src
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from src.core.flow import DEFAULT_FLOW, FlowRegistry, Turn, compile_flow
+from src.core.message import NormalizedMessage
+
+def run(flow, state, text, intent=None, entities=None, media_type="text", session=None, known_patient=None):
+    session = session or {"status": state, "data": {}}
+    turn = Turn(NormalizedMessage(text), intent, entities or {}, media_type, session.get("last_action"), known_patient)
+    action, reply = flow.run(state, turn, session, None, None)
+    return session, action, reply
+
+def test_default_flow_rules():
+    flow = compile_flow(DEFAULT_FLOW)
+    session, action, reply = run(flow, "ORCAMENTO_PEDIR_PLANO", "pago no pix")
+    assert (session["status"], session["data"], action) == ("ORCAMENTO_PEDIR_PEDIDO", {"plano": "PARTICULAR"}, "ASK_ORDER")
+    assert "*Particular*" in reply
+
+    # The triage entity wins over the keyword groups
+    session, _, reply = run(flow, "AGENDAMENTO_PEDIR_PLANO", "pix", entities={"PLANO_SAUDE": "ID_CASSI"})
+    assert session["data"]["plano"] == "ID_CASSI" and "*CASSI*" in reply
+
+    session, action, reply = run(flow, "ORCAMENTO_PEDIR_PEDIDO", "hemograma {completo}")
+    assert session["data"]["pedido_descricao"] == "hemograma {completo}"
+    assert reply.startswith("Anotei aqui: hemograma {completo}\n")
+
+    # No matching rule: nothing changes
+    session, action, reply = run(flow, "AGUARDANDO_HUMANO", "alguem ai?")
+    assert (session["status"], action, reply) == ("AGUARDANDO_HUMANO", None, None)
+
+def test_known_patient_skips_the_proof_photo():
+    flow = compile_flow(DEFAULT_FLOW)
+    session, action, reply = run(flow, "MENU_PRINCIPAL", "resultado", intent="RESULTADO",
+                                 known_patient={"patient_key": "123456", "results": "Resultados para *Maria*"})
+    assert (session["status"], session["data"], action, reply) == \
+        ("MENU_PRINCIPAL", {"protocolo": "123456"}, "SEND_RESULTS", "Resultados para *Maria*")
+
+    session, action, _ = run(flow, "MENU_PRINCIPAL", "resultado", intent="RESULTADO", known_patient=None)
+    assert (session["status"], action) == ("RESULTADO_PEDIR_COMPROVANTE", "ASK_PROOF")
+
+    # The caller only looks the patient up for intents a known_patient rule can match
+    assert flow.needs_known_patient("RESULTADO")
+    assert not flow.needs_known_patient("ORCAMENTO") and not flow.needs_known_patient(None)
+    tenant = compile_flow({**DEFAULT_FLOW, "states": {"MENU_PRINCIPAL": [
+        {"when": {"any": [{"equals": ["meus exames"], "known_patient": True}]}, "reply": "{results}"}]}})
+    assert tenant.needs_known_patient(None) # No intent condition: every message needs the lookup
+
+def test_tenant_flow_overrides_and_reloads():
+    flows_dir = tempfile.mkdtemp()
+    registry = FlowRegistry(flows_dir, check_interval_s=0)
+    assert registry.get("clinica_a") is registry.default
+
+    path = os.path.join(flows_dir, "clinica_a.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"replies": {"gratitude": "De nada!"},
+                   "states": {"AGUARDANDO_HUMANO": [{"when": {}, "reply": "Um atendente já vai falar com você."}]}}, f)
+    flow = registry.get("clinica_a")
+    assert flow.replies == {**DEFAULT_FLOW["replies"], "gratitude": "De nada!"}
+    assert run(flow, "AGUARDANDO_HUMANO", "alguem ai?")[2] == "Um atendente já vai falar com você."
+    assert registry.get("clinica_a") is flow # Compiled once per file version
+    assert registry.get("clinica_b") is registry.default
+
+    # A broken file falls back to the default flow
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"states": {"MENU_PRINCIPAL": [{"when": {"typo": 1}}]}}, f)
+    os.utime(path, (0, 0))
+    assert registry.get("clinica_a") is registry.default
+
+def test_tenant_file_is_checked_once_per_interval(monkeypatch):
+    flows_dir = tempfile.mkdtemp()
+    now = [0.0]
+    registry = FlowRegistry(flows_dir, check_interval_s=5, clock=lambda: now[0])
+    stats = []
+    stat = os.stat
+    monkeypatch.setattr(os, "stat", lambda path, *args, **kwargs: stats.append(path) or stat(path, *args, **kwargs))
+
+    assert registry.get("clinica_a") is registry.default
+    with open(os.path.join(flows_dir, "clinica_a.json"), "w", encoding="utf-8") as f:
+        json.dump({"replies": {"gratitude": "De nada!"}}, f)
+    now[0] = 4.9
+    assert registry.get("clinica_a") is registry.default # Not looked at again yet
+    assert len(stats) == 1
+    now[0] = 5.0
+    flow = registry.get("clinica_a")
+    assert flow.replies["gratitude"] == "De nada!"
+    assert registry.get("clinica_a") is flow and len(stats) == 2
+
+def test_manager_resolves_the_flow_once_per_message(temp_db):
+    from src.core.session import SessionManager
+    manager = SessionManager(write_behind=False, sweeper=False, retention=False)
+    try:
+        lookups = []
+        get = manager.flows.get
+        manager.flows.get = lambda client_id: lookups.append(client_id) or get(client_id)
+        assert manager.update_session("clinica_teste", "5581", "quero o resultado", "RESULTADO", {})
+        assert lookups == ["clinica_teste"]
+        flow = get("clinica_teste") # Resolved by the caller (the webhook, for triage): not looked up again
+        assert manager.update_session("clinica_teste", "5581", "2", "RESULTADO", {}, flow=flow)
+        assert lookups == ["clinica_teste"]
+    finally:
+        manager.close()
+
+if __name__ == "__main__":
+    import pytest # temp_db is a fixture (tests/conftest.py)
+    sys.exit(pytest.main([__file__, "-q"]))
@@ -0,0 +1,92 @@
+import sys
+import os
+import asyncio
+
+# Adjust path to import src
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from src.core import database
+from src.core.ingest import IngestQueue
+
+def recorder(delay=0.0):
+    handled, active = [], {}
+    async def handle(item):
+        conversation = item["from"]
+        active[conversation] = active.get(conversation, 0) + 1
+        assert active[conversation] == 1, "two messages of one conversation at once"
+        await asyncio.sleep(delay)
+        active[conversation] -= 1
+        if item.get("boom"):
+            raise ValueError("boom")
+        handled.append((conversation, item["n"]))
+    return handle, handled
+
+def test_in_order_per_conversation():
+    handle, handled = recorder(delay=0.001)
+    queue = IngestQueue(handle, workers=3, persist=False)
+
+    async def scenario():
+        await queue.start()
+        for n in range(5):
+            for conversation in ("A", "B", "C", "D"):
+                assert await queue.submit("c1", conversation, {"from": conversation, "n": n})
+        await queue.join()
+        await queue.stop()
+    asyncio.run(scenario())
+    for conversation in ("A", "B", "C", "D"):
+        assert [n for c, n in handled if c == conversation] == list(range(5))
+    health = queue.health()
+    assert (health["accepted"], health["processed"], health["depth"]) == (20, 20, 0)
+
+def test_sheds_when_full_and_survives_failures():
+    handle, handled = recorder()
+    queue = IngestQueue(handle, workers=2, max_depth=3, persist=False)
+
+    async def scenario():
+        results = [await queue.submit("c1", "A", {"from": "A", "n": n, "boom": n == 1}) for n in range(5)]
+        assert results == [True, True, True, False, False] # Workers not started: nothing drains
+        await queue.start()
+        await queue.join()
+        assert await queue.submit("c1", "A", {"from": "A", "n": 9}) # Room again
+        await queue.stop()
+    asyncio.run(scenario())
+    assert handled == [("A", 0), ("A", 2), ("A", 9)]
+    assert queue.stats == {"accepted": 4, "processed": 3, "failed": 1, "shed": 2}
+
+def test_persisted_messages_are_replayed(temp_db):
+    handle, handled = recorder()
+
+    async def accept_then_crash():
+        queue = IngestQueue(handle, workers=2, persist=True)
+        for n in range(3):
+            await queue.submit("c1", "A", {"from": "A", "n": n})
+        # Never started: the process "dies" with three acknowledged messages
+    asyncio.run(accept_then_crash())
+    assert len(database.list_inbox()) == 3
+
+    async def restart():
+        queue = IngestQueue(handle, workers=2, persist=True)
+        await queue.start()
+        await queue.join()
+        await queue.stop()
+    asyncio.run(restart())
+    assert handled == [("A", 0), ("A", 1), ("A", 2)]
+    assert database.list_inbox() == []
+
+def test_stop_keeps_unfinished_messages_in_the_inbox(temp_db):
+    handle, handled = recorder(delay=1.0)
+
+    async def scenario():
+        queue = IngestQueue(handle, workers=1, persist=True, drain_timeout_s=0.1)
+        await queue.start()
+        for n in range(2):
+            await queue.submit("c1", "A", {"from": "A", "n": n})
+        await asyncio.sleep(0.05) # The first message is in the handler
+        await queue.stop()
+    asyncio.run(scenario())
+    assert handled == []
+    assert [row["payload"]["n"] for row in database.list_inbox()] == [0, 1]
+
+if __name__ == "__main__":
+    import pytest # temp_db is a fixture (tests/conftest.py)
+    sys.exit(pytest.main([__file__, "-q"]))
@@ -0,0 +1,36 @@
+import sys
+import os
+
+# Adjust path to import src
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from src.core import message
+from src.core.message import NormalizedMessage
+from src.core.triage import Triage, normalize_text
+
+def test_normalized_forms():
+    msg = NormalizedMessage("  Olá!! Meu CPF é 123.456.789-00, veja www.site.com  ")
+    assert msg.stripped == "Olá!! Meu CPF é 123.456.789-00, veja www.site.com"
+    assert msg.folded == "  ola!! meu cpf e 123.456.789-00, veja   "
+    assert msg.normalized == normalize_text(msg.raw) == "ola meu cpf e 12345678900 veja"
+    assert msg.tokens == {"ola", "meu", "cpf", "e", "12345678900", "veja"}
+    assert msg.digits == "12345678900"
+    assert NormalizedMessage("").normalized == ""
+
+def test_message_is_folded_once(monkeypatch):
+    calls = []
+    unidecode = message.unidecode
+    monkeypatch.setattr(message, "unidecode", lambda text: calls.append(text) or unidecode(text))
+    msg = NormalizedMessage("Olááá, orçamento!")
+    assert calls == ["Olááá, orçamento!"]
+    assert msg.normalized == normalize_text(msg.raw) == "ola orcamento"
+
+def test_triage_accepts_normalized_message():
+    triage = Triage()
+    msg = NormalizedMessage("Quero o resultado, sou CASSI")
+    assert triage.analyze(msg) == triage.analyze(msg.raw) == ("RESULTADO", {"PLANO_SAUDE": "ID_CASSI"})
+
+if __name__ == "__main__":
+    test_normalized_forms()
+    test_triage_accepts_normalized_message()
+    print("✅ NormalizedMessage tests passed")
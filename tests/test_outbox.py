@@ -0,0 +1,95 @@
+import sys
+import os
+import asyncio
+import json
+import time
+
+import httpx
+
+# Adjust path to import src
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from src.core import database
+from src.core.outbox import OutboxWorker
+from src.core.replier import AsyncReplier
+
+def gateway(statuses=None):
+    """Fake gateway: answers with the next status of `statuses` (then 200) and logs what it sent."""
+    statuses = list(statuses or [])
+    sent, in_flight = [], {}
+    async def handle(request):
+        body = json.loads(request.content)
+        in_flight[body["number"]] = in_flight.get(body["number"], 0) + 1
+        assert in_flight[body["number"]] == 1, "two sends to one recipient at once"
+        await asyncio.sleep(0.01)
+        in_flight[body["number"]] -= 1
+        status = statuses.pop(0) if statuses else 200
+        if status == 200:
+            sent.append((body["number"], body["text"]))
+        return httpx.Response(status, text="gateway says no" if status != 200 else "ok")
+    return AsyncReplier(transport=httpx.MockTransport(handle)), sent
+
+def rows():
+    conn = database.get_connection()
+    return [dict(row) for row in conn.execute("SELECT recipient, text, status, attempts, next_attempt_at FROM outbox ORDER BY id")]
+
+def test_in_order_per_recipient_and_idempotent(temp_db):
+    replier, sent = gateway()
+    worker = OutboxWorker(replier)
+
+    async def scenario():
+        for i in range(3):
+            assert await worker.enqueue("c1", "A", f"a{i}", f"key-a{i}")
+        assert await worker.enqueue("c1", "A", "a0 again", "key-a0") is False # Same idempotency key
+        assert await worker.enqueue("c1", "B", "b0")
+        await worker.flush()
+        await replier.aclose()
+    asyncio.run(scenario())
+    assert [text for number, text in sent if number == "A"] == ["a0", "a1", "a2"]
+    assert sorted(sent) == [("A", "a0"), ("A", "a1"), ("A", "a2"), ("B", "b0")]
+    assert {row["status"] for row in rows()} == {"sent"}
+    assert worker.health()["queue"] == {"sent": 4}
+
+def test_backoff_then_dead_letter_keeps_order(temp_db):
+    replier, sent = gateway([503, 503])
+    worker = OutboxWorker(replier, max_attempts=2, backoff_base_s=10)
+
+    async def scenario():
+        await worker.enqueue("c1", "A", "first")
+        await worker.enqueue("c1", "A", "second")
+        now = time.time()
+        await worker.flush(now)
+        first = rows()[0]
+        assert (first["status"], first["attempts"]) == ("pending", 1)
+        assert now + 5 <= first["next_attempt_at"] <= now + 10 # base * 2**0, with jitter
+        assert sent == [] # "second" waits behind "first"
+
+        await worker.flush(now + 1000) # Second failure reaches max_attempts
+        await replier.aclose()
+    asyncio.run(scenario())
+    assert [(row["text"], row["status"]) for row in rows()] == [("first", "dead"), ("second", "sent")]
+    assert sent == [("A", "second")]
+    assert worker.stats == {"sent": 1, "retried": 1, "dead": 1}
+
+def test_client_errors_are_not_retried(temp_db):
+    replier, _ = gateway([400])
+    worker = OutboxWorker(replier)
+
+    async def scenario():
+        await worker.enqueue("c1", "A", "oi")
+        await worker.flush()
+        await replier.aclose()
+    asyncio.run(scenario())
+    assert [(row["status"], row["attempts"]) for row in rows()] == [("dead", 1)]
+
+def test_sent_replies_are_pruned(temp_db):
+    database.enqueue_outbox("c1", "A", "old", "k1", now=100.0)
+    database.enqueue_outbox("c1", "A", "new", "k2", now=100.0)
+    ids = [row["id"] for row in database.list_due_outbox(200.0)]
+    database.mark_outbox("c1", ids[0], "sent", 150.0)
+    assert database.prune_outbox_batch(cutoff=160.0) == 1
+    assert [row["text"] for row in rows()] == ["new"]
+
+if __name__ == "__main__":
+    import pytest # temp_db is a fixture (tests/conftest.py)
+    sys.exit(pytest.main([__file__, "-q"]))
@@ -0,0 +1,67 @@
+import sys
+import os
+import asyncio
+import json
+import time
+
+import httpx
+
+# Adjust path to import src
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from src.core.replier import AsyncReplier
+
+def gateway(delay=0.0, status=200):
+    """A fake Node gateway (httpx.MockTransport) that records requests and in-flight peaks per tenant."""
+    seen = {"requests": [], "in_flight": {}, "peak": {}}
+    async def handle(request):
+        client_id = request.url.path.rsplit("/", 1)[-1]
+        seen["in_flight"][client_id] = seen["in_flight"].get(client_id, 0) + 1
+        seen["peak"][client_id] = max(seen["peak"].get(client_id, 0), seen["in_flight"][client_id])
+        await asyncio.sleep(delay)
+        seen["in_flight"][client_id] -= 1
+        seen["requests"].append((client_id, json.loads(request.content)))
+        return httpx.Response(status, text="ok")
+    return httpx.MockTransport(handle), seen
+
+def test_send_text_posts_to_gateway():
+    transport, seen = gateway()
+    replier = AsyncReplier(transport=transport)
+
+    async def scenario():
+        assert await replier.send_text("clinica_a", "5581@s.whatsapp.net", "Olá") is True
+        await replier.aclose()
+    asyncio.run(scenario())
+    assert seen["requests"] == [("clinica_a", {"number": "5581@s.whatsapp.net", "text": "Olá"})]
+    assert replier.stats == {"sent": 1, "failed": 0, "rejected": 0}
+
+def test_nowait_returns_at_once_and_caps_each_tenant():
+    transport, seen = gateway(delay=0.05)
+    replier = AsyncReplier(transport=transport, concurrency=2)
+
+    async def scenario():
+        started = time.perf_counter()
+        for i in range(6):
+            replier.send_text_nowait("clinica_a", f"55{i}", "oi")
+        replier.send_text_nowait("clinica_b", "5599", "oi")
+        assert time.perf_counter() - started < 0.05 # Nothing waited on the gateway
+        await replier.aclose() # Drains the sends in flight
+    asyncio.run(scenario())
+    assert len(seen["requests"]) == 7
+    assert seen["peak"] == {"clinica_a": 2, "clinica_b": 1}
+
+def test_gateway_errors_are_counted_not_raised():
+    transport, _ = gateway(status=500)
+    replier = AsyncReplier(transport=transport)
+
+    async def scenario():
+        assert await replier.send_text("clinica_a", "5581", "oi") is False
+        await replier.aclose()
+    asyncio.run(scenario())
+    assert replier.stats == {"sent": 0, "failed": 1, "rejected": 0}
+
+if __name__ == "__main__":
+    test_send_text_posts_to_gateway()
+    test_nowait_returns_at_once_and_caps_each_tenant()
+    test_gateway_errors_are_counted_not_raised()
+    print("✅ Replier tests passed")
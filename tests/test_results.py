@@ -0,0 +1,152 @@
+import sys
+import os
+import json
+import tempfile
+import io
+import threading
+import time
+
+# Adjust path to import src
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import sqlite3
+from src.core.results import ResultsStore, phone_key
+from src.core.importer import import_stream
+
+MOCK = {
+    "clinica_teste": {"patients": {
+        "123456": {"name": "Maria Silva", "phone": "558199999999", "cpf": "11122233344", "exams": [
+            {"id": "EX001", "name": "Hemograma Completo", "date": "2023-10-25", "status": "PRONTO", "pdf_url": None},
+            {"id": "EX002", "name": "Colesterol Total", "date": "2023-10-25", "status": "EM_ANALISE", "pdf_url": None},
+        ]},
+        "111222": {"name": "João Santos", "phone": "558188888888", "exams": []},
+    }}
+}
+
+def write_json(path, data):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+
+def test_lookups_by_key_cpf_and_phone():
+    tmp = tempfile.mkdtemp()
+    store = ResultsStore(os.path.join(tmp, "results.db"))
+    try:
+        path = os.path.join(tmp, "mock_db.json")
+        write_json(path, MOCK)
+        assert store.sync_json(path) is True
+        assert store.sync_json(path) is False # Unchanged mtime: no work
+
+        maria = store.find_patient("clinica_teste", "123456")
+        assert [e["id"] for e in maria["exams"]] == ["EX001", "EX002"]
+        assert store.find_patient("clinica_teste", "11122233344")["name"] == "Maria Silva"
+        assert store.find_patient("outra_clinica", "123456") is None
+        assert [p["name"] for p in store.find_by_phone("clinica_teste", "558188888888")] == ["João Santos"]
+    finally:
+        store.close()
+
+def test_sync_is_incremental():
+    tmp = tempfile.mkdtemp()
+    store = ResultsStore(os.path.join(tmp, "results.db"))
+    try:
+        path = os.path.join(tmp, "mock_db.json")
+        write_json(path, MOCK)
+        store.sync_json(path)
+
+        changed = json.loads(json.dumps(MOCK))
+        changed["clinica_teste"]["patients"]["123456"]["exams"][1]["status"] = "PRONTO"
+        del changed["clinica_teste"]["patients"]["111222"]
+        write_json(path, changed)
+        os.utime(path, (1, 1))
+        assert store.upsert_patients("clinica_teste", changed["clinica_teste"]["patients"].items(), "mock_db.json") == 1
+        assert store.upsert_patients("clinica_teste", changed["clinica_teste"]["patients"].items(), "mock_db.json") == 0
+
+        store.sync_json(path)
+        assert store.find_patient("clinica_teste", "111222") is None
+        assert [e["status"] for e in store.find_patient("clinica_teste", "123456")["exams"]] == ["PRONTO", "PRONTO"]
+    finally:
+        store.close()
+
+def test_concurrent_syncs_import_once():
+    tmp = tempfile.mkdtemp()
+    store = ResultsStore(os.path.join(tmp, "results.db"))
+    try:
+        path = os.path.join(tmp, "mock_db.json")
+        write_json(path, MOCK)
+        upserts = []
+        upsert = store.upsert_patients
+        def slow_upsert(*args):
+            upserts.append(args[0])
+            time.sleep(0.05) # Keeps the first sync busy while the others check the mtime
+            return upsert(*args)
+        store.upsert_patients = slow_upsert
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(store.sync_json(path))) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert sorted(results) == [False, False, False, True]
+        assert upserts == ["clinica_teste"]
+        assert store.find_patient("clinica_teste", "123456")["name"] == "Maria Silva"
+    finally:
+        store.close()
+
+def test_phone_key_matches_number_variants():
+    assert phone_key("558199999999") == phone_key("+55 (81) 99999-9999") == "8199999999"
+    assert phone_key("5581999999999@s.whatsapp.net") == phone_key("081 9999-9999") == "8199999999"
+    assert phone_key("12345@s.whatsapp.net") is None and phone_key(None) is None
+
+    # A results.db from before phone_key is backfilled on open
+    tmp = tempfile.mkdtemp()
+    path = os.path.join(tmp, "results.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE patients (client_id TEXT NOT NULL, patient_key TEXT NOT NULL, protocol TEXT, cpf TEXT, "
+                 "phone TEXT, name TEXT, dob TEXT, source TEXT, content_hash TEXT, PRIMARY KEY (client_id, patient_key))")
+    conn.execute("INSERT INTO patients (client_id, patient_key, phone, name) VALUES ('c1', '1', '558177777777', 'Ana')")
+    conn.commit()
+    conn.close()
+    store = ResultsStore(path)
+    try:
+        assert [p["name"] for p in store.find_by_phone("c1", "5581977777777")] == ["Ana"]
+    finally:
+        store.close()
+
+CSV_EXPORT = """clientId,protocolo,cpf,nome,telefone,id_exame,exame,data,status
+clinica_teste,900001,55566677788,Ana Lima,558177777777,EX10,Glicemia,2024-01-10,EM_ANALISE
+clinica_teste,900001,55566677788,Ana Lima,558177777777,EX11,TSH,2024-01-10,PRONTO
+clinica_teste,,,Sem Chave,,EX12,TSH,2024-01-10,PRONTO
+"""
+
+def test_import_streams_and_skips_unchanged():
+    tmp = tempfile.mkdtemp()
+    store = ResultsStore(os.path.join(tmp, "results.db"))
+    try:
+        report = import_stream(store, io.BytesIO(CSV_EXPORT.encode("utf-8")), "csv", batch_size=1)
+        assert (report["rows"], report["written"], report["skipped"], report["errors"]) == (3, 2, 0, 1)
+        assert report["rows_per_s"] > 0
+
+        ana = store.find_patient("clinica_teste", "55566677788")
+        assert ana["name"] == "Ana Lima"
+        assert [(e["id"], e["status"]) for e in ana["exams"]] == [("EX10", "EM_ANALISE"), ("EX11", "PRONTO")]
+
+        # Re-import of the same export writes nothing; an NDJSON update touches only its exam
+        report = import_stream(store, io.BytesIO(CSV_EXPORT.encode("utf-8")), "csv")
+        assert (report["written"], report["skipped"]) == (0, 2)
+        update = json.dumps({"protocol": "900001", "exam_id": "EX10", "exam_name": "Glicemia",
+                             "date": "2024-01-10", "status": "PRONTO"}) + "\n"
+        report = import_stream(store, io.StringIO(update + "not json\n"), "ndjson", client_id="clinica_teste")
+        assert (report["written"], report["errors"]) == (1, 1)
+        ana = store.find_patient("clinica_teste", "900001")
+        assert [(e["id"], e["status"]) for e in ana["exams"]] == [("EX10", "PRONTO"), ("EX11", "PRONTO")]
+        assert ana["name"] == "Ana Lima" # Fields missing from a row keep their stored value
+    finally:
+        store.close()
+
+if __name__ == "__main__":
+    test_lookups_by_key_cpf_and_phone()
+    test_sync_is_incremental()
+    test_concurrent_syncs_import_once()
+    test_phone_key_matches_number_variants()
+    test_import_streams_and_skips_unchanged()
+    print("✅ Results store tests passed")
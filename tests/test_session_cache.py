@@ -0,0 +1,54 @@
+import sys
+import os
+
+# Adjust path to import src
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from src.core import database
+from src.core.cache import SessionCache
+from src.core.session import SessionManager
+
+def test_save_returns_increasing_versions(temp_db):
+    assert database.save_session("clinica_teste", "5581", {"status": "MENU_PRINCIPAL"}) == 1
+    assert database.save_session("clinica_teste", "5581", {"status": "MENU_PRINCIPAL"}) == 2
+    assert database.get_session_version("clinica_teste", "5581") == 2
+    assert database.get_session("clinica_teste", "5581")["version"] == 2
+    assert database.get_session_version("clinica_teste", "0000") is None
+
+def test_cache_lru_and_ttl():
+    cache = SessionCache(max_entries=2, ttl_s=60)
+    for phone in ("1", "2", "3"):
+        cache.put("c", phone, {"status": "MENU_PRINCIPAL", "version": 1})
+    assert cache.get("c", "1", 1) is None # Evicted (least recently used)
+    assert cache.get("c", "3", 1)["status"] == "MENU_PRINCIPAL"
+    assert cache.get("c", "3", 2) is None # Row moved on
+    assert cache.stats()["evictions"] == 1
+
+    cache.ttl_s = -1
+    assert cache.get("c", "2", 1) is None
+    assert cache.stats() == {"size": 0, "hits": 1, "misses": 3, "stale": 1, "expired": 1, "evictions": 1, "hit_rate": 0.25}
+
+def test_manager_serves_from_cache_and_sees_external_writes(temp_db):
+    manager = SessionManager(write_behind=False, sweeper=False, retention=False)
+    try:
+        manager.update_session("clinica_teste", "5581", "oi", "GREETING", {})
+        session = manager.get_session("clinica_teste", "5581")
+        assert manager.cache.hits == 1
+        session["status"] = "MUTATED" # Callers get a private copy
+        assert manager.get_session("clinica_teste", "5581")["status"] != "MUTATED"
+
+        # The dashboard (another process) finishes the conversation
+        stored = database.get_session("clinica_teste", "5581")
+        stored["status"] = "FINALIZADO"
+        database.save_session("clinica_teste", "5581", stored)
+        assert manager.get_session("clinica_teste", "5581")["status"] == "FINALIZADO"
+        assert manager.cache.stale == 1
+
+        database.delete_session("clinica_teste", "5581")
+        assert manager.get_session("clinica_teste", "5581")["status"] == "MENU_PRINCIPAL"
+    finally:
+        manager.close()
+
+if __name__ == "__main__":
+    import pytest # temp_db is a fixture (tests/conftest.py)
+    sys.exit(pytest.main([__file__, "-q"]))
@@ -0,0 +1,57 @@
+import sys
+import os
+import time
+
+# Adjust path to import src
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from src.core import database
+from src.core.sweeper import TimeoutSweeper
+from src.config import SESSION_TIMEOUT, HUMAN_SESSION_TIMEOUT
+
+def session(status, last_updated, data=None):
+    return {"status": status, "data": data or {}, "last_updated": last_updated, "interaction_count": 1}
+
+def test_sweeper_moves_expired_sessions(temp_db):
+    now = time.time()
+    robot_ts = now - SESSION_TIMEOUT - 10
+    database.save_sessions([
+        ("clinica_teste", "robot", session("ORCAMENTO_PEDIR_PLANO", robot_ts, {"plano": "CASSI"})),
+        ("clinica_teste", "human", session("AGUARDANDO_HUMANO", now - HUMAN_SESSION_TIMEOUT - 10)),
+        ("clinica_teste", "fresh", session("MENU_PRINCIPAL", now)),
+        ("clinica_teste", "done", session("FINALIZADO", now - HUMAN_SESSION_TIMEOUT * 10)),
+    ])
+
+    events = []
+    sweeper = TimeoutSweeper(batch_size=1)
+    sweeper.add_listener(events.append)
+    assert sweeper.run_once(now)["moved"] == 2
+
+    robot = database.get_session("clinica_teste", "robot")
+    assert (robot["status"], robot["data"], robot["last_updated"], robot["interaction_count"]) == \
+           ("AGUARDANDO_HUMANO", {}, robot_ts, 2)
+    human = database.get_session("clinica_teste", "human")
+    assert (human["status"], human["data"], human["last_updated"]) == ("MENU_PRINCIPAL", {"was_stale_human": True}, 0)
+    assert database.count_by_status("clinica_teste") == {"AGUARDANDO_HUMANO": 1, "MENU_PRINCIPAL": 2, "FINALIZADO": 1}
+    assert sorted((e["phone"], e["to"]) for e in events) == [("human", "MENU_PRINCIPAL"), ("robot", "AGUARDANDO_HUMANO")]
+
+    # The moved robot session now waits for the human timeout, counted from the same last message
+    assert sweeper.run_once(now)["moved"] == 0
+    assert sweeper.run_once(robot_ts + HUMAN_SESSION_TIMEOUT + 1)["moved"] == 2 # robot, and fresh (idle since now)
+    assert database.get_session("clinica_teste", "robot")["status"] == "MENU_PRINCIPAL"
+
+def test_sweeper_never_overwrites_newer_writes(temp_db):
+    now = time.time()
+    database.save_session("clinica_teste", "5581", session("ORCAMENTO_PEDIR_PLANO", now - SESSION_TIMEOUT - 10))
+    stale = database.list_expired_sessions("clinica_teste", now)
+    database.save_session("clinica_teste", "5581", session("ORCAMENTO_PEDIR_PEDIDO", now)) # Patient wrote meanwhile
+    assert database.expire_sessions("clinica_teste", stale) == []
+    assert database.get_session("clinica_teste", "5581")["status"] == "ORCAMENTO_PEDIR_PEDIDO"
+
+    # Pending write-behind updates are skipped
+    database.save_session("clinica_teste", "5581", session("ORCAMENTO_PEDIR_PLANO", now - SESSION_TIMEOUT - 10))
+    assert TimeoutSweeper(skip=lambda client_id, phone: True).run_once(now)["moved"] == 0
+
+if __name__ == "__main__":
+    import pytest # temp_db is a fixture (tests/conftest.py)
+    sys.exit(pytest.main([__file__, "-q"]))
@@ -5,6 +5,10 @@ import os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
 from src.core.triage import Triage
+from src.core.fuzzy import DEFAULT_THRESHOLDS, FuzzyIndex, bounded_distance, load_vocabulary
+from src.scripts.build_vocabulary import build_vocabulary
+
+VOCABULARY = load_vocabulary(os.path.join(os.path.dirname(__file__), "..", "data", "vocabulary.txt"))
 
 def test_triage():
     triage = Triage()
@@ -51,5 +55,80 @@ def test_triage():
         print(f"\n⚠️ {failures} TESTS FAILED")
         exit(1)
 
+def test_analyze_entities():
+    triage = Triage()
+    # Entities match anywhere (substring); the last plan listed in the ontology wins
+    assert triage.extract_entities("Tenho CASSI") == {"PLANO_SAUDE": "ID_CASSI"}
+    assert triage.extract_entities("cassi ou particular?") == {"PLANO_SAUDE": "ID_PARTICULAR"}
+    assert triage.extract_entities("policia militar") == {"PLANO_SAUDE": "ID_BM"}
+    # One pass returns both; the first intent of the ontology wins, wherever it appears
+    assert triage.analyze("resultado do orçamento, plano cassi") == ("ORCAMENTO", {"PLANO_SAUDE": "ID_CASSI"})
+    assert triage.analyze("") == (None, {})
+
+def test_fuzzy_fallback():
+    triage = Triage(vocabulary=VOCABULARY)
+    # Typos of keywords, within the edit budget for their length
+    assert triage.analyze("quero o resultdo") == ("RESULTADO", {})
+    assert triage.analyze("tenho klinmelo") == (None, {"PLANO_SAUDE": "ID_CLINMELO"})
+    assert triage.analyze("sou partcluar") == (None, {"PLANO_SAUDE": "ID_PARTICULAR"}) # 2 edits (swap) on a long word
+    # 5-letter keywords keep one edit, swaps included
+    assert triage.analyze("qual o vaolr") == ("ORCAMENTO", {})
+    assert triage.analyze("o precco") == ("ORCAMENTO", {})
+    assert triage.analyze("quero o luado") == ("RESULTADO", {})
+    assert triage.analyze("plano casis") == (None, {"PLANO_SAUDE": "ID_CASSI"})
+    # Short words, digits and phrases with a short word stay exact
+    assert triage.analyze("casa") == (None, {})
+    assert triage.analyze("a lista") == (None, {})
+    assert triage.detect_intent("2024") is None
+    # Real words are not typos: vocabulary words, and words farther than the keyword's own budget
+    assert triage.analyze("prece") == (None, {})
+    assert triage.analyze("esta calor hoje") == (None, {})
+    assert triage.analyze("recebi as cartas") == (None, {})
+    assert triage.analyze("vou mandar uma carta") == (None, {})
+    assert triage.analyze("ele esta preso") == (None, {})
+    assert triage.analyze("tem que valer") == (None, {})
+    assert triage.analyze("preciso de algo especial") == (None, {}) # 2 edits, but "especie" only tolerates 1
+    assert Triage(vocabulary=()).analyze("esta calor hoje") == ("ORCAMENTO", {}) # Without the vocabulary
+    # An exact match always wins over a fuzzy one
+    assert triage.analyze("resultdo do orcamento") == ("ORCAMENTO", {})
+
+    # Per-tenant thresholds (flow "fuzzy" settings)
+    assert triage.analyze("quero o resultdo", fuzzy={**DEFAULT_THRESHOLDS, "enabled": False}) == (None, {})
+    assert triage.analyze("klinmelo", fuzzy={**DEFAULT_THRESHOLDS, "min_length": 9}) == (None, {})
+    one_edit = {**DEFAULT_THRESHOLDS, "long_max_distance": 1}
+    assert triage.extract_entities("sou partcluar") == {"PLANO_SAUDE": "ID_PARTICULAR"}
+    assert triage.analyze("sou partcluar", fuzzy=one_edit) == (None, {})
+
+def test_vocabulary_is_built_from_the_corpus():
+    counts = {"calor": 40, "hoje": 90, "resultado": 500, "resultdo": 12, "laudo": 50, "lauda": 30,
+              "exame": 80, "raro": 9, "frio": 3, "2024": 70}
+    vocabulary = build_vocabulary(counts, {"resultado", "laudo", "exame", "pronto"}, min_count=5, typo_share=0.1)
+    # Kept: frequent non-keyword words ("lauda" is too common to be a typo of "laudo").
+    # Left out: a rare misspelling of a keyword, keywords, rare or short words, digits
+    assert vocabulary == {"calor": 40, "lauda": 30}
+
+def test_bounded_distance_and_index():
+    assert bounded_distance("cassi", "casis", 1) == 1 # One swap
+    assert bounded_distance("clinmelo", "klinmello", 2) == 2
+    assert bounded_distance("resultado", "laudo", 2) == 3 # Over the limit: limit + 1
+    index = FuzzyIndex()
+    for keyword in ("valor", "laudo", "exame pronto", "1"):
+        index.add(keyword, keyword)
+    assert [m[2] for m in index.lookup("lauda", 1)] == ["laudo"]
+    assert index.lookup("1", 1) == () and index.lookup("laudo", 1) == () # Digits and exact hits are skipped
+    assert [m[2] for m in index.search("ja esta o exame pronro", DEFAULT_THRESHOLDS)] == ["exame pronto"]
+    six = {**DEFAULT_THRESHOLDS, "min_length": 6}
+    assert index.search("ja esta o exame pronro", six) == [] # "exame" is under min_length
+    # Vocabulary words are never fuzzy, unless they are part of a keyword
+    index = FuzzyIndex(vocabulary={"calor", "exame"})
+    for keyword in ("valor", "exame pronto"):
+        index.add(keyword, keyword)
+    assert index.search("calor", DEFAULT_THRESHOLDS) == []
+    assert [m[2] for m in index.search("exame pronro", DEFAULT_THRESHOLDS)] == ["exame pronto"]
+
 if __name__ == "__main__":
     test_triage()
+    test_analyze_entities()
+    test_fuzzy_fallback()
+    test_vocabulary_is_built_from_the_corpus()
+    test_bounded_distance_and_index()
@@ -5,6 +5,7 @@ from fastapi.testclient import TestClient
 # Adjust path to import src
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
+from src.api import webhook
 from src.api.webhook import app
 
 client = TestClient(app)
@@ -49,6 +50,32 @@ def test_webhook_valid_message():
     assert response.status_code == 200
     assert response.json().get("status") == "processed"
 
+def test_results_import_requires_token(monkeypatch):
+    body = "protocolo,exame,status\n900001,Glicemia,PRONTO\n"
+    monkeypatch.setattr(webhook, "RESULTS_IMPORT_TOKEN", "")
+    assert client.post("/results/import?clientId=c1", content=body).status_code == 404 # Off when unset
+
+    monkeypatch.setattr(webhook, "RESULTS_IMPORT_TOKEN", "s3cret")
+    assert client.post("/results/import?clientId=c1", content=body).status_code == 401
+    response = client.post("/results/import?clientId=c1", content=body, headers={"X-Import-Token": "wrong"})
+    assert response.status_code == 401
+    response = client.post("/results/import?clientId=c1", content=body, headers={"X-Import-Token": "s3cret"})
+    assert response.status_code == 200
+    assert response.json()["rows"] == 1
+
+def test_evolution_webhook_replies_through_the_client(monkeypatch):
+    sent = []
+    monkeypatch.setattr(webhook, "outbox_worker", None)
+    monkeypatch.setattr(webhook.replier_service, "send_text_nowait", lambda *args: sent.append(args))
+    payload = {"event": "messages.upsert", "instance": "clinica_evo",
+               "data": {"key": {"remoteJid": "5581777@s.whatsapp.net", "id": "EVO1"},
+                        "pushName": "Ana", "message": {"conversation": "oi"}}}
+    response = client.post("/webhook/evolution", json=payload)
+    assert response.status_code == 200
+    assert response.json()["status"] == "processed"
+    assert len(sent) == 1 and sent[0][:2] == ("clinica_evo", "5581777@s.whatsapp.net")
+    assert webhook.session_manager.get_session("clinica_evo", "5581777")["status"] == "MENU_PRINCIPAL"
+
 if __name__ == "__main__":
     try:
         test_webhook_ignored_messages()
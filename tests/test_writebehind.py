@@ -0,0 +1,79 @@
+import sys
+import os
+import threading
+import time
+
+# Adjust path to import src
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from src.core import database
+from src.core.writebehind import WriteBehindBuffer
+
+def test_pending_reads_and_flush(temp_db):
+    buffer = WriteBehindBuffer(flush_ms=60_000, max_batch=100)
+    try:
+        session = {"status": "MENU_PRINCIPAL", "data": {}}
+        buffer.put("clinica_teste", "5581", session)
+        session["status"] = "MUTATED_AFTER_PUT" # Snapshot must not change
+
+        assert database.get_session("clinica_teste", "5581") is None
+        assert buffer.get("clinica_teste", "5581")["status"] == "MENU_PRINCIPAL"
+
+        assert buffer.flush() == 1
+        assert buffer.pending() == 0
+        assert database.get_session("clinica_teste", "5581")["status"] == "MENU_PRINCIPAL"
+    finally:
+        buffer.close()
+
+def test_max_batch_triggers_flush(temp_db):
+    buffer = WriteBehindBuffer(flush_ms=60_000, max_batch=3)
+    try:
+        for i in range(3):
+            buffer.put("clinica_teste", f"55810{i}", {"status": "MENU_PRINCIPAL"})
+        deadline = time.time() + 2
+        while buffer.pending() and time.time() < deadline:
+            time.sleep(0.01)
+        assert len(database.get_all_sessions("clinica_teste")) == 3
+    finally:
+        buffer.close()
+
+def test_close_flushes_pending(temp_db):
+    buffer = WriteBehindBuffer(flush_ms=60_000, max_batch=100)
+    buffer.put("clinica_teste", "5581", {"status": "AGUARDANDO_HUMANO"})
+    buffer.close()
+    assert database.get_session("clinica_teste", "5581")["status"] == "AGUARDANDO_HUMANO"
+
+def test_flush_does_not_block_puts_and_gets(temp_db):
+    buffer = WriteBehindBuffer(flush_ms=60_000, max_batch=100)
+    save_sessions, writing, release = database.save_sessions, threading.Event(), threading.Event()
+    def slow_save(batch):
+        writing.set()
+        assert release.wait(5)
+        if len(batch) == 1:
+            raise RuntimeError("disk full")
+        return save_sessions(batch)
+    database.save_sessions = slow_save
+    try:
+        buffer.put("c1", "A", {"status": "MENU_PRINCIPAL"})
+        flusher = threading.Thread(target=buffer.flush)
+        flusher.start()
+        assert writing.wait(5)
+        # The write is in progress: puts and gets go through, and the batch in flight is still readable
+        started = time.monotonic()
+        buffer.put("c1", "B", {"status": "ORCAMENTO_PEDIR_PLANO"})
+        assert buffer.get("c1", "A")["status"] == "MENU_PRINCIPAL"
+        assert buffer.is_pending("c1", "A") and buffer.pending() == 2
+        assert time.monotonic() - started < 1
+        release.set()
+        flusher.join(5)
+        # The failed batch went back to dirty, next to the newer put
+        assert buffer.pending() == 2
+        assert buffer.flush() == 2
+        assert database.get_session("c1", "A")["status"] == "MENU_PRINCIPAL"
+    finally:
+        database.save_sessions = save_sessions
+        buffer.close()
+
+if __name__ == "__main__":
+    import pytest # temp_db is a fixture (tests/conftest.py)
+    sys.exit(pytest.main([__file__, "-q"]))
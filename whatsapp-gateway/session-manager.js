@@ -5,6 +5,7 @@ const pino = require('pino');
 
 const IDLE_TIMEOUT = 10 * 60 * 1000; // 10 minutes
 const RECONNECT_DELAY = 10000;
+const WEBHOOK_MAX_ATTEMPTS = 5; // redeliveries while the webhook answers 429 (queue full)
 
 class SessionManager {
     constructor(webhookUrl) {
@@ -132,15 +133,29 @@ class SessionManager {
                 text: msg.message?.conversation || msg.message?.extendedTextMessage?.text || "",
                 fromMe: !!fromMe,
                 mediaType: Object.keys(msg.message)[0],
-                timestamp: msg.messageTimestamp
+                timestamp: msg.messageTimestamp,
+                originalMessage: { key: msg.key } // key.id lets the webhook drop redeliveries
             };
 
-            await axios.post(this.webhookUrl, payload);
+            await this.postWebhook(payload);
         } catch (e) {
             console.error(`[SESSION] [${clientId}] Webhook Error: ${e.message}`);
         }
     }
 
+    async postWebhook(payload) {
+        // The webhook deduplicates on the message key, so retrying is safe
+        for (let attempt = 1; ; attempt++) {
+            try {
+                return await axios.post(this.webhookUrl, payload);
+            } catch (e) {
+                if (e.response?.status !== 429 || attempt >= WEBHOOK_MAX_ATTEMPTS) throw e;
+                const retryAfter = Number(e.response.headers['retry-after']) || 1;
+                await new Promise(r => setTimeout(r, retryAfter * 1000 * attempt));
+            }
+        }
+    }
+
     async sendMessage(clientId, jid, text) {
         const sock = await this.getSock(clientId);
         if (!sock) throw new Error('Session not found or failed to initialize');